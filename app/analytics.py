@@ -0,0 +1,156 @@
+import argparse
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Statistiques d'une partie (GET /games/{id}/analytics) : taux de résolution par point
+# clé, temps médian entre le début de la partie et les résolutions, points clés les
+# moins résolus. Elles sont lues dans des agrégats tenus à jour à chaque écriture par
+# des déclencheurs SQLite (migration 6), jamais recalculées à partir des résolutions.
+
+# Largeur (en s) des tranches de solve_times (created_at / 60 dans la migration 6)
+SOLVE_TIME_BUCKET = 60
+# Points clés les moins résolus renvoyés par défaut
+LEAST_SOLVED = 5
+
+GAME_START = text("SELECT time_start FROM games WHERE id = :game_id")
+GAME_PLAYERS = text("SELECT players FROM game_stats WHERE game_id = :game_id")
+KEYPOINT_SOLVES = text(
+    "SELECT keypoints.id, keypoints.name, COALESCE(keypoint_stats.solves, 0) FROM keypoints"
+    " LEFT JOIN keypoint_stats ON keypoint_stats.game_id = keypoints.game_id AND keypoint_stats.keypoint_id = keypoints.id"
+    " WHERE keypoints.game_id = :game_id ORDER BY keypoints.id"
+)
+# Tranche médiane des temps de résolution de chaque point clé, choisie par la base (sans
+# rapatrier les tranches) : celle où le cumul des résolutions passe la moitié du total
+MEDIAN_BUCKETS = text(
+    "SELECT keypoint_id, minute, before, solves, total FROM ("
+    " SELECT keypoint_id, minute, solves,"
+    " SUM(solves) OVER (PARTITION BY keypoint_id ORDER BY minute) - solves AS before,"
+    " SUM(solves) OVER (PARTITION BY keypoint_id) AS total"
+    " FROM solve_times WHERE game_id = :game_id AND solves > 0"
+    ") WHERE before < total / 2.0 AND before + solves >= total / 2.0"
+)
+# Même chose pour toutes les résolutions de la partie
+MEDIAN_BUCKET = text(
+    "SELECT minute, before, solves, total FROM ("
+    " SELECT minute, solves, SUM(solves) OVER (ORDER BY minute) - solves AS before, SUM(solves) OVER () AS total"
+    " FROM (SELECT minute, SUM(solves) AS solves FROM solve_times WHERE game_id = :game_id AND solves > 0 GROUP BY minute)"
+    ") WHERE before < total / 2.0 AND before + solves >= total / 2.0"
+)
+
+# Recalcul complet depuis users et solves, pour le script de rattrapage
+REBUILD_STATS = [
+    "DELETE FROM game_stats{where}",
+    "DELETE FROM keypoint_stats{where}",
+    "DELETE FROM solve_times{where}",
+    "INSERT INTO game_stats (game_id, players) SELECT game_id, count(*) FROM users{where} GROUP BY game_id",
+    "INSERT INTO keypoint_stats (game_id, keypoint_id, solves)"
+    " SELECT game_id, keypoint_id, count(*) FROM solves{where} GROUP BY game_id, keypoint_id",
+    "INSERT INTO solve_times (game_id, keypoint_id, minute, solves)"
+    " SELECT game_id, keypoint_id, created_at / 60, count(*) FROM solves"
+    " WHERE created_at IS NOT NULL{and_where} GROUP BY game_id, keypoint_id, created_at / 60",
+]
+
+
+def read_stats(db_session: Session, game_id: str) -> Optional[dict]:
+    # Agrégats d'une partie, au format gardé dans les archives ; None si elle n'existe pas
+    parameters = {"game_id": game_id}
+    time_start = db_session.execute(GAME_START, parameters).scalar()
+    if time_start is None:
+        return None
+    median = db_session.execute(MEDIAN_BUCKET, parameters).first()
+    return {
+        "time_start": time_start,
+        "players": db_session.execute(GAME_PLAYERS, parameters).scalar() or 0,
+        # (keypoint_id, nom, résolutions)
+        "keypoints": [list(row) for row in db_session.execute(KEYPOINT_SOLVES, parameters)],
+        # Tranches médianes : ([keypoint_id,] tranche, résolutions avant, dans la tranche, horodatées)
+        "medians": [list(row) for row in db_session.execute(MEDIAN_BUCKETS, parameters)],
+        "median": list(median) if median is not None else None,
+    }
+
+
+def median_time(bucket: Optional[List[int]], time_start: int) -> Optional[int]:
+    # bucket : (tranche, résolutions avant, dans la tranche, total) ; les résolutions
+    # d'une tranche sont supposées réparties uniformément sur sa durée
+    if bucket is None:
+        return None
+    minute, before, solves, total = bucket
+    instant = (minute + (total / 2 - before) / solves) * SOLVE_TIME_BUCKET
+    # Une résolution avant le début (partie avancée depuis) compte pour 0
+    return max(0, round(instant - time_start))
+
+
+def game_analytics(game_id: str, stats: dict, least: int = LEAST_SOLVED) -> dict:
+    # Réponse de GET /games/{id}/analytics (GameAnalytics), à partir des agrégats
+    players = stats["players"]
+    time_start = stats["time_start"]
+    medians = {row[0]: row[1:] for row in stats["medians"]}
+    keypoints = [
+        {
+            "id": keypoint_id,
+            "name": name,
+            "solves": solves,
+            "solve_rate": round(solves / players, 4) if players else 0.0,
+            "median_time": median_time(medians.get(keypoint_id), time_start),
+        }
+        for keypoint_id, name, solves in stats["keypoints"]
+    ]
+    solves = sum(keypoint["solves"] for keypoint in keypoints)
+    pairs = players * len(keypoints)
+    return {
+        "game_id": game_id,
+        "players": players,
+        "solves": solves,
+        "timed_solves": stats["median"][3] if stats["median"] else 0,
+        "solve_rate": round(solves / pairs, 4) if pairs else 0.0,
+        "median_time": median_time(stats["median"], time_start),
+        "keypoints": keypoints,
+        "least_solved": sorted(keypoints, key=lambda keypoint: (keypoint["solves"], keypoint["id"]))[:least],
+    }
+
+
+def archived_stats(snapshot: dict) -> dict:
+    # Archives écrites avant les agrégats : comptes tirés des résolutions, sans temps
+    solves: Dict[int, int] = {}
+    for solve in snapshot["solves"]:
+        solves[solve[1]] = solves.get(solve[1], 0) + 1
+    return {
+        "time_start": snapshot["game"]["time_start"],
+        "players": len(snapshot["users"]),
+        "keypoints": [[row["id"], row["name"], solves.get(row["id"], 0)] for row in snapshot["keypoints"]],
+        "medians": [],
+        "median": None,
+    }
+
+
+def rebuild_stats(db_session: Session, game_id: Optional[str] = None):
+    # Recalcule les agrégats d'une partie (de toutes si game_id est None) depuis les
+    # tables users et solves, après une modification faite hors de l'application
+    if game_id is None:
+        statements = [statement.format(where="", and_where="") for statement in REBUILD_STATS]
+    else:
+        statements = [
+            statement.format(where=" WHERE game_id = :game_id", and_where=" AND game_id = :game_id")
+            for statement in REBUILD_STATS
+        ]
+    for statement in statements:
+        db_session.execute(text(statement), {"game_id": game_id})
+    db_session.commit()
+
+
+if __name__ == "__main__":
+    from database import SHARDS, session_for, shard_session
+
+    parser = argparse.ArgumentParser(description="Recalcule les statistiques des parties depuis les joueurs et les résolutions")
+    parser.add_argument("game_id", nargs="?", help="partie à recalculer (toutes par défaut)")
+    args = parser.parse_args()
+
+    sessions = [session_for(args.game_id)] if args.game_id else [shard_session(shard) for shard in range(SHARDS)]
+    for db in sessions:
+        try:
+            rebuild_stats(db, args.game_id)
+        finally:
+            db.close()
+    print("Statistiques recalculées pour %s" % ("la partie %s" % args.game_id if args.game_id else "toutes les parties"))
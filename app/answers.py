@@ -0,0 +1,52 @@
+import unicodedata
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def normalize_answer(text: str) -> str:
+    # Ignore la casse, les accents et les espaces superflus : " Rézoléo " == "rezoleo"
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+class SolutionCache:
+    # Solutions normalisées et points de chaque point clef, pour vérifier une réponse sans requête SQL
+
+    def __init__(self):
+        self._games: Dict[str, Dict[int, Tuple[str, int]]] = {}
+
+    def get(self, game_id: str, keypoint_id: int) -> Optional[Tuple[str, int]]:
+        return self._games.get(game_id, {}).get(keypoint_id)
+
+    def set(self, game_id: str, keypoint_id: int, solution: str, points: int):
+        self._games.setdefault(game_id, {})[keypoint_id] = (normalize_answer(solution), points)
+
+    def remove(self, game_id: str, keypoint_id: int):
+        self._games.get(game_id, {}).pop(keypoint_id, None)
+
+    def drop(self, game_id: str):
+        self._games.pop(game_id, None)
+
+    def check(self, game_id: str, keypoint_id: int, answer: str) -> Optional[bool]:
+        # None si le point clef n'existe pas
+        entry = self.get(game_id, keypoint_id)
+        if entry is None:
+            return None
+        return normalize_answer(answer) == entry[0]
+
+    def load(self, game_id: str, rows: Iterable[Tuple[int, str, int]]):
+        # rows : (keypoint_id, solution, points) de tous les points clefs de la partie
+        self._games[game_id] = {
+            keypoint_id: (normalize_answer(solution), points)
+            for keypoint_id, solution, points in rows
+        }
+
+    def rebuild(self, rows: Iterable[Tuple[str, int, str, int]]):
+        # rows : (game_id, keypoint_id, solution, points), lus depuis la table keypoints
+        games: Dict[str, Dict[int, Tuple[str, int]]] = {}
+        for game_id, keypoint_id, solution, points in rows:
+            games.setdefault(game_id, {})[keypoint_id] = (normalize_answer(solution), points)
+        self._games = games
+
+
+solutions = SolutionCache()
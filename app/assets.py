@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.responses import Response
+
+# Images des points clés, stockées sous le nom de leur empreinte SHA-256 : un même
+# fichier envoyé plusieurs fois n'est écrit qu'une fois.
+ASSETS_DIR = os.getenv("ASSETS_DIR", "./assets")
+ASSET_MAX_BYTES = int(os.getenv("ASSET_MAX_BYTES", str(10 * 1024 * 1024)))
+# Largeurs (en pixels) des variantes redimensionnées, générées une seule fois à l'envoi
+ASSET_VARIANTS = [int(width) for width in os.getenv("ASSET_VARIANTS", "320,1024").split(",") if width.strip()]
+# Taille des morceaux lus sur le disque quand le serveur ne sait pas faire de sendfile
+ASSET_CHUNK_SIZE = 64 * 1024
+# Les fichiers ne changent jamais pour une même URL
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Signatures des formats acceptés (le WebP est reconnu à part) : (préfixe, extension)
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+SIGNATURE_SIZE = 12
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+ASSET_NAME = re.compile(r"^(?P<sha>[0-9a-f]{64})(?:-(?P<width>\d+))?\.(?P<ext>jpg|png|gif|webp)$")
+
+
+class AssetTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+class StoredAsset(NamedTuple):
+    sha256: str
+    extension: str
+    size: int
+    # largeur -> nom de fichier de la variante
+    variants: Dict[int, str]
+
+    @property
+    def name(self) -> str:
+        return "%s.%s" % (self.sha256, self.extension)
+
+
+def detect_image(head: bytes) -> Optional[str]:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def asset_path(name: str) -> Optional[str]:
+    # None si le nom ne correspond pas à un fichier du magasin (évite tout chemin arbitraire)
+    match = ASSET_NAME.match(name)
+    if match is None:
+        return None
+    return os.path.join(ASSETS_DIR, match.group("sha")[:2], name)
+
+
+def content_type(name: str) -> str:
+    return CONTENT_TYPES[name.rsplit(".", 1)[1]]
+
+
+def _variant_name(sha256: str, width: int, extension: str) -> str:
+    return "%s-%d.%s" % (sha256, width, extension)
+
+
+def existing_variants(sha256: str, extension: str) -> Dict[int, str]:
+    variants = {}
+    for width in ASSET_VARIANTS:
+        name = _variant_name(sha256, width, extension)
+        if os.path.exists(asset_path(name)):
+            variants[width] = name
+    return variants
+
+
+def generate_variants(sha256: str, extension: str) -> Dict[int, str]:
+    # Pillow est facultatif : sans lui, seules les images d'origine sont servies
+    try:
+        from PIL import Image
+    except ImportError:
+        return {}
+    if extension == "gif":
+        # Le redimensionnement perdrait l'animation
+        return {}
+    source = asset_path("%s.%s" % (sha256, extension))
+    variants = {}
+    with Image.open(source) as image:
+        for width in sorted(ASSET_VARIANTS):
+            if width >= image.width:
+                continue
+            height = max(1, round(image.height * width / image.width))
+            name = _variant_name(sha256, width, extension)
+            temporary = asset_path(name) + ".tmp"
+            resized = image.resize((width, height), Image.LANCZOS)
+            resized.save(temporary, format=image.format)
+            os.replace(temporary, asset_path(name))
+            variants[width] = name
+    return variants
+
+
+def validate_image(path: str):
+    # Décode toute l'image : une signature correcte ne garantit pas un contenu lisible.
+    # Sans Pillow, seule la signature est vérifiée.
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    try:
+        with Image.open(path) as image:
+            image.load()
+    except Exception:
+        raise UnsupportedImage()
+
+
+async def store_asset(chunks: AsyncIterator[bytes], max_bytes: int = ASSET_MAX_BYTES) -> StoredAsset:
+    # Le corps est écrit sur le disque au fil de l'eau, en calculant son empreinte ;
+    # seul le morceau courant est en mémoire. Les écritures se font dans un thread.
+    loop = asyncio.get_event_loop()
+    temporary_dir = os.path.join(ASSETS_DIR, "tmp")
+    os.makedirs(temporary_dir, exist_ok=True)
+    temporary = os.path.join(temporary_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    # Début du fichier, gardé jusqu'à pouvoir reconnaître le format
+    head = b""
+    output = open(temporary, "wb")
+    try:
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise AssetTooLarge()
+                if len(head) < SIGNATURE_SIZE:
+                    head += chunk[:SIGNATURE_SIZE]
+                    if len(head) >= SIGNATURE_SIZE and detect_image(head) is None:
+                        raise UnsupportedImage()
+                digest.update(chunk)
+                await loop.run_in_executor(None, output.write, chunk)
+        finally:
+            output.close()
+        extension = detect_image(head)
+        if extension is None:
+            raise UnsupportedImage()
+
+        sha256 = digest.hexdigest()
+        final = asset_path("%s.%s" % (sha256, extension))
+        if os.path.exists(final):
+            # Déjà stocké : variantes comprises
+            os.remove(temporary)
+            return StoredAsset(sha256, extension, size, existing_variants(sha256, extension))
+        # Validée avant d'entrer dans le magasin : un fichier corrompu n'y est jamais servi
+        await loop.run_in_executor(None, validate_image, temporary)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(temporary, final)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    variants = await loop.run_in_executor(None, generate_variants, sha256, extension)
+    return StoredAsset(sha256, extension, size, variants)
+
+
+def parse_range(header: Optional[str], size: int) -> Tuple[Optional[Tuple[int, int]], bool]:
+    # Renvoie ((début, fin incluse) ou None pour tout le fichier, satisfiable).
+    # Seules les plages simples sont gérées ; les autres sont ignorées (réponse 200).
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None, True
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start == "":
+            # bytes=-N : les N derniers octets
+            length = int(end)
+            if length <= 0:
+                return None, False
+            return (max(0, size - length), size - 1), size > 0
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None, True
+    if first >= size or last < first:
+        return None, False
+    return (first, min(last, size - 1)), True
+
+
+class AssetResponse(Response):
+    # Réponse pour un fichier du magasin : plages (206/416), ETag et, si le serveur
+    # propose l'extension http.response.zerocopysend, envoi sans copie. Le fichier
+    # n'est jamais chargé en entier en mémoire (FileResponse demande aiofiles et
+    # ignore l'en-tête Range).
+
+    def __init__(self, path: str, name: str, headers: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.name = name
+        self.extra_headers = headers or {}
+        self.background = None
+
+    def _headers(self, status: int, size: int, content_range: Optional[str], length: int) -> List[Tuple[bytes, bytes]]:
+        headers = {
+            "accept-ranges": "bytes",
+            "cache-control": ASSET_CACHE_CONTROL,
+            "etag": '"%s"' % self.name,
+        }
+        if status != 304:
+            headers["content-type"] = content_type(self.name)
+            headers["content-length"] = str(length)
+        if content_range:
+            headers["content-range"] = content_range
+        headers.update(self.extra_headers)
+        return [(key.encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()]
+
+    async def __call__(self, scope, receive, send):
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        size = os.stat(self.path).st_size
+
+        if request_headers.get("if-none-match") in ('"%s"' % self.name, "*"):
+            await send({"type": "http.response.start", "status": 304, "headers": self._headers(304, size, None, 0)})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        byte_range, satisfiable = parse_range(request_headers.get("range"), size)
+        if not satisfiable:
+            headers = self._headers(416, size, "bytes */%d" % size, 0)
+            await send({"type": "http.response.start", "status": 416, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if byte_range is None:
+            status, offset, count, content_range = 200, 0, size, None
+        else:
+            first, last = byte_range
+            status, offset, count = 206, first, last - first + 1
+            content_range = "bytes %d-%d/%d" % (first, last, size)
+
+        await send({"type": "http.response.start", "status": status, "headers": self._headers(status, size, content_range, count)})
+        if scope["method"] == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb") as file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": offset,
+                    "count": count,
+                    "more_body": False,
+                })
+                return
+            loop = asyncio.get_event_loop()
+            remaining = count
+            while remaining > 0:
+                chunk = await loop.run_in_executor(None, os.pread, file.fileno(), min(ASSET_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # Fichier tronqué entre stat() et la lecture : on termine la réponse
+                await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,143 @@
+import gzip
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Boolean, Integer, String, and_, column, select, table, text
+from sqlalchemy.orm import Session
+
+from models import GameDB, KeypointDB, SolveDB, UserDB
+from serializers import dumps
+
+# Paquet hors-ligne d'une partie : tout son contenu en un seul document compressé,
+# ou seulement ce qui a changé depuis une version donnée. La version est celle du
+# journal des modifications (table changes, tenue par des déclencheurs SQLite) :
+# elle ne fait qu'augmenter, d'un démarrage du serveur à l'autre.
+
+# Niveau de compression : le paquet est compressé une fois par version, puis servi tel quel
+BUNDLE_COMPRESSION_LEVEL = 6
+
+KEYPOINT_COLUMNS = [table_column for table_column in KeypointDB.__table__.columns if table_column.name != "game_id"]
+USER_COLUMNS = [table_column for table_column in UserDB.__table__.columns if table_column.name != "game_id"]
+GAME_COLUMNS = list(GameDB.__table__.columns)
+
+# Tables tenues par les déclencheurs (migration 4), sans modèle ORM
+changes = table(
+    "changes",
+    column("game_id", String),
+    column("entity", String),
+    column("entity_id", Integer),
+    column("related_id", Integer),
+    column("seq", Integer),
+    column("deleted", Boolean),
+)
+CURRENT_VERSION = text("SELECT seq FROM change_versions WHERE game_id = :game_id")
+
+
+def current_version(db_session: Session, game_id: str) -> Optional[int]:
+    # None si la partie n'existe pas
+    return db_session.execute(CURRENT_VERSION, {"game_id": game_id}).scalar()
+
+
+def _rows(db_session: Session, columns, where) -> List[dict]:
+    return [dict(row) for row in db_session.execute(select(columns).where(where))]
+
+
+def empty_bundle(version: int, since: Optional[int]) -> dict:
+    return {
+        "version": version,
+        "since": since,
+        "full": since is None,
+        "game": None,
+        "keypoints": [],
+        "users": [],
+        "solves": [],
+        "deleted": {"keypoints": [], "users": [], "solves": []},
+    }
+
+
+def build_bundle(db_session: Session, game_id: str) -> Optional[dict]:
+    # La version est lue avant le contenu : une écriture concurrente figure au pire
+    # dans le paquet et dans le prochain delta, jamais dans aucun des deux.
+    version = current_version(db_session, game_id)
+    if version is None:
+        return None
+    bundle = empty_bundle(version, None)
+    game = db_session.execute(select(GAME_COLUMNS).where(GameDB.id == game_id)).first()
+    if game is None:
+        return None
+    bundle["game"] = dict(game)
+    bundle["keypoints"] = _rows(db_session, KEYPOINT_COLUMNS, KeypointDB.game_id == game_id)
+    bundle["users"] = _rows(db_session, USER_COLUMNS, UserDB.game_id == game_id)
+    bundle["solves"] = [list(row) for row in db_session.execute(
+        select([SolveDB.user_id, SolveDB.keypoint_id]).where(SolveDB.game_id == game_id)
+    )]
+    return bundle
+
+
+def _changed(game_id: str, since: int, entity: str):
+    return and_(
+        changes.c.game_id == game_id,
+        changes.c.seq > since,
+        changes.c.entity == entity,
+        changes.c.deleted.is_(False),
+    )
+
+
+def build_delta(db_session: Session, game_id: str, since: int) -> Optional[dict]:
+    # Entités ajoutées, modifiées ou supprimées après la version since, lues par
+    # jointure avec le journal (pas de liste d'ids en paramètre, quelle que soit
+    # la durée de la déconnexion). Une version inconnue (plus récente que la partie,
+    # base restaurée...) renvoie le paquet complet.
+    version = current_version(db_session, game_id)
+    if version is None:
+        return None
+    if since > version:
+        return build_bundle(db_session, game_id)
+    delta = empty_bundle(version, since)
+    if since == version:
+        return delta
+
+    keypoints, users, solves = KeypointDB.__table__, UserDB.__table__, SolveDB.__table__
+    deleted = delta["deleted"]
+    for entity, entity_id, related_id in db_session.execute(
+            select([changes.c.entity, changes.c.entity_id, changes.c.related_id]).where(and_(
+                changes.c.game_id == game_id, changes.c.seq > since, changes.c.deleted.is_(True)))):
+        if entity == "solve":
+            deleted["solves"].append([entity_id, related_id])
+        else:
+            deleted[entity + "s"].append(entity_id)
+
+    if db_session.execute(select([changes.c.seq]).where(_changed(game_id, since, "game"))).first() is not None:
+        delta["game"] = dict(db_session.execute(select(GAME_COLUMNS).where(GameDB.id == game_id)).first())
+    delta["keypoints"] = [dict(row) for row in db_session.execute(
+        select(KEYPOINT_COLUMNS)
+        .select_from(keypoints.join(changes, changes.c.entity_id == keypoints.c.id))
+        .where(and_(_changed(game_id, since, "keypoint"), keypoints.c.game_id == game_id))
+    )]
+    delta["users"] = [dict(row) for row in db_session.execute(
+        select(USER_COLUMNS)
+        .select_from(users.join(changes, changes.c.entity_id == users.c.id))
+        .where(and_(_changed(game_id, since, "user"), users.c.game_id == game_id))
+    )]
+    # Une résolution ne change pas : seule sa clé est renvoyée, si elle existe encore
+    delta["solves"] = [list(row) for row in db_session.execute(
+        select([solves.c.user_id, solves.c.keypoint_id])
+        .select_from(solves.join(changes, and_(
+            changes.c.entity_id == solves.c.user_id,
+            changes.c.related_id == solves.c.keypoint_id,
+            changes.c.game_id == solves.c.game_id,
+        )))
+        .where(_changed(game_id, since, "solve"))
+    )]
+    return delta
+
+
+def compress(content: dict) -> bytes:
+    return gzip.compress(dumps(content), BUNDLE_COMPRESSION_LEVEL)
+
+
+def build_compressed(db_session: Session, game_id: str, since: Optional[int] = None) -> Optional[Tuple[bytes, int]]:
+    # Paquet (ou delta) déjà compressé et sa version ; appelé dans un thread de run_db
+    content = build_bundle(db_session, game_id) if since is None else build_delta(db_session, game_id, since)
+    if content is None:
+        return None
+    return compress(content), content["version"]
@@ -0,0 +1,115 @@
+import os
+import uuid
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple, Union
+
+# Taille maximale (en octets) des réponses gardées en cache
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+
+class GameVersions:
+    # Compteur de version par partie, incrémenté à chaque écriture sur la partie.
+    # Avec plusieurs workers (coherence.py), la version est le couple (numéro de la
+    # dernière modification lue dans le fil commun, écritures locales pas encore relues) :
+    # tant qu'un worker n'a pas d'écriture en attente, son ETag est celui des autres.
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        # Distingue les ETags d'un démarrage à l'autre, les compteurs repartant de 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self.shared_epoch: Optional[str] = None
+        self._shared: Dict[str, int] = {}
+        # Numéro de la dernière écriture locale de chaque partie
+        self._writes = 0
+        self._written: Dict[str, int] = {}
+
+    def get(self, game_id: str) -> Union[int, Tuple[int, int]]:
+        if self.shared_epoch is None:
+            return self._versions.get(game_id, 0)
+        return self._shared.get(game_id, 0), self._versions.get(game_id, 0)
+
+    def bump(self, game_id: str) -> int:
+        version = self._versions[game_id] = self._versions.get(game_id, 0) + 1
+        if self.shared_epoch is not None:
+            self._writes += 1
+            self._written[game_id] = self._writes
+        return version
+
+    def share(self, epoch: str):
+        # Passe aux versions du fil commun (epoch : celui des bases)
+        self.shared_epoch = epoch
+
+    def mark(self) -> int:
+        # À lire avant d'interroger le fil : les écritures locales antérieures y figurent
+        return self._writes
+
+    def sync(self, game_id: str, feed: int, mark: int):
+        self._shared[game_id] = feed
+        if self._written.get(game_id, 0) <= mark:
+            self._versions.pop(game_id, None)
+            self._written.pop(game_id, None)
+
+    def etag(self, game_id: str, version: Union[int, Tuple[int, int], None] = None) -> str:
+        if version is None:
+            version = self.get(game_id)
+        if self.shared_epoch is None:
+            return 'W/"%s-%s-%d"' % (game_id, self.epoch, version)
+        feed, local = version
+        if local:
+            return 'W/"%s-%s-%d-%s.%d"' % (game_id, self.shared_epoch, feed, self.epoch, local)
+        return 'W/"%s-%s-%d"' % (game_id, self.shared_epoch, feed)
+
+
+class ResponseCache:
+    # Cache LRU de corps de réponse déjà sérialisés (avec leurs en-têtes propres), borné en mémoire
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, Dict[str, str]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: Hashable, body: bytes, headers: Optional[Dict[str, str]] = None):
+        if len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous[0])
+        self._entries[key] = (body, headers or {})
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+game_versions = GameVersions()
+response_cache = ResponseCache()
@@ -0,0 +1,323 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+import uuid
+import zlib
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from answers import solutions
+from bundle import build_bundle, build_delta
+from cache import game_versions
+from database import SHARDS, run_db, shard_for, shard_session
+from events import broadcaster
+from leaderboard import leaderboards
+from lifecycle import game_archive, game_lifecycle
+from spatial import spatial_indexes
+
+# Plusieurs workers (uvicorn --workers) sur les mêmes bases : chacun garde ses caches
+# en mémoire (versions, réponses, classements, index, solutions) et les remet à jour
+# en lisant le fil des modifications de chaque base (migration 5), tenu par des
+# déclencheurs SQLite. Les évènements publiés par un worker sont relayés aux abonnés
+# des autres par la table game_events. Aucun service externe n'est nécessaire.
+WORKERS = int(os.getenv("WORKERS", "1"))
+# "off" : un seul processus ; "eventual" : le fil est relu toutes les COHERENCE_INTERVAL s ;
+# "strict" : il l'est aussi avant chaque requête sur une partie (lecture de ses écritures
+# quel que soit le worker qui répond, au prix d'une requête SQL légère par requête).
+COHERENCE = os.getenv("COHERENCE", "off" if WORKERS <= 1 else "eventual")
+COHERENCE_INTERVAL = float(os.getenv("COHERENCE_INTERVAL", "0.05"))
+# Durée (en s) pendant laquelle les évènements relayés restent dans la base
+COHERENCE_EVENTS_TTL = int(os.getenv("COHERENCE_EVENTS_TTL", "60"))
+# Verrou du worker élu pour les tâches uniques (archivage, purge des évènements)
+COHERENCE_LOCK = os.getenv("COHERENCE_LOCK", "./arriddle.lock")
+
+FEED_STATE = text("SELECT value, epoch FROM feed_counter")
+FEED_VALUE = text("SELECT value FROM feed_counter")
+ALL_GAMES = text(
+    "SELECT game_feed.game_id, game_feed.feed, change_versions.seq FROM game_feed"
+    " JOIN change_versions ON change_versions.game_id = game_feed.game_id"
+)
+CHANGED_GAMES = text(
+    "SELECT game_feed.game_id, game_feed.feed, change_versions.seq FROM game_feed"
+    " LEFT JOIN change_versions ON change_versions.game_id = game_feed.game_id"
+    " WHERE game_feed.feed > :cursor ORDER BY game_feed.feed"
+)
+LAST_EVENT = text("SELECT max(id) FROM game_events")
+NEW_EVENTS = text("SELECT id, game_id, origin, payload, key FROM game_events WHERE id > :cursor ORDER BY id")
+INSERT_EVENT = text(
+    "INSERT INTO game_events (game_id, origin, payload, key, created_at)"
+    " VALUES (:game_id, :origin, :payload, :key, :created_at)"
+)
+PRUNE_EVENTS = text("DELETE FROM game_events WHERE created_at < :before")
+
+# Fichiers verrouillés par ce processus, gardés ouverts jusqu'à son arrêt
+_locks = []
+
+
+def try_lock(path: str):
+    # Verrou exclusif non bloquant, libéré par le système à l'arrêt du processus
+    handle = open(path, "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def claim_worker_path(path: str, slots: int = 1024) -> str:
+    # Fichier propre au worker (journal des résolutions) : le premier emplacement libre,
+    # repris après un redémarrage par le nouveau worker, qui rejoue ce qu'il contient
+    for slot in range(slots):
+        handle = try_lock("%s.%d.lock" % (path, slot))
+        if handle is not None:
+            _locks.append(handle)
+            return "%s.%d" % (path, slot)
+    raise RuntimeError("Aucun emplacement libre pour %s" % path)
+
+
+def _event_key(key: Optional[str]) -> Optional[Hashable]:
+    # Clés de regroupement : tuples, encodés en listes JSON
+    if key is None:
+        return None
+    value = json.loads(key)
+    return tuple(value) if isinstance(value, list) else value
+
+
+class ChangeFeed:
+
+    def __init__(self, interval: float = COHERENCE_INTERVAL, lock_path: str = COHERENCE_LOCK):
+        self.interval = interval
+        self.lock_path = lock_path
+        self.worker = uuid.uuid4().hex[:8]
+        self.leader = False
+        self.on_leader: List[Callable] = []
+        self.relayed = 0
+        self.received = 0
+        # Par base : dernier numéro du fil et dernier évènement lus
+        self._cursors: Dict[int, int] = {}
+        self._event_cursors: Dict[int, int] = {}
+        # Version (journal des modifications) des caches de chaque partie
+        self._synced: Dict[str, int] = {}
+        self._outbox: List[dict] = []
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._syncs: Dict[int, int] = {}
+        self._lock = None
+        self._pruned = 0.0
+        self._task = None
+
+    # ---- démarrage
+
+    def _read_state(self, shard: int) -> Tuple[int, str, list, int]:
+        db_session = shard_session(shard)
+        try:
+            value, epoch = db_session.execute(FEED_STATE).first()
+            games = db_session.execute(ALL_GAMES).fetchall()
+            last_event = db_session.execute(LAST_EVENT).scalar() or 0
+            return value, epoch, games, last_event
+        finally:
+            db_session.close()
+
+    async def open(self):
+        # Avant le chargement des caches : ce qui est écrit pendant ce chargement
+        # sera relu au premier passage, et réappliqué sans effet s'il y figure déjà
+        states = await asyncio.gather(*(run_db(self._read_state, shard) for shard in range(SHARDS)))
+        epochs = "".join(epoch for _, epoch, _, _ in states)
+        game_versions.share(epochs if SHARDS == 1 else "%08x" % zlib.crc32(epochs.encode("ascii")))
+        mark = game_versions.mark()
+        for shard, (value, _, games, last_event) in enumerate(states):
+            self._cursors[shard] = value
+            self._event_cursors[shard] = last_event
+            self._locks[shard] = asyncio.Lock()
+            self._syncs[shard] = 0
+            for game_id, feed, seq in games:
+                game_versions.sync(game_id, feed, mark)
+                self._synced[game_id] = seq
+        broadcaster.relay = self.relay
+
+    async def start(self):
+        await self._elect()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._flush_outbox()
+        broadcaster.relay = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+            self.leader = False
+
+    async def _elect(self):
+        # Un seul worker à la fois tient le verrou ; les autres retentent à chaque passage
+        if self.leader:
+            return
+        self._lock = try_lock(self.lock_path)
+        if self._lock is None:
+            return
+        self.leader = True
+        for callback in self.on_leader:
+            await callback()
+
+    # ---- évènements
+
+    def relay(self, game_id: str, payload: str, key: Optional[Hashable]):
+        self._outbox.append({
+            "game_id": game_id,
+            "origin": self.worker,
+            "payload": payload,
+            "key": None if key is None else json.dumps(key),
+            "created_at": int(time.time()),
+        })
+
+    def _write_events(self, shard: int, rows: List[dict]):
+        db_session = shard_session(shard)
+        try:
+            db_session.execute(INSERT_EVENT, rows)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    async def _flush_outbox(self):
+        if not self._outbox:
+            return
+        outbox, self._outbox = self._outbox, []
+        by_shard: Dict[int, List[dict]] = {}
+        for row in outbox:
+            by_shard.setdefault(shard_for(row["game_id"]), []).append(row)
+        shards = list(by_shard)
+        results = await asyncio.gather(
+            *(run_db(self._write_events, shard, by_shard[shard]) for shard in shards), return_exceptions=True
+        )
+        for shard, result in zip(shards, results):
+            if isinstance(result, Exception):
+                # Remis en tête de file, dans l'ordre, pour le prochain passage
+                self._outbox[:0] = by_shard[shard]
+                print("Relais des évènements de la base %d en échec, nouvel essai :" % shard, result)
+            else:
+                self.relayed += len(by_shard[shard])
+
+    def _prune_events(self, shard: int, before: int):
+        db_session = shard_session(shard)
+        try:
+            db_session.execute(PRUNE_EVENTS, {"before": before})
+            db_session.commit()
+        finally:
+            db_session.close()
+
+    # ---- relecture du fil
+
+    def _read_changes(self, shard: int, cursor: int, event_cursor: int) -> Tuple[list, list]:
+        # Évènements lus avant le fil : les écritures qu'ils annoncent y figurent déjà,
+        # et les caches sont à jour quand les abonnés les reçoivent
+        db_session = shard_session(shard)
+        try:
+            events = db_session.execute(NEW_EVENTS, {"cursor": event_cursor}).fetchall()
+            games = []
+            if db_session.execute(FEED_VALUE).scalar() > cursor:
+                for game_id, feed, seq in db_session.execute(CHANGED_GAMES, {"cursor": cursor}).fetchall():
+                    delta = None
+                    if seq is not None:
+                        since = self._synced.get(game_id)
+                        if since is None:
+                            delta = build_bundle(db_session, game_id)
+                        else:
+                            delta = build_delta(db_session, game_id, since)
+                    games.append((game_id, feed, delta))
+            return events, games
+        finally:
+            db_session.close()
+
+    def _apply(self, game_id: str, delta: Optional[dict]):
+        if delta is None:
+            # Partie supprimée, ou archivée par un autre worker
+            self._synced.pop(game_id, None)
+            leaderboards.drop(game_id)
+            spatial_indexes.drop(game_id)
+            solutions.drop(game_id)
+            game_lifecycle.cancel(game_id)
+            if os.path.exists(game_archive.path(game_id)):
+                game_archive.add(game_id)
+            return
+        if delta["full"]:
+            leaderboards.load(game_id, [(user["id"], user["name"], user["points"]) for user in delta["users"]])
+            spatial_indexes.load(game_id, [
+                (keypoint["id"], keypoint["latitude"], keypoint["longitude"]) for keypoint in delta["keypoints"]
+            ])
+            solutions.load(game_id, [
+                (keypoint["id"], keypoint["solution"], keypoint["points"]) for keypoint in delta["keypoints"]
+            ])
+        else:
+            for keypoint in delta["keypoints"]:
+                spatial_indexes.upsert(game_id, keypoint["id"], keypoint["latitude"], keypoint["longitude"])
+                solutions.set(game_id, keypoint["id"], keypoint["solution"], keypoint["points"])
+            for user in delta["users"]:
+                leaderboards.update(game_id, user["id"], user["name"], user["points"])
+            for keypoint_id in delta["deleted"]["keypoints"]:
+                spatial_indexes.remove(game_id, keypoint_id)
+                solutions.remove(game_id, keypoint_id)
+            for user_id in delta["deleted"]["users"]:
+                leaderboards.remove(game_id, user_id)
+        if delta["game"] is not None:
+            game_lifecycle.schedule(game_id, delta["game"]["time_start"], delta["game"]["duration"])
+        self._synced[game_id] = delta["version"]
+
+    async def sync(self, shard: int):
+        # Une relecture commencée après l'arrivée de la requête voit toutes les écritures
+        # validées avant elle : les requêtes qui attendaient le verrou s'en contentent.
+        ticket = self._syncs[shard]
+        async with self._locks[shard]:
+            if self._syncs[shard] > ticket:
+                return
+            self._syncs[shard] += 1
+            mark = game_versions.mark()
+            events, games = await run_db(self._read_changes, shard, self._cursors[shard], self._event_cursors[shard])
+            for game_id, feed, delta in games:
+                self._apply(game_id, delta)
+                game_versions.sync(game_id, feed, mark)
+                self._cursors[shard] = max(self._cursors[shard], feed)
+            for event_id, game_id, origin, payload, key in events:
+                self._event_cursors[shard] = event_id
+                if origin != self.worker:
+                    broadcaster.deliver(game_id, payload, _event_key(key))
+                    self.received += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._flush_outbox()
+                for shard in range(SHARDS):
+                    await self.sync(shard)
+                await self._elect()
+                if self.leader and time.time() - self._pruned > COHERENCE_EVENTS_TTL / 2:
+                    self._pruned = time.time()
+                    for shard in range(SHARDS):
+                        await run_db(self._prune_events, shard, int(self._pruned) - COHERENCE_EVENTS_TTL)
+            except Exception as error:
+                print("Relecture du fil des modifications en échec, nouvel essai :", error)
+
+
+class CoherenceMiddleware:
+    # Mode strict : avant toute requête sur une partie, le fil de sa base est relu.
+    # Middleware ASGI « pur », comme MetricsMiddleware.
+
+    def __init__(self, app, feed: ChangeFeed):
+        self.app = app
+        self.feed = feed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            parts = scope["path"].split("/", 3)
+            # /games/{game_id}... ; la liste des parties est toujours lue dans la base
+            if len(parts) > 2 and parts[1] == "games" and parts[2] not in ("", "bulk", "import"):
+                await self.feed.sync(shard_for(parts[2]))
+        await self.app(scope, receive, send)
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,145 @@
+import asyncio
+import gzip
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Compression négociée des réponses (Accept-Encoding) : brotli si le module est
+# installé et accepté par le client, sinon gzip. Les réponses versionnées d'une partie
+# sont compressées une fois par version et gardées dans le cache de réponses
+# (versioned_response) ; les autres le sont à la volée par CompressionMiddleware.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") not in ("0", "false", "no")
+# Taille (en octets) en dessous de laquelle une réponse est envoyée telle quelle
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Niveaux de compression : gzip de 1 à 9, brotli de 0 à 11
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Au-delà de cette taille, la compression est faite hors de la boucle d'évènements
+COMPRESSION_THREAD_SIZE = 64 * 1024
+
+# Par ordre de préférence à qualité (q) égale
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Réponses jamais compressées à la volée : flux d'évènements, contenus déjà compressés
+SKIPPED_TYPES = ("text/event-stream", "image/", "application/gzip")
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    # Meilleur encodage accepté par le client (None : réponse non compressée)
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, parameters = item.strip().partition(";")
+        weight = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                weight = float(parameter[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL)
+
+
+async def compress_async(body: bytes, encoding: str) -> bytes:
+    # zlib et brotli relâchent le GIL : un gros corps est compressé dans un thread
+    if len(body) < COMPRESSION_THREAD_SIZE:
+        return compress(body, encoding)
+    return await asyncio.get_event_loop().run_in_executor(None, compress, body, encoding)
+
+
+class CompressionStats:
+    # Octets avant et après compression, par encodage, pour GET /metrics
+
+    def __init__(self):
+        self.bytes_in: Dict[str, int] = {}
+        self.bytes_out: Dict[str, int] = {}
+
+    def record(self, encoding: str, size_in: int, size_out: int):
+        self.bytes_in[encoding] = self.bytes_in.get(encoding, 0) + size_in
+        self.bytes_out[encoding] = self.bytes_out.get(encoding, 0) + size_out
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    # Middleware ASGI « pur », comme MetricsMiddleware. Seules les réponses envoyées en
+    # un seul morceau sont compressées : les flux (SSE, export NDJSON) passent tels quels,
+    # comme celles qui ont déjà un Content-Encoding (paquet hors-ligne, réponses versionnées).
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: List[dict] = []
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                if _compressible(message["headers"]):
+                    # Retenu jusqu'au corps : la taille et l'encodage n'y sont pas encore connus
+                    start.append(message)
+                    return
+            elif message["type"] == "http.response.body" and start:
+                response_start = start.pop()
+                body = message.get("body", b"")
+                if message.get("more_body", False) or len(body) < self.min_size:
+                    await send(response_start)
+                else:
+                    compressed = await compress_async(body, encoding)
+                    compression_stats.record(encoding, len(body), len(compressed))
+                    response_start["headers"] = _compressed_headers(response_start["headers"], encoding, len(compressed))
+                    await send(response_start)
+                    message = dict(message, body=compressed)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _compressible(headers: List[Tuple[bytes, bytes]]) -> bool:
+    for name, value in headers:
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type" and value.decode("latin-1").startswith(SKIPPED_TYPES):
+            return False
+    return True
+
+
+def _compressed_headers(headers: List[Tuple[bytes, bytes]], encoding: str, length: int) -> List[Tuple[bytes, bytes]]:
+    vary = [value for name, value in headers if name == b"vary"]
+    headers = [(name, value) for name, value in headers if name not in (b"content-length", b"vary")]
+    headers.append((b"content-length", str(length).encode("latin-1")))
+    headers.append((b"content-encoding", encoding.encode("latin-1")))
+    headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+    return headers
@@ -0,0 +1,172 @@
+import asyncio
+import functools
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///./database_arriddle.db")
+# Nombre de bases entre lesquelles les parties sont réparties (selon leur id) : une
+# partie très active ne bloque plus les écritures des parties des autres bases.
+SHARDS = int(os.getenv("SHARDS", "1"))
+
+# Taille du pool de connexions partagé par toutes les requêtes
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Temps (en ms) pendant lequel SQLite attend que le verrou d'écriture se libère
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+# Nombre de threads dédiés aux appels à la base : jamais plus que de connexions disponibles
+DB_THREADS = int(os.getenv("DB_THREADS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
+
+def _is_sqlite(uri: str) -> bool:
+    return uri.startswith("sqlite")
+
+
+def _create_engine(uri: str):
+    if not _is_sqlite(uri):
+        return create_engine(
+            uri,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_pre_ping=True,
+        )
+
+    # Par défaut SQLAlchemy n'utilise pas de pool pour un fichier SQLite :
+    # on en configure un pour ne pas rouvrir le fichier à chaque requête.
+    new_engine = create_engine(
+        uri,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000},
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL : les lectures ne sont plus bloquées par l'écriture en cours
+        cursor = dbapi_connection.cursor()
+        if ":memory:" not in uri:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=%d" % SQLITE_BUSY_TIMEOUT)
+        # Désactivées par défaut dans SQLite : les résolutions sont supprimées en cascade
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return new_engine
+
+
+def shard_uri(shard: int) -> str:
+    # Base 0 : DATABASE_URL ; base n : DATABASE_URL_<n>, ou à défaut le même fichier
+    # SQLite suffixé (database_arriddle.db -> database_arriddle.1.db)
+    if shard == 0:
+        return SQLALCHEMY_DATABASE_URI
+    uri = os.getenv("DATABASE_URL_%d" % shard)
+    if uri:
+        return uri
+    if not _is_sqlite(SQLALCHEMY_DATABASE_URI) or ":memory:" in SQLALCHEMY_DATABASE_URI:
+        raise RuntimeError("DATABASE_URL_%d manquant pour SHARDS=%d" % (shard, SHARDS))
+    root, extension = os.path.splitext(SQLALCHEMY_DATABASE_URI)
+    return "%s.%d%s" % (root, shard, extension)
+
+
+def shard_for(game_id: str) -> int:
+    # Hachage stable d'un processus à l'autre (contrairement à hash())
+    if SHARDS == 1:
+        return 0
+    return zlib.crc32(game_id.encode("utf-8")) % SHARDS
+
+
+# Les moteurs ne sont créés qu'à la première utilisation (hook de démarrage ou commande),
+# pas à l'import : importer l'application n'ouvre pas la base.
+engines: Dict[int, Engine] = {}
+# Base 0 : la seule sans répartition, et celle des commandes qui ne visent pas une partie
+engine = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+shard_sessions: Dict[int, sessionmaker] = {0: SessionLocal}
+
+
+def get_engine(shard: int = 0):
+    # Toute base peut être ouverte, y compris au-delà de SHARDS (rééquilibrage après une réduction)
+    global engine
+    if shard not in engines:
+        engines[shard] = _create_engine(shard_uri(shard))
+        shard_sessions.setdefault(shard, sessionmaker(autocommit=False, autoflush=False)).configure(bind=engines[shard])
+        if shard == 0:
+            engine = engines[0]
+    return engines[shard]
+
+
+def get_engines() -> list:
+    return [get_engine(shard) for shard in range(SHARDS)]
+
+
+def dispose_engine():
+    global engine
+    for shard_engine in engines.values():
+        shard_engine.dispose()
+    engines.clear()
+    engine = None
+
+
+def shard_session(shard: int) -> Session:
+    get_engine(shard)
+    return shard_sessions[shard]()
+
+
+def session_for(game_id: str) -> Session:
+    # Session sur la base qui contient la partie
+    return shard_session(shard_for(game_id))
+
+
+def pool_stats() -> Dict[str, int]:
+    # État des pools de connexions, additionné sur toutes les bases (vide tant qu'aucune n'est ouverte)
+    stats: Dict[str, int] = {}
+    for shard_engine in engines.values():
+        pool = shard_engine.pool
+        if not isinstance(pool, QueuePool):
+            continue
+        for state, value in (
+                ("size", pool.size()),
+                ("checked_in", pool.checkedin()),
+                ("checked_out", pool.checkedout()),
+                ("overflow", max(0, pool.overflow()))):
+            stats[state] = stats.get(state, 0) + value
+    return stats
+
+
+# Dependency : une session par requête, rendue au pool à la fin
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Dependency des routes d'une partie : la session est ouverte sur la base de la partie
+def get_game_db(game_id: str):
+    db = session_for(game_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Les requêtes SQLAlchemy sont bloquantes : on les exécute dans un pool de threads
+# borné pour ne pas bloquer la boucle d'évènements d'uvicorn.
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+# Nombre maximal d'évènements en attente pour un client avant d'écraser les plus anciens
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+
+
+class Subscription:
+    # File bornée d'un client : un client lent ne bloque jamais la diffusion
+
+    def __init__(self, game_id: str, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.game_id = game_id
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.closed = False
+        # Chaque entrée est [clé de regroupement, message JSON]
+        self._events: Deque[List] = deque()
+        self._pending: Dict[Hashable, List] = {}
+        self._ready = asyncio.Event()
+
+    def push(self, payload: str, key: Optional[Hashable] = None):
+        if self.closed:
+            return
+        # Un évènement déjà en attente avec la même clé est remplacé par le plus récent
+        if key is not None and key in self._pending:
+            self._pending[key][1] = payload
+            return
+        if len(self._events) >= self.maxsize:
+            oldest_key, _ = self._events.popleft()
+            self._pending.pop(oldest_key, None)
+            self.dropped += 1
+        entry = [key, payload]
+        self._events.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        self._ready.set()
+
+    async def get(self) -> Optional[str]:
+        # Renvoie None une fois l'abonnement fermé
+        while not self._events and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        if self.closed:
+            return None
+        if self.dropped:
+            # Le client est prévenu qu'il a raté des évènements et doit se resynchroniser
+            dropped, self.dropped = self.dropped, 0
+            return json.dumps({"type": "overflow", "game_id": self.game_id, "data": {"dropped": dropped}})
+        key, payload = self._events.popleft()
+        if key is not None:
+            self._pending.pop(key, None)
+        return payload
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class Broadcaster:
+    # Diffusion en mémoire des évènements d'une partie à tous ses abonnés
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        # Avec plusieurs workers : transmet aussi l'évènement aux autres (coherence.py)
+        self.relay: Optional[Callable[[str, str, Optional[Hashable]], None]] = None
+
+    def subscribe(self, game_id: str) -> Subscription:
+        subscription = Subscription(game_id)
+        self._subscribers.setdefault(game_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        subscribers = self._subscribers.get(subscription.game_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.game_id]
+
+    def count(self, game_id: str) -> int:
+        return len(self._subscribers.get(game_id, ()))
+
+    def publish(self, game_id: str, event_type: str, data: Any, key: Optional[Hashable] = None):
+        if game_id not in self._subscribers and self.relay is None:
+            return
+        # Sérialisé une seule fois, quel que soit le nombre d'abonnés
+        payload = json.dumps({"type": event_type, "game_id": game_id, "data": data})
+        if self.relay is not None:
+            self.relay(game_id, payload, key)
+        self.deliver(game_id, payload, key)
+
+    def deliver(self, game_id: str, payload: str, key: Optional[Hashable] = None):
+        # Abonnés de ce processus seulement : évènements déjà sérialisés, ou relayés par un autre worker
+        for subscription in self._subscribers.get(game_id, ()):
+            subscription.push(payload, key)
+
+
+broadcaster = Broadcaster()
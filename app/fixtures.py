@@ -0,0 +1,179 @@
+from sqlalchemy.orm import Session
+
+from database import SHARDS, shard_for, shard_session
+from models import GameDB, KeypointDB, SolveDB, UserDB
+
+# Données de démonstration, chargées à la demande (`python fixtures.py`) sur une base
+# déjà migrée, et non plus à chaque démarrage du serveur.
+
+
+def demo_games():
+    return [
+        GameDB(
+            id="JKDKJFD3",
+            name="Découverte du campus universitaire de Villeneuve d'Ascq",
+            visibility=True,
+            duration=10800,
+            time_start=1592645436,
+            nb_player_max=12,
+            keypoints=[],
+            users=[]
+        ),
+        GameDB(
+            id="DJ83JDJF",
+            name="Découverte de Paris",
+            visibility=True,
+            duration=21600,
+            time_start=1591039848,
+            nb_player_max=8,
+            keypoints=[],
+            users=[],
+        ),
+        GameDB(
+            id="FUEIJE23",
+            name="Découverte de Lille",
+            visibility=False,
+            duration=9000,
+            time_start=1591019348,
+            nb_player_max=6,
+            keypoints=[],
+            users=[]
+        ),
+    ]
+
+
+def demo_content():
+    return [
+        UserDB(
+            id=1,
+            name="Alvin",
+            points=10,
+            game_id="JKDKJFD3",
+        ),
+        UserDB(
+            id=2,
+            name="Erik",
+            points=25,
+            game_id="JKDKJFD3",
+        ),
+        UserDB(
+            id=3,
+            name="Ashka",
+            points=5,
+            game_id="JKDKJFD3",
+        ),
+        UserDB(
+            id=4,
+            name="Johan",
+            points=10,
+            game_id="JKDKJFD3",
+        ),
+
+        UserDB(
+            id=5,
+            name="Wincaml",
+            points=15,
+            game_id="JKDKJFD3",
+        ),
+        KeypointDB(
+            id=4,
+            name="La résidence Léonard de Vinci",
+            description="Quel est l'association qui s'occupe d'Internet ?",
+            solution="Rézoléo",
+            points=10,
+            url_cible="https://rezoleo.fr",
+            latitude=50.60891984079241,
+            longitude=3.1479595389831827,
+            game_id="JKDKJFD3",
+        ),
+        KeypointDB(
+            id=5,
+            name="Centrale Lille",
+            description="Quel est le prénom du meilleur prof d'info de Centrale ?",
+            solution="Thomas",
+            points=10,
+            url_cible="https://centralelille.fr",
+            latitude=50.60671204431724,
+            longitude=3.1362654536795187,
+            game_id="JKDKJFD3",
+        ),
+        KeypointDB(
+            id=1,
+            name="Chimie Lille",
+            description="Comment s'appelle l'organisme lié à la fusion avec Centrale ?",
+            solution="Centrale Lille Institut",
+            points=20,
+            url_cible="https://www.ensc-lille.fr/",
+            latitude=50.60961737017392,
+            longitude=3.1465197652352384,
+            game_id="JKDKJFD3",
+        ),
+        KeypointDB(
+            id=2,
+            name="Stade Pierre Mauroy",
+            description="Quel est l'accronyme de l'équipe de Foot Lilloise ?",
+            solution="LOSC",
+            points=30,
+            url_cible="https://www.stade-pierre-mauroy.com/",
+            latitude=50.611909431152135,
+            longitude=3.1306297350229695,
+            game_id="JKDKJFD3",
+        ),
+        KeypointDB(
+            id=3,
+            name="Polytech Lille",
+            description="Quel est la réponse de la vie, de l'univers et de tout le reste ?",
+            solution="42",
+            points=20,
+            url_cible="https://www.polytech-lille.fr/",
+            latitude=50.607782321056426,
+            longitude=3.136245795396877,
+            game_id="JKDKJFD3",
+        ),
+    ]
+
+
+def demo_solves():
+    return [
+        SolveDB(
+            user_id=1,
+            keypoint_id=1,
+            game_id="JKDKJFD3"
+        ),
+        SolveDB(
+            user_id=1,
+            keypoint_id=4,
+            game_id="JKDKJFD3"
+        )
+    ]
+
+
+def load_fixtures(db_session: Session, shard: int = 0) -> bool:
+    # Charge les parties de démonstration qui reviennent à la base shard (SHARDS) ;
+    # renvoie False si elles y sont déjà
+    games = [game for game in demo_games() if shard_for(game.id) == shard]
+    if not games:
+        return False
+    existing = db_session.query(GameDB.id).filter(GameDB.id.in_([game.id for game in games])).first()
+    if existing is not None:
+        return False
+    # Chaque étape ne référence que des lignes déjà insérées (clés étrangères)
+    for rows in (games, demo_content(), demo_solves()):
+        db_session.add_all([row for row in rows if shard_for(getattr(row, "game_id", None) or row.id) == shard])
+        db_session.flush()
+    db_session.commit()
+    return True
+
+
+if __name__ == "__main__":
+    loaded = False
+    for shard in range(SHARDS):
+        init_session = shard_session(shard)
+        try:
+            loaded = load_fixtures(init_session, shard) or loaded
+        finally:
+            init_session.close()
+    if loaded:
+        print("Données de démonstration chargées")
+    else:
+        print("BdD déjà initialisée")
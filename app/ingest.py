@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from database import run_db, shard_for, shard_session
+from scoring import PendingSolve, record_solves
+
+# "sync" : chaque résolution est écrite avant de répondre ; "batched" : elle est
+# acquittée tout de suite puis écrite avec d'autres dans une même transaction.
+SOLVE_INGEST = os.getenv("SOLVE_INGEST", "sync")
+# Un lot est écrit dès qu'il atteint cette taille...
+SOLVE_BATCH_SIZE = int(os.getenv("SOLVE_BATCH_SIZE", "200"))
+# ... ou au plus tard après ce délai (en s)
+SOLVE_BATCH_INTERVAL = float(os.getenv("SOLVE_BATCH_INTERVAL", "0.05"))
+# "memory" : perdu si le processus s'arrête brutalement ; "journal" : écrit dans un
+# journal avant l'acquittement (survit à un crash du processus) ; "fsync" : journal
+# synchronisé sur disque (survit à une coupure de courant, mais plus lent).
+SOLVE_INGEST_DURABILITY = os.getenv("SOLVE_INGEST_DURABILITY", "journal")
+SOLVE_JOURNAL = os.getenv("SOLVE_JOURNAL", "./solves.journal")
+
+
+class SolveIngestor:
+    # File d'écriture différée des résolutions, vidée par lots par une tâche de fond
+
+    def __init__(
+            self,
+            batch_size: int = SOLVE_BATCH_SIZE,
+            interval: float = SOLVE_BATCH_INTERVAL,
+            durability: str = SOLVE_INGEST_DURABILITY,
+            journal_path: str = SOLVE_JOURNAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.durability = durability
+        self.journal_path = journal_path
+        self.on_commit: List[Callable[[List[PendingSolve]], None]] = []
+        self.batches = 0
+        self.committed = 0
+        self._queue: List[PendingSolve] = []
+        # Clés (game_id, user_id, keypoint_id) en attente : une résolution n'est mise en file qu'une fois
+        self._pending: Set[Tuple[str, int, int]] = set()
+        self._journal = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task = None
+        # Group commit : les résolutions écrites pendant une synchronisation attendent
+        # la suivante, qui les couvre toutes (un fsync par vague, hors de la boucle)
+        self._next_sync: Optional[asyncio.Future] = None
+        self._sync_task: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    @property
+    def _flushing_path(self) -> str:
+        return self.journal_path + ".flushing"
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        replayed = self._open_journal()
+        for solve in replayed:
+            self._enqueue(solve)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        while self._sync_task is not None:
+            await asyncio.shield(self._sync_task)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    async def submit(self, game_id: str, user_id: int, keypoint_id: int, points: int, created_at: int) -> bool:
+        # Renvoie False si la même résolution est déjà en attente
+        solve = PendingSolve(game_id, user_id, keypoint_id, points, created_at)
+        if (game_id, user_id, keypoint_id) in self._pending:
+            return False
+        if self._journal is not None:
+            self._journal.write(json.dumps(solve) + "\n")
+            self._journal.flush()
+        self._enqueue(solve)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        if self._journal is not None and self.durability == "fsync":
+            # Pas d'acquittement avant que la ligne soit sur disque
+            await self._sync_journal()
+        return True
+
+    async def flush(self):
+        async with self._lock:
+            if not self._queue:
+                return
+            # Le journal ne change pas de fichier pendant une synchronisation
+            while self._sync_task is not None:
+                await asyncio.shield(self._sync_task)
+            batch, self._queue = self._queue, []
+            # Les résolutions arrivées pendant l'écriture vont dans un nouveau journal
+            self._rotate_journal()
+            # Une transaction par base (SHARDS), écrites en parallèle
+            by_shard: Dict[int, List[PendingSolve]] = {}
+            for solve in batch:
+                by_shard.setdefault(shard_for(solve.game_id), []).append(solve)
+            results = await asyncio.gather(
+                *(self._record(shard, solves) for shard, solves in by_shard.items()), return_exceptions=True
+            )
+            applied, failed, error = [], [], None
+            for solves, result in zip(by_shard.values(), results):
+                if isinstance(result, BaseException):
+                    failed.extend(solves)
+                    error = result
+                else:
+                    applied.extend(result)
+            # Les lots en échec restent dans le journal "flushing" (rejoué au prochain
+            # démarrage, sans doublon : INSERT OR IGNORE) et sont retentés
+            self._queue = failed + self._queue
+            retried = set(failed)
+            for solve in batch:
+                if solve not in retried:
+                    self._pending.discard((solve.game_id, solve.user_id, solve.keypoint_id))
+            if error is None and self._journal is not None and os.path.exists(self._flushing_path):
+                os.remove(self._flushing_path)
+            if len(failed) < len(batch):
+                self.batches += 1
+                self.committed += len(applied)
+        if len(failed) < len(batch):
+            for callback in self.on_commit:
+                callback(applied)
+        if error is not None:
+            raise error
+
+    async def _record(self, shard: int, solves: List[PendingSolve]) -> List[PendingSolve]:
+        db_session = shard_session(shard)
+        try:
+            return await run_db(record_solves, db_session, solves)
+        finally:
+            db_session.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as error:
+                print("Écriture des résolutions en échec, nouvel essai :", error)
+
+    async def _sync_journal(self):
+        if self._next_sync is None:
+            self._next_sync = asyncio.get_event_loop().create_future()
+            if self._sync_task is None:
+                self._sync_task = asyncio.ensure_future(self._run_syncs())
+        await asyncio.shield(self._next_sync)
+
+    async def _run_syncs(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while self._next_sync is not None:
+                waiters, self._next_sync = self._next_sync, None
+                try:
+                    await loop.run_in_executor(None, os.fsync, self._journal.fileno())
+                except Exception as error:
+                    waiters.set_exception(error)
+                else:
+                    waiters.set_result(None)
+        finally:
+            self._sync_task = None
+
+    def _enqueue(self, solve: PendingSolve):
+        self._pending.add((solve.game_id, solve.user_id, solve.keypoint_id))
+        self._queue.append(solve)
+
+    def _read_journal(self, path: str) -> List[PendingSolve]:
+        if not os.path.exists(path):
+            return []
+        solves = []
+        with open(path) as journal:
+            for line in journal:
+                try:
+                    solves.append(PendingSolve(*json.loads(line)))
+                except (ValueError, TypeError):
+                    # Dernière ligne tronquée par un arrêt brutal
+                    continue
+        return solves
+
+    def _open_journal(self) -> List[PendingSolve]:
+        if self.durability == "memory":
+            return []
+        # Les résolutions non confirmées au dernier arrêt sont rejouées ; l'insertion
+        # étant idempotente, celles déjà écrites sont simplement ignorées.
+        replayed = self._read_journal(self._flushing_path) + self._read_journal(self.journal_path)
+        self._journal = open(self.journal_path, "w")
+        for solve in replayed:
+            self._journal.write(json.dumps(solve) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        if os.path.exists(self._flushing_path):
+            os.remove(self._flushing_path)
+        return replayed
+
+    def _rotate_journal(self):
+        if self._journal is None:
+            return
+        self._journal.close()
+        if os.path.exists(self._flushing_path):
+            # Un lot précédent a échoué : on garde ses lignes avec celles du lot courant
+            with open(self._flushing_path, "a") as flushing, open(self.journal_path) as journal:
+                flushing.write(journal.read())
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self._flushing_path)
+        self._journal = open(self.journal_path, "a")
+
+
+solve_ingestor = SolveIngestor()
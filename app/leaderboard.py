@@ -0,0 +1,213 @@
+import math
+import random
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import LeaderboardEntry
+
+MAX_LEVELS = 32
+
+
+class _Infinity:
+    # Valeur du noeud de fin : plus grande que toutes les clés
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+
+_NIL_VALUE = _Infinity()
+
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, levels: int):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedSet:
+    # Skip list indexable : insertion, suppression, rang et accès par position en O(log n)
+
+    def __init__(self):
+        self._nil = _Node(_NIL_VALUE, 0)
+        self._head = _Node(None, MAX_LEVELS)
+        self._head.next = [self._nil] * MAX_LEVELS
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def insert(self, value):
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].value < value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = min(MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+        new_node = _Node(value, levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, value):
+        chain = [None] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._nil or target.value != value:
+            raise KeyError(value)
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def bisect_left(self, value) -> int:
+        # Nombre d'éléments strictement inférieurs à value
+        position = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def islice(self, start: int, stop: int) -> Iterable:
+        if start >= self._size or stop <= start:
+            return
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        for _ in range(min(stop, self._size) - start):
+            yield node.value
+            node = node.next[0]
+
+
+class Leaderboard:
+    # Classement d'une partie : les clés (-points, user_id) placent les meilleurs en tête
+
+    def __init__(self):
+        self._ranking = RankedSet()
+        self._players: Dict[int, Tuple[int, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._players
+
+    def update(self, user_id: int, name: str, points: int):
+        previous = self._players.get(user_id)
+        if previous is not None:
+            if previous[0] != points:
+                self._ranking.remove((-previous[0], user_id))
+                self._ranking.insert((-points, user_id))
+        else:
+            self._ranking.insert((-points, user_id))
+        self._players[user_id] = (points, name)
+
+    def add_points(self, user_id: int, points: int):
+        player = self._players.get(user_id)
+        if player is not None:
+            self.update(user_id, player[1], player[0] + points)
+
+    def remove(self, user_id: int):
+        previous = self._players.pop(user_id, None)
+        if previous is not None:
+            self._ranking.remove((-previous[0], user_id))
+
+    def _rank_of_points(self, points: int) -> int:
+        # Les ex aequo partagent le même rang (1, 2, 2, 4...)
+        return self._ranking.bisect_left((-points, 0)) + 1
+
+    def rank(self, user_id: int) -> Optional[LeaderboardEntry]:
+        player = self._players.get(user_id)
+        if player is None:
+            return None
+        points, name = player
+        return LeaderboardEntry(rank=self._rank_of_points(points), user_id=user_id, name=name, points=points)
+
+    def top(self, n: int) -> List[LeaderboardEntry]:
+        entries = []
+        rank = 0
+        previous_points = None
+        for position, (negative_points, user_id) in enumerate(self._ranking.islice(0, n)):
+            points = -negative_points
+            if points != previous_points:
+                rank = position + 1
+                previous_points = points
+            entries.append(LeaderboardEntry(
+                rank=rank, user_id=user_id, name=self._players[user_id][1], points=points))
+        return entries
+
+
+class Leaderboards:
+    # Ensemble des classements, un par partie, tenus à jour par les routes d'écriture
+
+    def __init__(self):
+        self._games: Dict[str, Leaderboard] = {}
+
+    def get(self, game_id: str) -> Optional[Leaderboard]:
+        # Sans rien créer : None pour une partie sans joueur (ou inconnue)
+        return self._games.get(game_id)
+
+    def update(self, game_id: str, user_id: int, name: str, points: int):
+        leaderboard = self._games.get(game_id)
+        if leaderboard is None:
+            leaderboard = self._games[game_id] = Leaderboard()
+        leaderboard.update(user_id, name, points)
+
+    def add_points(self, game_id: str, user_id: int, points: int):
+        if game_id in self._games:
+            self._games[game_id].add_points(user_id, points)
+
+    def remove(self, game_id: str, user_id: int):
+        if game_id in self._games:
+            self._games[game_id].remove(user_id)
+
+    def drop(self, game_id: str):
+        self._games.pop(game_id, None)
+
+    def load(self, game_id: str, rows: Iterable[Tuple[int, str, int]]):
+        # rows : (user_id, name, points) de tous les joueurs de la partie
+        leaderboard = Leaderboard()
+        for user_id, name, points in rows:
+            leaderboard.update(user_id, name, points)
+        self._games[game_id] = leaderboard
+
+    def rebuild(self, rows: Iterable[Tuple[str, int, str, int]]):
+        # rows : (game_id, user_id, name, points), typiquement lus depuis la table users
+        games: Dict[str, Leaderboard] = {}
+        for game_id, user_id, name, points in rows:
+            leaderboard = games.get(game_id)
+            if leaderboard is None:
+                leaderboard = games[game_id] = Leaderboard()
+            leaderboard.update(user_id, name, points)
+        self._games = games
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,362 @@
+import asyncio
+import gzip
+import heapq
+import json
+import os
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from analytics import archived_stats, read_stats
+from bundle import current_version, empty_bundle
+from database import run_db, session_for
+from ingest import SOLVE_INGEST, solve_ingestor
+from leaderboard import Leaderboard
+from models import Game, GameDB, Keypoint, KeypointDB, KeypointSummary, LeaderboardEntry, Solve, SolveDB, User, UserDB, UserSummary
+
+# Archivage des parties terminées : à la fin de la partie (plus un délai de grâce),
+# les scores sont figés, le classement final calculé et la partie déplacée dans une
+# archive compressée (un fichier par partie), servie en lecture seule par les routes GET.
+GAME_ARCHIVE = os.getenv("GAME_ARCHIVE", "0") not in ("0", "false", "no")
+GAME_ARCHIVE_DIR = os.getenv("GAME_ARCHIVE_DIR", "./archives")
+# Délai (en s) entre la fin d'une partie et son archivage (réponses en retard, lots en attente)
+GAME_ARCHIVE_GRACE = int(os.getenv("GAME_ARCHIVE_GRACE", "3600"))
+# Nombre d'archives gardées décompressées en mémoire
+GAME_ARCHIVE_CACHE = int(os.getenv("GAME_ARCHIVE_CACHE", "64"))
+# Le planificateur se réveille au moins à cet intervalle (en s), même sans échéance
+LIFECYCLE_MAX_SLEEP = 60
+# Délai (en s) avant un nouvel essai d'archivage en échec
+LIFECYCLE_RETRY_DELAY = 60
+
+ARCHIVE_FORMAT = 1
+
+
+class ArchivedGame:
+    # Partie archivée, décompressée dans les mêmes modèles que ceux des routes GET
+
+    def __init__(self, snapshot: dict):
+        self.archived_at = snapshot["archived_at"]
+        # Version du journal des modifications au moment de l'archivage
+        self.version = snapshot.get("version", 0)
+        game_id = snapshot["game"]["id"]
+        summaries = {row["id"]: UserSummary(**row) for row in snapshot["users"]}
+        keypoint_summaries = {row["id"]: KeypointSummary(**row) for row in snapshot["keypoints"]}
+        solvers: Dict[int, List[UserSummary]] = {}
+        solved: Dict[int, List[KeypointSummary]] = {}
+        for user_id, keypoint_id, *_ in snapshot["solves"]:
+            solvers.setdefault(keypoint_id, []).append(summaries[user_id])
+            solved.setdefault(user_id, []).append(keypoint_summaries[keypoint_id])
+
+        self.keypoints = {
+            keypoint_id: Keypoint(**summary.dict(), users_solvers=solvers.get(keypoint_id, []))
+            for keypoint_id, summary in keypoint_summaries.items()
+        }
+        # Joueurs et résolutions triés par clé de pagination
+        self.users = [
+            User(**summary.dict(), keypoints_solved=solved.get(user_id, []))
+            for user_id, summary in sorted(summaries.items())
+        ]
+        self._user_ids = [user.id for user in self.users]
+        # (user_id, keypoint_id, created_at) ; sans created_at dans les premières archives
+        self.solves = [
+            Solve(user_id=solve[0], keypoint_id=solve[1], game_id=game_id, created_at=solve[2] if len(solve) > 2 else None)
+            for solve in snapshot["solves"]
+        ]
+        self._solve_keys = [(solve.user_id, solve.keypoint_id) for solve in self.solves]
+        self.game = Game(**snapshot["game"], keypoints=list(self.keypoints.values()), users=self.users)
+        self.ranking = [
+            LeaderboardEntry(rank=rank, user_id=user_id, name=summaries[user_id].name, points=points)
+            for rank, user_id, points in snapshot["ranking"]
+        ]
+        self._ranks = {entry.user_id: entry for entry in self.ranking}
+        # Agrégats des statistiques (analytics.read_stats), figés à l'archivage
+        self.stats = snapshot.get("stats") or archived_stats(snapshot)
+
+    def user(self, user_id: int) -> Optional[User]:
+        position = bisect_right(self._user_ids, user_id) - 1
+        if position >= 0 and self._user_ids[position] == user_id:
+            return self.users[position]
+        return None
+
+    def users_after(self, after_id: Optional[int], limit: int) -> List[User]:
+        start = bisect_right(self._user_ids, after_id) if after_id is not None else 0
+        return self.users[start:start + limit]
+
+    def solves_after(self, after_key: Optional[List[int]], limit: int) -> List[Solve]:
+        start = bisect_right(self._solve_keys, tuple(after_key)) if after_key is not None else 0
+        return self.solves[start:start + limit]
+
+    def bundle(self) -> dict:
+        # Paquet hors-ligne complet, au même format que bundle.build_bundle
+        bundle = empty_bundle(self.version, None)
+        bundle["game"] = self.game.dict(exclude={"keypoints", "users"})
+        bundle["keypoints"] = [keypoint.dict(exclude={"game_id", "users_solvers"}) for keypoint in self.keypoints.values()]
+        bundle["users"] = [user.dict(exclude={"game_id", "keypoints_solved"}) for user in self.users]
+        bundle["solves"] = [list(key) for key in self._solve_keys]
+        return bundle
+
+    def top(self, n: int) -> List[LeaderboardEntry]:
+        return self.ranking[:n]
+
+    def rank(self, user_id: int) -> Optional[LeaderboardEntry]:
+        return self._ranks.get(user_id)
+
+
+class GameArchive:
+    # Archives des parties terminées : un fichier JSON compressé (gzip) par partie.
+    # Les ids archivés sont gardés en mémoire : savoir qu'une partie n'est pas
+    # archivée ne coûte ni lecture disque ni requête SQL.
+
+    def __init__(self, directory: str = GAME_ARCHIVE_DIR, cache_size: int = GAME_ARCHIVE_CACHE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._ids: Set[str] = set()
+        self._cache: "OrderedDict[str, ArchivedGame]" = OrderedDict()
+
+    def __contains__(self, game_id: str) -> bool:
+        return game_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def path(self, game_id: str) -> str:
+        return os.path.join(self.directory, game_id + ".json.gz")
+
+    def scan(self):
+        if not os.path.isdir(self.directory):
+            self._ids = set()
+            return
+        self._ids = {name[:-len(".json.gz")] for name in os.listdir(self.directory) if name.endswith(".json.gz")}
+
+    def pending_path(self, game_id: str) -> str:
+        return self.path(game_id) + ".pending"
+
+    def write(self, game_id: str, snapshot: dict) -> str:
+        # Écrite à côté de son nom définitif, ignorée par scan() jusqu'à publish()
+        os.makedirs(self.directory, exist_ok=True)
+        pending = self.pending_path(game_id)
+        with gzip.open(pending, "wt", encoding="utf-8") as output:
+            json.dump(snapshot, output, ensure_ascii=False, separators=(",", ":"))
+        return pending
+
+    def publish(self, game_id: str):
+        # Renommage atomique, une fois la partie supprimée de la base ; un autre worker
+        # peut l'avoir déjà fait au démarrage (recover)
+        try:
+            os.replace(self.pending_path(game_id), self.path(game_id))
+        except FileNotFoundError:
+            if not os.path.exists(self.path(game_id)):
+                raise
+
+    def discard(self, game_id: str):
+        if os.path.exists(self.pending_path(game_id)):
+            os.remove(self.pending_path(game_id))
+
+    def pending(self) -> List[str]:
+        # Archives écrites dont la suppression de la partie n'a pas été suivie du
+        # renommage (arrêt du processus entre les deux)
+        if not os.path.isdir(self.directory):
+            return []
+        return [name[:-len(".json.gz.pending")] for name in os.listdir(self.directory) if name.endswith(".json.gz.pending")]
+
+    def add(self, game_id: str):
+        self._ids.add(game_id)
+        self._cache.pop(game_id, None)
+
+    def read(self, game_id: str) -> ArchivedGame:
+        with gzip.open(self.path(game_id), "rt", encoding="utf-8") as archive:
+            return ArchivedGame(json.load(archive))
+
+    async def get(self, game_id: str) -> Optional[ArchivedGame]:
+        if game_id not in self._ids:
+            return None
+        archived = self._cache.get(game_id)
+        if archived is not None:
+            self._cache.move_to_end(game_id)
+            return archived
+        archived = await asyncio.get_event_loop().run_in_executor(None, self.read, game_id)
+        self._cache[game_id] = archived
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return archived
+
+
+def snapshot_game(db_session: Session, game_id: str) -> Optional[dict]:
+    game = db_session.execute(GameDB.__table__.select().where(GameDB.id == game_id)).first()
+    if game is None:
+        return None
+    keypoints = [dict(row) for row in db_session.execute(
+        KeypointDB.__table__.select().where(KeypointDB.game_id == game_id).order_by(KeypointDB.id)
+    )]
+    users = [dict(row) for row in db_session.execute(
+        UserDB.__table__.select().where(UserDB.game_id == game_id).order_by(UserDB.id)
+    )]
+    # Résolutions réduites à (user_id, keypoint_id, created_at) : les relations sont reconstruites à la lecture
+    solves = [list(row) for row in db_session.execute(
+        select([SolveDB.user_id, SolveDB.keypoint_id, SolveDB.created_at])
+        .where(SolveDB.game_id == game_id)
+        .order_by(SolveDB.user_id, SolveDB.keypoint_id)
+    )]
+    version = current_version(db_session, game_id)
+    leaderboard = Leaderboard()
+    for user in users:
+        leaderboard.update(user["id"], user["name"], user["points"])
+    return {
+        "format": ARCHIVE_FORMAT,
+        "archived_at": int(time.time()),
+        "version": version or 0,
+        "game": dict(game),
+        "keypoints": keypoints,
+        "users": users,
+        "solves": solves,
+        # Classement final : (rang, user_id, points)
+        "ranking": [[entry.rank, entry.user_id, entry.points] for entry in leaderboard.top(len(leaderboard))],
+        "stats": read_stats(db_session, game_id),
+    }
+
+
+def archive_game(db_session: Session, archive: GameArchive, game_id: str) -> Optional[dict]:
+    # Instantané et suppression dans la même transaction d'écriture : rien ne peut être
+    # écrit entre les deux (et supprimé sans être archivé). L'archive n'est publiée
+    # qu'une fois la suppression validée ; en cas d'échec, elle est effacée.
+    if db_session.bind.dialect.name == "sqlite":
+        # Le module sqlite3 n'ouvre sa transaction qu'à la première écriture
+        db_session.execute(text("BEGIN IMMEDIATE"))
+    try:
+        # Scores figés tels quels (points de départ et corrections compris)
+        snapshot = snapshot_game(db_session, game_id)
+        if snapshot is None:
+            db_session.rollback()
+            return None
+        archive.write(game_id, snapshot)
+        # Points clefs, joueurs et résolutions suivent (ON DELETE CASCADE)
+        db_session.execute(GameDB.__table__.delete().where(GameDB.id == game_id))
+        db_session.commit()
+    except BaseException:
+        db_session.rollback()
+        archive.discard(game_id)
+        raise
+    archive.publish(game_id)
+    return snapshot
+
+
+def recover_archives(archive: GameArchive):
+    # Au démarrage : une archive en attente dont la partie n'existe plus a été validée
+    # puis interrompue avant son renommage ; sinon elle sera réécrite au prochain essai
+    for game_id in archive.pending():
+        db_session = session_for(game_id)
+        try:
+            exists = db_session.query(GameDB.id).filter(GameDB.id == game_id).first() is not None
+        finally:
+            db_session.close()
+        if not exists:
+            archive.publish(game_id)
+
+
+class LifecycleScheduler:
+    # Échéances d'archivage (fin de partie + délai de grâce) des parties en cours, dans
+    # un tas : la prochaine échéance est toujours en tête, et la tâche de fond dort
+    # jusqu'à elle. Une partie replanifiée laisse son ancienne entrée, ignorée à l'échéance.
+
+    def __init__(self, archive: GameArchive, grace: int = GAME_ARCHIVE_GRACE, clock: Callable[[], float] = time.time):
+        self.archive = archive
+        self.grace = grace
+        self.clock = clock
+        self.on_archive: List[Callable[[str, dict], None]] = []
+        self.archived = 0
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, game_id: str, time_start: int, duration: Optional[int]):
+        if duration is None:
+            # Partie sans fin : jamais archivée automatiquement
+            self.cancel(game_id)
+            return
+        deadline = time_start + duration + self.grace
+        if self._deadlines.get(game_id) == deadline:
+            return
+        self._deadlines[game_id] = deadline
+        heapq.heappush(self._heap, (deadline, game_id))
+        if self._wakeup is not None and self._heap[0] == (deadline, game_id):
+            self._wakeup.set()
+
+    def cancel(self, game_id: str):
+        self._deadlines.pop(game_id, None)
+
+    def load(self, rows: Iterable[Tuple[str, int, Optional[int]]]):
+        # rows : (game_id, time_start, duration), typiquement lus depuis la table games
+        self._heap = []
+        self._deadlines = {}
+        for game_id, time_start, duration in rows:
+            if duration is not None:
+                deadline = time_start + duration + self.grace
+                self._deadlines[game_id] = deadline
+                self._heap.append((deadline, game_id))
+        heapq.heapify(self._heap)
+
+    def due(self, now: float) -> List[str]:
+        games = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, game_id = heapq.heappop(self._heap)
+            if self._deadlines.get(game_id) == deadline:
+                del self._deadlines[game_id]
+                games.append(game_id)
+        return games
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def archive_game(self, game_id: str) -> Optional[dict]:
+        if SOLVE_INGEST == "batched":
+            # Les résolutions acquittées font partie des scores finaux
+            await solve_ingestor.flush()
+        db_session = session_for(game_id)
+        try:
+            snapshot = await run_db(archive_game, db_session, self.archive, game_id)
+        finally:
+            db_session.close()
+        if snapshot is None:
+            return None
+        self.cancel(game_id)
+        self.archive.add(game_id)
+        self.archived += 1
+        for callback in self.on_archive:
+            callback(game_id, snapshot)
+        return snapshot
+
+    async def _run(self):
+        while True:
+            delay = LIFECYCLE_MAX_SLEEP
+            if self._heap:
+                delay = min(delay, max(0.0, self._heap[0][0] - self.clock()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            for game_id in self.due(self.clock()):
+                try:
+                    await self.archive_game(game_id)
+                except Exception as error:
+                    print("Archivage de la partie %s en échec, nouvel essai :" % game_id, error)
+                    deadline = self._deadlines[game_id] = self.clock() + LIFECYCLE_RETRY_DELAY
+                    heapq.heappush(self._heap, (deadline, game_id))
+
+
+game_archive = GameArchive()
+game_lifecycle = LifecycleScheduler(game_archive)
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from starlette.routing import compile_path
+
+# Protection des routes d'écriture : seaux à jetons par partie, par joueur et par
+# adresse IP, avec un budget par route (429), et limite globale du nombre de requêtes
+# en cours, avec une file d'attente bornée (503). Tout est en mémoire du processus :
+# avec plusieurs workers, chacun applique les budgets à ses propres requêtes.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") not in ("0", "false", "no")
+# Nombre maximal de seaux gardés par règle (les moins récemment utilisés sont oubliés)
+RATE_LIMIT_KEYS = int(os.getenv("RATE_LIMIT_KEYS", "100000"))
+# Requêtes traitées en même temps (0 : pas de limite), requêtes en attente au-delà,
+# et attente maximale (en s) d'une place avant de renvoyer 503
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "128"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "512"))
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", "5"))
+# Retry-After (en s) des réponses 503
+ADMISSION_RETRY_AFTER = 1
+
+# Budgets par route : portée ("game", "user" ou "ip") -> (requêtes, période en s).
+# La capacité du seau est le nombre de requêtes : une rafale de cette taille passe,
+# puis une requête par période / requêtes. RATE_LIMITS (JSON, même forme) les remplace.
+DEFAULT_RATE_LIMITS = {
+    "POST /games": {"ip": (20, 60)},
+    "POST /games/bulk": {"ip": (5, 60)},
+    "POST /games/import": {"ip": (5, 60)},
+    "POST /assets": {"ip": (30, 60)},
+    "PUT /games/{game_id}": {"game": (30, 60), "ip": (60, 60)},
+    "POST /games/{game_id}/keypoints": {"game": (50, 10), "ip": (50, 10)},
+    "POST /games/{game_id}/users": {"game": (100, 1), "ip": (30, 1)},
+    "PUT /games/{game_id}/users/{user_id}": {"user": (10, 10), "ip": (60, 1)},
+    "POST /games/{game_id}/solves": {"user": (10, 10), "game": (200, 1), "ip": (60, 1)},
+    "POST /games/{game_id}/keypoints/{keypoint_id}/attempts": {"user": (20, 10), "game": (400, 1), "ip": (100, 1)},
+}
+RATE_LIMITS = json.loads(os.getenv("RATE_LIMITS")) if os.getenv("RATE_LIMITS") else DEFAULT_RATE_LIMITS
+
+# Routes jamais mises en file : flux d'évènements (connexions longues) et métriques
+ADMISSION_EXEMPT_SUFFIXES = ("/events", "/metrics")
+
+
+class TokenBuckets:
+    # Un seau par clé : (jetons restants, date de mise à jour), rempli au fil du temps.
+    # Un seau inutilisé pendant une période entière est plein, donc inutile : les seaux
+    # sont rangés du moins au plus récemment utilisé et les plus anciens expirent.
+
+    def __init__(self, requests: int, period: float, max_keys: int = RATE_LIMIT_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(requests)
+        self.period = float(period)
+        self.rate = requests / period
+        self.max_keys = max_keys
+        self.clock = clock
+        self.evictions = 0
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Hashable) -> float:
+        # 0 si la requête passe, sinon le délai (en s) avant le prochain jeton
+        now = self.clock()
+        self._expire(now)
+        bucket = self._buckets.pop(key, None)
+        tokens = self.capacity if bucket is None else min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    def _expire(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key = next(iter(buckets))
+            if now - buckets[key][1] < self.period:
+                break
+            del buckets[key]
+
+
+class RouteLimit:
+
+    def __init__(self, route: str, budgets: Dict[str, Tuple[int, float]]):
+        self.method, self.path = route.split(" ", 1)
+        self.route = route
+        self.regex = compile_path(self.path)[0]
+        self.buckets = [(scope, TokenBuckets(requests, period)) for scope, (requests, period) in budgets.items()]
+
+
+class RateLimiter:
+
+    def __init__(self, limits: Dict[str, Dict[str, Tuple[int, float]]] = RATE_LIMITS):
+        self.routes: Dict[str, List[RouteLimit]] = {}
+        for route, budgets in limits.items():
+            limit = RouteLimit(route, budgets)
+            self.routes.setdefault(limit.method, []).append(limit)
+        # (route, portée) -> requêtes refusées
+        self.limited: Dict[Tuple[str, str], int] = {}
+
+    def check(self, scope) -> Optional[float]:
+        # Délai avant nouvel essai si la requête dépasse un budget, None sinon
+        routes = self.routes.get(scope["method"])
+        if not routes:
+            return None
+        path = scope["path"]
+        for limit in routes:
+            match = limit.regex.match(path)
+            if match is None:
+                continue
+            parameters = match.groupdict()
+            retry_after = None
+            for scope_name, buckets in limit.buckets:
+                key = self._key(scope_name, scope, parameters)
+                if key is None:
+                    continue
+                delay = buckets.take(key)
+                if delay:
+                    self.limited[(limit.route, scope_name)] = self.limited.get((limit.route, scope_name), 0) + 1
+                    retry_after = max(retry_after or 0.0, delay)
+            return retry_after
+        return None
+
+    @staticmethod
+    def _key(scope_name: str, scope, parameters: Dict[str, str]) -> Optional[Hashable]:
+        if scope_name == "ip":
+            client = scope.get("client")
+            return client[0] if client else None
+        game_id = parameters.get("game_id")
+        if scope_name == "game":
+            return game_id
+        # Joueur : dans le chemin, ou en paramètre (résolutions, réponses)
+        user_id = parameters.get("user_id")
+        if user_id is None:
+            user_id = dict(parse_qsl(scope["query_string"].decode("latin-1"))).get("user_id")
+        return None if user_id is None else (game_id, user_id)
+
+    def sizes(self) -> Dict[Tuple[str, str], int]:
+        return {
+            (limit.route, scope_name): len(buckets)
+            for limits in self.routes.values() for limit in limits for scope_name, buckets in limit.buckets
+        }
+
+
+class AdmissionControl:
+    # Au plus max_concurrent requêtes en cours ; au-delà, au plus max_queued attendent
+    # leur tour (dans l'ordre d'arrivée) pendant timeout secondes. Les autres sont
+    # refusées tout de suite : la file ne grandit jamais sans limite.
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS, max_queued: int = MAX_QUEUED_REQUESTS, timeout: float = ADMISSION_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queued:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter], timeout=self.timeout)
+        except BaseException:
+            # Requête annulée pendant l'attente : une place déjà transmise est rendue
+            if waiter.done():
+                self.release()
+            else:
+                self._abandon(waiter)
+            raise
+        if not waiter.done():
+            self._abandon(waiter)
+            self.rejected += 1
+            return False
+        return True
+
+    def _abandon(self, waiter: asyncio.Future):
+        waiter.cancel()
+        self._waiters.remove(waiter)
+
+    def release(self):
+        # La place passe directement au premier en attente
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+            return
+        self.active -= 1
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+
+def _error(status: int, detail: str, retry_after: float) -> Tuple[dict, dict]:
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    start = {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode("latin-1")),
+        ],
+    }
+    return start, {"type": "http.response.body", "body": body}
+
+
+class LimitsMiddleware:
+    # Middleware ASGI « pur », comme MetricsMiddleware : les budgets sont vérifiés avant
+    # la file d'attente, pour qu'un client refusé n'y prenne jamais de place.
+
+    def __init__(self, app, limiter: Optional[RateLimiter], admission: Optional[AdmissionControl]):
+        self.app = app
+        self.limiter = limiter
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.limiter is not None:
+            retry_after = self.limiter.check(scope)
+            if retry_after is not None:
+                for message in _error(429, "Trop de requêtes, réessayez plus tard", retry_after):
+                    await send(message)
+                return
+        if self.admission is None or scope["path"].endswith(ADMISSION_EXEMPT_SUFFIXES):
+            await self.app(scope, receive, send)
+            return
+        if not await self.admission.acquire():
+            for message in _error(503, "Serveur surchargé, réessayez plus tard", ADMISSION_RETRY_AFTER):
+                await send(message)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release()
+
+
+rate_limiter = RateLimiter() if RATE_LIMIT_ENABLED else None
+admission = AdmissionControl() if MAX_CONCURRENT_REQUESTS > 0 else None
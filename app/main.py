@@ -1,296 +1,841 @@
+import asyncio
+import gzip
+import json
 import os
+import tempfile
+import time
 import uuid
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
-import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Form, File, UploadFile
-from models import Base, Game, GameDB, PutGame, Keypoint, KeypointDB, PutKeypoint, User, UserDB, PutUser, Solve, SolveDB
+from fastapi import FastAPI, HTTPException, Depends, Form, File, UploadFile, Query
+from fastapi.encoders import jsonable_encoder
+from models import Asset, GameBundle, Game, GameDB, PutGame, Keypoint, KeypointDB, KeypointSummary, PutKeypoint, User, UserDB, UserSummary, PutUser, Solve, SolveDB, LeaderboardEntry, NearbyKeypoint, AttemptResult, GameAnalytics, BulkGame, GameTransferResult
 from functions import gen_id
-
-
-from sqlalchemy import create_engine
-from sqlalchemy import exc
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy.orm import joinedload
+from database import dispose_engine, get_engines, get_game_db, run_db, pool_stats, session_for
+from leaderboard import leaderboards
+from spatial import GridIndex, spatial_indexes
+from answers import solutions
+from scoring import record_solve, recompute_points, AlreadySolved, UnknownUser, PendingSolve
+from ingest import SOLVE_INGEST, solve_ingestor
+from events import broadcaster
+from cache import game_versions, response_cache
+from transfer import IMPORT_SPOOL_BYTES, create_game_bulk, export_game, GameImporter
+from assets import AssetResponse, AssetTooLarge, StoredAsset, UnsupportedImage, ASSET_MAX_BYTES, asset_path, content_type, store_asset
+from serializers import dumps, game_content, keypoints_content, users_content
+from sharding import fetch_all, games_page
+from bundle import build_compressed, compress, empty_bundle
+from analytics import LEAST_SOLVED, game_analytics, read_stats
+from lifecycle import GAME_ARCHIVE, game_archive, game_lifecycle, recover_archives
+from compression import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, CompressionMiddleware, compress_async, compression_stats, negotiate
+from coherence import COHERENCE, CoherenceMiddleware, change_feed, claim_worker_path
+from limits import LimitsMiddleware, admission, rate_limiter
+from metrics import METRICS_ENABLED, MetricsMiddleware, metrics
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, parse_fields, project, page_headers
+
+
+from sqlalchemy import exc, and_, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import selectinload
 
 from starlette.requests import Request
-from starlette.responses import Response
-from starlette.status import HTTP_404_NOT_FOUND
-
-SQLALCHEMY_DATABASE_URI = "sqlite:///./database_arriddle.db"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URI, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
-db_session = SessionLocal()
-
-# Permet de créer la base de données avec une oeuvre si ce n'est pas déjà fait
-try:
-    test_games = [
-        UserDB(
-            name="Alvin",
-            points=10,
-            game_id="JKDKJFD3",
-        ),
-        UserDB(
-            name="Erik",
-            points=25,
-            game_id="JKDKJFD3",
-        ),
-        UserDB(
-            name="Ashka",
-            points=5,
-            game_id="JKDKJFD3",
-        ),
-        UserDB(
-            name="Johan",
-            points=10,
-            game_id="JKDKJFD3",
-        ),
-
-        UserDB(
-            name="Wincaml",
-            points=15,
-            game_id="JKDKJFD3",
-        ),
-        KeypointDB(
-            id=4,
-            name="La résidence Léonard de Vinci",
-            description="Quel est l'association qui s'occupe d'Internet ?",
-            solution="Rézoléo",
-            points=10,
-            url_cible="https://rezoleo.fr",
-            latitude=50.60891984079241,
-            longitude=3.1479595389831827,
-            game_id="JKDKJFD3",
-        ),
-        KeypointDB(
-            id=5,
-            name="Centrale Lille",
-            description="Quel est le prénom du meilleur prof d'info de Centrale ?",
-            solution="Thomas",
-            points=10,
-            url_cible="https://centralelille.fr",
-            latitude=50.60671204431724,
-            longitude=3.1362654536795187,
-            game_id="JKDKJFD3",
-        ),
-        KeypointDB(
-            id=1,
-            name="Chimie Lille",
-            description="Comment s'appelle l'organisme lié à la fusion avec Centrale ?",
-            solution="Centrale Lille Institut",
-            points=20,
-            url_cible="https://www.ensc-lille.fr/",
-            latitude=50.60961737017392,
-            longitude=3.1465197652352384,
-            game_id="JKDKJFD3",
-        ),
-        KeypointDB(
-            id=2,
-            name="Stade Pierre Mauroy",
-            description="Quel est l'accronyme de l'équipe de Foot Lilloise ?",
-            solution="LOSC",
-            points=30,
-            url_cible="https://www.stade-pierre-mauroy.com/",
-            latitude=50.611909431152135,
-            longitude=3.1306297350229695,
-            game_id="JKDKJFD3",
-        ),
-        KeypointDB(
-            id=3,
-            name="Polytech Lille",
-            description="Quel est la réponse de la vie, de l'univers et de tout le reste ?",
-            solution="42",
-            points=20,
-            url_cible="https://www.polytech-lille.fr/",
-            latitude=50.607782321056426,
-            longitude=3.136245795396877,
-            game_id="JKDKJFD3",
-        ),
-        GameDB(
-            id="JKDKJFD3",
-            name="Découverte du campus universitaire de Villeneuve d'Ascq",
-            visibility=True,
-            duration=10800,
-            time_start=1592645436,
-            nb_player_max=12,
-            keypoints=[],
-            users=[]
-        ),
-        GameDB(
-            id="DJ83JDJF",
-            name="Découverte de Paris",
-            visibility=True,
-            duration=21600,
-            time_start=1591039848,
-            nb_player_max=8,
-            keypoints=[],
-            users=[],
-        ),
-        GameDB(
-            id="FUEIJE23",
-            name="Découverte de Lille",
-            visibility=False,
-            duration=9000,
-            time_start=1591019348,
-            nb_player_max=6,
-            keypoints=[],
-            users=[]
-        ),
-        SolveDB(
-            user_id=1,
-            keypoint_id=1,
-            game_id="JKDKJFD3"
-        ),
-        SolveDB(
-            user_id=1,
-            keypoint_id=4,
-            game_id="JKDKJFD3"
-        )
-    ]
-
-    db_session.add_all(test_games)
-    db_session.commit()
-
-except exc.IntegrityError:
-    print("BdD déjà initialisée")
-
-db_session.close()
-
-
-# Dependency
-def get_db():
-    try:
-        yield db_session
-    finally:
-        db_session.close()
-
-
-def get_keypoint(db_session: Session, keypoint_id: int, game_id: str) -> Optional[KeypointDB]:
-    return (
+from starlette.responses import Response, StreamingResponse
+from starlette.websockets import WebSocket
+from starlette.status import HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT, HTTP_413_REQUEST_ENTITY_TOO_LARGE, HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+# Stratégies de chargement : chaque relation sérialisée par les modèles de réponse
+# est chargée d'avance (une requête par relation), quel que soit le nombre de lignes.
+KEYPOINT_LOADING = (selectinload(KeypointDB.users_solvers),)
+USER_LOADING = (selectinload(UserDB.keypoints_solved),)
+GAME_RELATIONS = {
+    "keypoints": selectinload(GameDB.keypoints).selectinload(KeypointDB.users_solvers),
+    "users": selectinload(GameDB.users).selectinload(UserDB.keypoints_solved),
+}
+GAME_LOADING = tuple(GAME_RELATIONS.values())
+
+
+async def get_keypoint(db_session: Session, keypoint_id: int, game_id: str) -> Optional[KeypointDB]:
+    return await run_db(
         db_session.query(KeypointDB)
+        .options(*KEYPOINT_LOADING)
         .filter(KeypointDB.game_id == game_id)
         .filter(KeypointDB.id == keypoint_id)
-        .first()
+        .first
     )
 
 
-def get_all_keypoints(db_session: Session, game_id: str) -> List[Optional[KeypointDB]]:
-    return (
+async def get_all_keypoints(db_session: Session, game_id: str) -> List[Optional[KeypointDB]]:
+    return await run_db(
         db_session.query(KeypointDB)
+        .options(*KEYPOINT_LOADING)
         .filter(KeypointDB.game_id == game_id)
-        .all()
+        .all
     )
 
 
-def get_game(db_session: Session, game_id: str) -> Optional[GameDB]:
-    return (
+async def get_game(db_session: Session, game_id: str) -> Optional[GameDB]:
+    return await run_db(
         db_session.query(GameDB)
+        .options(*GAME_LOADING)
         .filter(GameDB.id == game_id)
-        .first()
+        .first
     )
 
 
-def get_all_games(db_session: Session) -> List[Optional[GameDB]]:
-    return (
-        db_session.query(GameDB)
-        .all()
-    )
-
-
-def get_user(db_session: Session, user_id: int, game_id: str) -> Optional[UserDB]:
-    return (
+def game_filters(
+        visibility: Optional[bool] = None,
+        active_at: Optional[int] = None,
+        started_after: Optional[int] = None,
+        started_before: Optional[int] = None,
+        after_id: Optional[str] = None) -> list:
+    # Conditions du listing des parties, communes à la requête ORM et à la sérialisation rapide
+    where = []
+    if visibility is not None:
+        where.append(GameDB.visibility == visibility)
+    if active_at is not None:
+        where.append(GameDB.time_start <= active_at)
+        where.append(or_(GameDB.duration.is_(None), GameDB.time_start + GameDB.duration > active_at))
+    if started_after is not None:
+        where.append(GameDB.time_start >= started_after)
+    if started_before is not None:
+        where.append(GameDB.time_start < started_before)
+    # Pagination par clé : on reprend après le dernier id renvoyé
+    if after_id is not None:
+        where.append(GameDB.id > after_id)
+    return where
+
+
+async def get_all_games(
+        db_session: Session,
+        visibility: Optional[bool] = None,
+        active_at: Optional[int] = None,
+        started_after: Optional[int] = None,
+        started_before: Optional[int] = None,
+        after_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        relations=tuple(GAME_RELATIONS)) -> List[Optional[GameDB]]:
+    query = db_session.query(GameDB).options(*(GAME_RELATIONS[relation] for relation in relations))
+    query = query.filter(*game_filters(visibility, active_at, started_after, started_before, after_id))
+    query = query.order_by(GameDB.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return await run_db(query.all)
+
+
+async def get_user(db_session: Session, user_id: int, game_id: str) -> Optional[UserDB]:
+    return await run_db(
         db_session.query(UserDB)
+        .options(*USER_LOADING)
         .filter(UserDB.game_id == game_id)
         .filter(UserDB.id == user_id)
-        .first()
+        .first
     )
 
 
-def get_all_users(db_session: Session, game_id: str) -> List[Optional[UserDB]]:
-    return (
-        db_session.query(UserDB)
-        .filter(UserDB.game_id == game_id)
-        .all()
+async def get_all_users(
+        db_session: Session,
+        game_id: str,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        with_solved: bool = True) -> List[Optional[UserDB]]:
+    query = db_session.query(UserDB).filter(UserDB.game_id == game_id)
+    if with_solved:
+        query = query.options(*USER_LOADING)
+    if after_id is not None:
+        query = query.filter(UserDB.id > after_id)
+    query = query.order_by(UserDB.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return await run_db(query.all)
+
+
+async def get_solves(
+        db_session: Session,
+        game_id: str,
+        after_key: Optional[List[int]] = None,
+        limit: Optional[int] = None) -> List[Optional[SolveDB]]:
+    query = db_session.query(SolveDB).filter(SolveDB.game_id == game_id)
+    if after_key is not None:
+        after_user_id, after_keypoint_id = after_key
+        query = query.filter(or_(
+            SolveDB.user_id > after_user_id,
+            and_(SolveDB.user_id == after_user_id, SolveDB.keypoint_id > after_keypoint_id),
+        ))
+    query = query.order_by(SolveDB.user_id, SolveDB.keypoint_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return await run_db(query.all)
+
+
+app = FastAPI(title="ARriddle API", version=os.getenv("API_VERSION", "dev"))
+
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+if COHERENCE == "strict":
+    app.add_middleware(CoherenceMiddleware, feed=change_feed)
+
+# Après la cohérence et la compression : une requête refusée ne coûte ni l'une ni l'autre
+if rate_limiter is not None or admission is not None:
+    app.add_middleware(LimitsMiddleware, limiter=rate_limiter, admission=admission)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    metrics.register(
+        "db_pool_connections", "Connexions du pool SQLAlchemy, par état",
+        lambda: {(("state", state),): value for state, value in pool_stats().items()},
+    )
+    metrics.register(
+        "response_cache_events_total", "Accès au cache de réponses",
+        lambda: {(("event", event),): response_cache.stats()[event] for event in ("hits", "misses", "evictions")},
+        kind="counter",
+    )
+    metrics.register(
+        "response_cache_bytes", "Taille des réponses en cache",
+        lambda: {(): response_cache.size},
+    )
+    metrics.register(
+        "solve_ingest_queue", "Résolutions acquittées en attente d'écriture",
+        lambda: {(): len(solve_ingestor)},
     )
+    metrics.register(
+        "games_archive_scheduled", "Parties en cours dont l'archivage est planifié",
+        lambda: {(): len(game_lifecycle)},
+    )
+    metrics.register(
+        "games_archived", "Parties terminées servies depuis l'archive",
+        lambda: {(): len(game_archive)},
+    )
+    metrics.register(
+        "response_compression_bytes_total", "Taille des réponses compressées à la volée, avant et après compression",
+        lambda: dict(
+            [((("encoding", encoding), ("stage", "in")), size) for encoding, size in compression_stats.bytes_in.items()]
+            + [((("encoding", encoding), ("stage", "out")), size) for encoding, size in compression_stats.bytes_out.items()]
+        ),
+        kind="counter",
+    )
+    if rate_limiter is not None:
+        metrics.register(
+            "rate_limited_total", "Requêtes refusées (429) par budget, par route et par portée",
+            lambda: {(("route", route), ("scope", scope)): count for (route, scope), count in rate_limiter.limited.items()},
+            kind="counter",
+        )
+        metrics.register(
+            "rate_limit_buckets", "Seaux à jetons en mémoire, par route et par portée",
+            lambda: {(("route", route), ("scope", scope)): size for (route, scope), size in rate_limiter.sizes().items()},
+        )
+    if admission is not None:
+        metrics.register(
+            "admission_requests", "Requêtes en cours de traitement ou en attente d'une place",
+            lambda: {(("state", "active"),): admission.active, (("state", "waiting"),): admission.waiting},
+        )
+        metrics.register(
+            "admission_rejected_total", "Requêtes refusées (503) faute de place",
+            lambda: {(): admission.rejected},
+            kind="counter",
+        )
+    if COHERENCE != "off":
+        # Chaque worker a ses propres métriques : l'étiquette dit lequel a répondu
+        metrics.register(
+            "coherence_worker_info", "Worker qui a servi cette page de métriques",
+            lambda: {(("worker", change_feed.worker), ("leader", str(change_feed.leader).lower())): 1},
+        )
+        metrics.register(
+            "coherence_events_total", "Évènements relayés aux autres workers, ou reçus d'eux",
+            lambda: {(("direction", "relayed"),): change_feed.relayed, (("direction", "received"),): change_feed.received},
+            kind="counter",
+        )
+
+# ---------------------------------- STARTUP -------------------------------
+
+
+# Démarrage : la base n'est ouverte qu'ici, jamais à l'import du module.
+# Le schéma doit déjà être à jour (python migrations.py).
+@app.on_event("startup")
+async def open_database():
+    # Toutes les bases de la répartition (SHARDS) sont ouvertes au démarrage
+    for engine in get_engines():
+        if METRICS_ENABLED:
+            metrics.instrument_engine(engine)
 
 
-def get_solves(db_session: Session, game_id: str) -> List[Optional[SolveDB]]:
-    return (
-        db_session.query(SolveDB)
-        .filter(SolveDB.game_id == game_id)
-        .all()
+@app.on_event("startup")
+async def open_change_feed():
+    # Plusieurs workers : le fil des modifications est ouvert avant le chargement des caches
+    if COHERENCE != "off":
+        await change_feed.open()
+
+
+@app.on_event("startup")
+async def load_leaderboards():
+    # Requêtes Core plutôt qu'ORM : des tuples bruts, sans le coût par ligne de Query
+    rows = await fetch_all(select([UserDB.game_id, UserDB.id, UserDB.name, UserDB.points]))
+    leaderboards.rebuild(rows)
+
+
+@app.on_event("startup")
+async def load_keypoint_indexes():
+    # Index spatial et solutions sont construits à partir d'un seul parcours de keypoints
+    rows = await fetch_all(select([
+        KeypointDB.game_id, KeypointDB.id, KeypointDB.latitude, KeypointDB.longitude,
+        KeypointDB.solution, KeypointDB.points,
+    ]))
+    spatial_indexes.rebuild(
+        (game_id, keypoint_id, lat, lon)
+        for game_id, keypoint_id, lat, lon, _, _ in rows
+        if lat is not None and lon is not None
+    )
+    solutions.rebuild(
+        (game_id, keypoint_id, solution, points)
+        for game_id, keypoint_id, _, _, solution, points in rows
     )
 
 
-app = FastAPI(title="ARriddle API", version=os.getenv("API_VERSION", "dev"))
+@app.on_event("startup")
+async def start_solve_ingestor():
+    if SOLVE_INGEST == "batched":
+        if COHERENCE != "off":
+            # Un journal par worker : chacun ne rejoue que le sien
+            solve_ingestor.journal_path = claim_worker_path(solve_ingestor.journal_path)
+        solve_ingestor.on_commit.append(solves_committed)
+        await solve_ingestor.start()
+
+
+@app.on_event("startup")
+async def start_game_lifecycle():
+    # Les archives déjà écrites sont servies même si l'archivage automatique est désactivé
+    await run_db(recover_archives, game_archive)
+    game_archive.scan()
+    game_lifecycle.on_archive.append(game_archived)
+    if not GAME_ARCHIVE:
+        return
+    if COHERENCE != "off":
+        # Plusieurs workers : seul le worker élu archive les parties
+        change_feed.on_leader.append(start_archiving)
+        return
+    await start_archiving()
+
+
+async def start_archiving():
+    rows = await fetch_all(select([GameDB.id, GameDB.time_start, GameDB.duration]))
+    game_lifecycle.load(rows)
+    await game_lifecycle.start()
+
+
+@app.on_event("startup")
+async def start_change_feed():
+    if COHERENCE != "off":
+        await change_feed.start()
+
+
+@app.on_event("shutdown")
+async def stop_game_lifecycle():
+    await game_lifecycle.stop()
+
+
+@app.on_event("shutdown")
+async def stop_solve_ingestor():
+    if SOLVE_INGEST == "batched":
+        await solve_ingestor.stop()
+
+
+@app.on_event("shutdown")
+async def stop_change_feed():
+    if COHERENCE != "off":
+        await change_feed.stop()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    dispose_engine()
+
+
+async def load_game_state(db_session: Session, game_id: str):
+    # Recharge les structures en mémoire d'une partie modifiée en masse
+    game = await run_db(
+        db_session.query(GameDB.time_start, GameDB.duration)
+        .filter(GameDB.id == game_id)
+        .first
+    )
+    users = await run_db(
+        db_session.query(UserDB.id, UserDB.name, UserDB.points)
+        .filter(UserDB.game_id == game_id)
+        .all
+    )
+    keypoints = await run_db(
+        db_session.query(KeypointDB.id, KeypointDB.latitude, KeypointDB.longitude, KeypointDB.solution, KeypointDB.points)
+        .filter(KeypointDB.game_id == game_id)
+        .all
+    )
+    leaderboards.load(game_id, users)
+    spatial_indexes.load(game_id, [(keypoint.id, keypoint.latitude, keypoint.longitude) for keypoint in keypoints])
+    solutions.load(game_id, [(keypoint.id, keypoint.solution, keypoint.points) for keypoint in keypoints])
+    game_lifecycle.schedule(game_id, game.time_start, game.duration)
+    game_versions.bump(game_id)
 
 # ---------------------------------- GET -------------------------------
 
 
+def json_body(content) -> bytes:
+    # Même encodage que JSONResponse, avec orjson s'il est installé
+    return dumps(content)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return any(candidate.strip() in (etag, "*") for candidate in if_none_match.split(","))
+
+
+# Corps en cours de construction, par clé du cache de réponses
+_building: Dict[tuple, "asyncio.Future[Optional[Tuple[bytes, Dict[str, str]]]]"] = {}
+
+
+async def build_once(key: tuple, build, encode: Callable) -> Tuple[bytes, Dict[str, str]]:
+    # Les requêtes simultanées sur une même clé (une nouvelle version demandée par tous
+    # les joueurs d'une partie) attendent la même construction au lieu d'interroger
+    # chacune la base ; si elle échoue, chacune reconstruit pour renvoyer sa propre erreur.
+    pending = _building.get(key)
+    if pending is not None:
+        cached = await asyncio.shield(pending)
+        if cached is not None:
+            return cached
+    future = _building[key] = asyncio.get_event_loop().create_future()
+    try:
+        content, extra_headers = await build()
+        cached = encode(content), extra_headers
+        response_cache.set(key, *cached)
+    except BaseException:
+        future.set_result(None)
+        raise
+    finally:
+        if _building.get(key) is future:
+            del _building[key]
+    future.set_result(cached)
+    return cached
+
+
+async def versioned_response(request: Request, route: str, game_id: str, build, encode: Callable = json_body) -> Response:
+    # L'ETag ne dépend que de la version de la partie : un 304 ne touche pas la base
+    version = game_versions.get(game_id)
+    headers = {"ETag": game_versions.etag(game_id, version), "Cache-Control": "no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = (route, game_id, version, request.url.query)
+    cached = response_cache.get(key)
+    if cached is None:
+        cached = await build_once(key, build, encode)
+    body, extra_headers = cached
+    headers.update(extra_headers)
+    if COMPRESSION_ENABLED and "Content-Encoding" not in headers:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        if encoding is not None and len(body) >= COMPRESSION_MIN_SIZE:
+            # Compressé une fois par version et par encodage, gardé dans le même cache
+            body = await compressed_body(key + (encoding,), body, encoding)
+            headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def compressed_body(key: tuple, body: bytes, encoding: str) -> bytes:
+    cached = response_cache.get(key)
+    if cached is None:
+        async def build():
+            return await compress_async(body, encoding), {}
+        cached = await build_once(key, build, lambda compressed: compressed)
+    return cached[0]
+
+
+def bad_request(error: ValueError):
+    return HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(error))
+
+
+
 @app.get("/")
 async def read_root():
     return {"Hello": "World"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.api_route("/assets/{name}", methods=["GET", "HEAD"], summary="Récupère une image (ou une de ses versions redimensionnées)")
+async def read_asset(name: str):
+    path = asset_path(name)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    return AssetResponse(path, name)
+
+
+async def get_keypoints_by_distance(db_session: Session, game_id: str, distances) -> List[NearbyKeypoint]:
+    if not distances:
+        return []
+    keypoints = await run_db(
+        db_session.query(KeypointDB)
+        .options(*KEYPOINT_LOADING)
+        .filter(KeypointDB.game_id == game_id)
+        .filter(KeypointDB.id.in_([keypoint_id for _, keypoint_id in distances]))
+        .all
+    )
+    keypoints = {keypoint.id: keypoint for keypoint in keypoints}
+    return [
+        NearbyKeypoint(**Keypoint.from_orm(keypoints[keypoint_id]).dict(), distance=distance)
+        for distance, keypoint_id in distances
+        if keypoint_id in keypoints
+    ]
+
+
+async def find_spatial_index(db_session: Session, game_id: str) -> GridIndex:
+    index = spatial_indexes.get(game_id)
+    if index is not None:
+        return index
+    # Pas d'index en mémoire : partie sans point clef, archivée, ou inconnue
+    if game_id not in game_archive:
+        game = await run_db(db_session.query(GameDB.id).filter(GameDB.id == game_id).first)
+        if game is None:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    # Index vide, jamais gardé
+    return GridIndex()
+
+
+@app.get("/games/{game_id}/keypoints/nearby", summary="Récupère les points clés autour d'une position, du plus proche au plus lointain", response_model=List[NearbyKeypoint])
+async def read_nearby_keypoints(
+        game_id: str,
+        lat: float = Query(..., ge=-90, le=90),
+        lon: float = Query(..., ge=-180, le=180),
+        radius: float = Query(..., gt=0, le=100000, description="Rayon de recherche (en mètres)"),
+        limit: int = Query(100, ge=1, le=500),
+        db: Session = Depends(get_game_db)):
+    distances = (await find_spatial_index(db, game_id)).nearby(lat, lon, radius, limit)
+    return await get_keypoints_by_distance(db, game_id, distances)
+
+
+@app.get("/games/{game_id}/keypoints/within", summary="Récupère les points clés d'une zone, du plus proche au plus lointain de son centre", response_model=List[NearbyKeypoint])
+async def read_keypoints_within(
+        game_id: str,
+        min_lat: float = Query(..., ge=-90, le=90),
+        min_lon: float = Query(..., ge=-180, le=180),
+        max_lat: float = Query(..., ge=-90, le=90),
+        max_lon: float = Query(..., ge=-180, le=180),
+        limit: int = Query(100, ge=1, le=500),
+        db: Session = Depends(get_game_db)):
+    if min_lat > max_lat:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="min_lat doit être inférieure à max_lat")
+    # Une zone qui traverse l'antiméridien a min_lon > max_lon
+    if min_lon > max_lon:
+        max_lon += 360
+    index = await find_spatial_index(db, game_id)
+    center_lat, center_lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    keypoint_ids = index.within(min_lat, min_lon, max_lat, max_lon)
+    distances = index.nearest(center_lat, center_lon, keypoint_ids, limit)
+    return await get_keypoints_by_distance(db, game_id, distances)
+
+
 @app.get("/games/{game_id}/keypoints/{keypoint_id}", summary="Récupère le point clé correspondant à l'id", response_model=Keypoint)
-async def read_keypoint(keypoint_id: int, game_id: str, db: Session = Depends(get_db)):
-    keypoint = get_keypoint(db, keypoint_id=keypoint_id, game_id=game_id)
+async def read_keypoint(keypoint_id: int, game_id: str, db: Session = Depends(get_game_db)):
+    archived = await game_archive.get(game_id)
+    if archived is not None:
+        keypoint = archived.keypoints.get(keypoint_id)
+    else:
+        keypoint = await get_keypoint(db, keypoint_id=keypoint_id, game_id=game_id)
     if keypoint is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
     return keypoint
 
 
 @app.get("/games/{game_id}/keypoints", summary="Récupère tous les points clés", response_model=List[Keypoint])
-async def read_all_keypoints(game_id: str, db: Session = Depends(get_db)):
-    keypoints = get_all_keypoints(db, game_id=game_id)
-    if keypoints is None:
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
-    return keypoints
+async def read_all_keypoints(game_id: str, request: Request, db: Session = Depends(get_game_db)):
+    async def build():
+        archived = await game_archive.get(game_id)
+        if archived is not None:
+            return jsonable_encoder(archived.game.keypoints), {}
+        # Lignes assemblées directement en dictionnaires (serializers.py)
+        return await run_db(keypoints_content, db, game_id), {}
+    return await versioned_response(request, "keypoints", game_id, build)
 
 
 @app.get("/games/{game_id}", summary="Récupère la partie correspondante à l'id", response_model=Game)
-async def read_game(game_id: str, db: Session = Depends(get_db)):
-    game = get_game(db, game_id=game_id)
-    if game is None:
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
-    return game
-
+async def read_game(game_id: str, request: Request, db: Session = Depends(get_game_db)):
+    async def build():
+        archived = await game_archive.get(game_id)
+        if archived is not None:
+            return jsonable_encoder(archived.game), {}
+        game = await run_db(game_content, db, game_id)
+        if game is None:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+        return game, {}
+    return await versioned_response(request, "game", game_id, build)
+
+
+@app.get("/games", summary="Récupère les parties, page par page", response_model=List[Game])
+async def read_all_games(
+        request: Request,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: str = Query(None, description="Valeur de X-Next-Cursor de la page précédente"),
+        visibility: bool = Query(None, description="Seulement les parties publiques (true) ou privées (false)"),
+        active_at: int = Query(None, description="Seulement les parties en cours à ce timestamp"),
+        started_after: int = Query(None, description="Seulement les parties commençant à partir de ce timestamp"),
+        started_before: int = Query(None, description="Seulement les parties commençant avant ce timestamp"),
+        fields: str = Query(None, description="Champs à renvoyer, séparés par des virgules")):
+    try:
+        after_id = decode_cursor(cursor, (str,))[0] if cursor else None
+        selected = parse_fields(fields, Game)
+    except ValueError as error:
+        raise bad_request(error)
 
-@app.get("/games", summary="Récupère toutes les parties", response_model=List[Game])
-async def read_all_games(db: Session = Depends(get_db)):
-    games = get_all_games(db)
-    if games is None:
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
-    return games
+    where = game_filters(visibility, active_at, started_after, started_before, after_id)
+    # Fusion des pages de toutes les bases
+    content, next_key = await games_page(where, selected, limit)
+    return Response(json_body(content), media_type="application/json", headers=page_headers(request, next_key))
 
 
-@app.get("/games/{game_id}/users", summary="Récupère les utilisateurs la partie correspondante à l'id", response_model=List[User])
-async def read_users(game_id: str, db: Session = Depends(get_db)):
-    users = get_all_users(db, game_id=game_id)
-    if users is None:
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
-    return users
+@app.get("/games/{game_id}/users", summary="Récupère les utilisateurs la partie correspondante à l'id, page par page", response_model=List[User])
+async def read_users(
+        game_id: str,
+        request: Request,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: str = Query(None, description="Valeur de X-Next-Cursor de la page précédente"),
+        fields: str = Query(None, description="Champs à renvoyer, séparés par des virgules"),
+        db: Session = Depends(get_game_db)):
+    try:
+        after_id = decode_cursor(cursor, (int,))[0] if cursor else None
+        selected = parse_fields(fields, User)
+    except ValueError as error:
+        raise bad_request(error)
+
+    async def build():
+        archived = await game_archive.get(game_id)
+        if archived is not None:
+            users = archived.users_after(after_id, limit + 1)
+            next_key = (users[limit - 1].id,) if len(users) > limit else None
+            content = [project(user, selected, {"keypoints_solved": KeypointSummary}) for user in users[:limit]]
+        else:
+            content, next_key = await run_db(users_content, db, game_id, selected, after_id, limit)
+        return content, page_headers(request, next_key)
+    return await versioned_response(request, "users", game_id, build)
 
 
 @app.get("/games/{game_id}/users/{user_id}", summary="Récupère l'utilisateur correspondant à l'id de la partie correspondante à l'id de partie", response_model=User)
-async def read_user(user_id: int, game_id: str, db: Session = Depends(get_db)):
-    user = get_user(db, user_id=user_id, game_id=game_id)
+async def read_user(user_id: int, game_id: str, db: Session = Depends(get_game_db)):
+    archived = await game_archive.get(game_id)
+    if archived is not None:
+        user = archived.user(user_id)
+    else:
+        user = await get_user(db, user_id=user_id, game_id=game_id)
     if user is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
     return user
 
 
-@app.get("/games/{game_id}/solves", summary="Récupère les références des résolutions", response_model=List[Solve])
-async def read_solves(game_id: str, db: Session = Depends(get_db)):
-    solve = get_solves(db, game_id=game_id)
-    if solve is None:
+@app.get("/games/{game_id}/solves", summary="Récupère les références des résolutions, page par page", response_model=List[Solve])
+async def read_solves(
+        game_id: str,
+        request: Request,
+        response: Response,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: str = Query(None, description="Valeur de X-Next-Cursor de la page précédente"),
+        db: Session = Depends(get_game_db)):
+    try:
+        after_key = decode_cursor(cursor, (int, int)) if cursor else None
+    except ValueError as error:
+        raise bad_request(error)
+    archived = await game_archive.get(game_id)
+    if archived is not None:
+        solves = archived.solves_after(after_key, limit + 1)
+    else:
+        solves = await get_solves(db, game_id=game_id, after_key=after_key, limit=limit + 1)
+    if len(solves) > limit:
+        last = solves[limit - 1]
+        response.headers.update(page_headers(request, (last.user_id, last.keypoint_id)))
+    return solves[:limit]
+
+
+@app.get("/games/{game_id}/export", summary="Exporte la partie complète (résolutions comprises) au format NDJSON")
+async def export_game_ndjson(game_id: str, db: Session = Depends(get_game_db)):
+    game = await run_db(db.query(GameDB.id).filter(GameDB.id == game_id).first)
+    if game is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
-    return solve
+    return StreamingResponse(
+        export_game(game_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="%s.ndjson"' % game_id},
+    )
+
+
+@app.get("/games/{game_id}/bundle", summary="Télécharge la partie complète, ou ses modifications depuis une version, en un seul document compressé", response_model=GameBundle)
+async def read_bundle(
+        game_id: str,
+        request: Request,
+        since: int = Query(None, ge=0, description="Valeur de version de la dernière synchronisation : seules les modifications suivantes sont renvoyées"),
+        db: Session = Depends(get_game_db)):
+    async def build():
+        archived = await game_archive.get(game_id)
+        if archived is not None:
+            # Plus de journal pour une partie archivée : le paquet complet, sauf si le client l'a déjà
+            content = empty_bundle(archived.version, since) if since == archived.version else archived.bundle()
+            bundle = await asyncio.get_event_loop().run_in_executor(None, compress, content), content["version"]
+        else:
+            bundle = await run_db(build_compressed, db, game_id, since)
+        if bundle is None:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+        body, version = bundle
+        return body, {"Content-Encoding": "gzip", "Vary": "Accept-Encoding", "X-Bundle-Version": str(version)}
+
+    # Compressé une fois par version (dans le thread de la requête SQL), puis servi tel quel
+    response = await versioned_response(request, "bundle", game_id, build, encode=lambda body: body)
+    if response.status_code == 200 and "gzip" not in request.headers.get("accept-encoding", ""):
+        del response.headers["content-encoding"]
+        response.body = gzip.decompress(response.body)
+        response.headers["content-length"] = str(len(response.body))
+    return response
+
+
+@app.get("/games/{game_id}/leaderboard", summary="Récupère les meilleurs joueurs de la partie", response_model=List[LeaderboardEntry])
+async def read_leaderboard(game_id: str, top: int = Query(10, ge=1, le=1000), db: Session = Depends(get_game_db)):
+    archived = await game_archive.get(game_id)
+    if archived is not None:
+        return archived.top(top)
+    leaderboard = leaderboards.get(game_id)
+    if leaderboard is None:
+        # Pas de classement en mémoire : partie sans joueur, ou inconnue
+        game = await run_db(db.query(GameDB.id).filter(GameDB.id == game_id).first)
+        if game is None:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+        return []
+    return leaderboard.top(top)
+
+
+@app.get("/games/{game_id}/leaderboard/{user_id}", summary="Récupère le rang d'un joueur de la partie", response_model=LeaderboardEntry)
+async def read_user_rank(game_id: str, user_id: int):
+    archived = await game_archive.get(game_id)
+    if archived is not None:
+        entry = archived.rank(user_id)
+    else:
+        leaderboard = leaderboards.get(game_id)
+        entry = leaderboard.rank(user_id) if leaderboard is not None else None
+    if entry is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    return entry
+
+
+@app.get("/games/{game_id}/analytics", summary="Statistiques de la partie : taux de résolution, temps de résolution et points clés les moins résolus", response_model=GameAnalytics)
+async def read_analytics(
+        game_id: str,
+        request: Request,
+        least: int = Query(LEAST_SOLVED, ge=0, le=100, description="Nombre de points clés les moins résolus à renvoyer"),
+        db: Session = Depends(get_game_db)):
+    # Lue dans les agrégats (migration 6), puis gardée en cache jusqu'à la prochaine écriture
+    async def build():
+        archived = await game_archive.get(game_id)
+        if archived is not None:
+            stats = archived.stats
+        else:
+            stats = await run_db(read_stats, db, game_id)
+        if stats is None:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+        return game_analytics(game_id, stats, least), {}
+    return await versioned_response(request, "analytics", game_id, build)
+
+# ---------------------------------- EVENTS -------------------------------
+
+# Délai (en s) entre deux commentaires de maintien de connexion SSE
+EVENTS_KEEPALIVE = 15
+
+
+def publish_score(game_id: str, user_id: int):
+    leaderboard = leaderboards.get(game_id)
+    entry = leaderboard.rank(user_id) if leaderboard is not None else None
+    if entry is not None:
+        # Seul le dernier score d'un joueur compte : les changements en attente sont regroupés
+        broadcaster.publish(game_id, "score", entry.dict(), key=("score", user_id))
+
+
+def publish_keypoint(game_id: str, keypoint_id: int, keypoint: Optional[KeypointDB] = None):
+    data = {"id": keypoint_id, "deleted": keypoint is None}
+    if keypoint is not None:
+        data.update(
+            name=keypoint.name,
+            description=keypoint.description,
+            points=keypoint.points,
+            url_cible=keypoint.url_cible,
+            latitude=keypoint.latitude,
+            longitude=keypoint.longitude,
+        )
+    broadcaster.publish(game_id, "keypoint_edited", data, key=("keypoint", keypoint_id))
+
+
+def solves_committed(solves: List[PendingSolve]):
+    # Appelé une fois les résolutions écrites, en direct ou par lot
+    for game_id in {solve.game_id for solve in solves}:
+        game_versions.bump(game_id)
+    for solve in solves:
+        leaderboards.add_points(solve.game_id, solve.user_id, solve.points)
+        broadcaster.publish(solve.game_id, "solve", {"user_id": solve.user_id, "keypoint_id": solve.keypoint_id})
+        publish_score(solve.game_id, solve.user_id)
+
+
+def game_archived(game_id: str, snapshot: dict):
+    # Appelé une fois la partie archivée et supprimée des tables
+    game_versions.bump(game_id)
+    leaderboards.drop(game_id)
+    spatial_indexes.drop(game_id)
+    solutions.drop(game_id)
+    archived = {"game_id": game_id, "ranking": [
+        {"rank": rank, "user_id": user_id, "points": points} for rank, user_id, points in snapshot["ranking"][:10]
+    ]}
+    broadcaster.publish(game_id, "game_archived", archived)
+
+
+@app.websocket("/games/{game_id}/events")
+async def game_events_websocket(websocket: WebSocket, game_id: str):
+    await websocket.accept()
+    subscription = broadcaster.subscribe(game_id)
+
+    async def wait_disconnect():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                subscription.close()
+                return
+
+    reader = asyncio.ensure_future(wait_disconnect())
+    try:
+        while True:
+            payload = await subscription.get()
+            if payload is None:
+                break
+            await websocket.send_text(payload)
+    finally:
+        reader.cancel()
+        broadcaster.unsubscribe(subscription)
+
+
+@app.get("/games/{game_id}/events", summary="Flux (Server-Sent Events) des évènements de la partie")
+async def game_events_stream(game_id: str, request: Request):
+    subscription = broadcaster.subscribe(game_id)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(subscription.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if payload is None:
+                    break
+                yield "data: " + payload + "\n\n"
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # ---------------------------------- POST -------------------------------
 
@@ -301,10 +846,9 @@ async def create_game(
         visibility: bool,
         time_start: int,
         nb_player_max: int = None,
-        duration: int = None,
-        db: Session = Depends(get_db)):
+        duration: int = None):
 
-    # Génération de la nouvelle partie
+    # Génération de la nouvelle partie, écrite dans la base que désigne son id
     new_game = GameDB(
         id=gen_id(8),
         name=name,
@@ -313,12 +857,119 @@ async def create_game(
         time_start=time_start,
         nb_player_max=nb_player_max,
     )
-    db_session.add(new_game)
-    db_session.commit()
-    db_session.refresh(new_game)
+    db = session_for(new_game.id)
+    try:
+        db.add(new_game)
+        await run_db(db.commit)
+        await run_db(db.refresh, new_game)
+    finally:
+        db.close()
+    game_versions.bump(new_game.id)
+    game_lifecycle.schedule(new_game.id, new_game.time_start, new_game.duration)
     return new_game
 
 
+@app.post("/games/bulk", summary="Crée une partie avec ses points clés et ses joueurs en une transaction", response_model=GameTransferResult, status_code=HTTP_201_CREATED)
+async def create_game_with_content(game: BulkGame):
+    game_id = gen_id(8)
+    db = session_for(game_id)
+    try:
+        try:
+            result = await run_db(create_game_bulk, db, game, game_id)
+        except exc.IntegrityError:
+            raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Nom de partie, de point clé ou de joueur déjà utilisé")
+        await load_game_state(db, result.id)
+    finally:
+        db.close()
+    return result
+
+
+def open_importer(record, name: Optional[str], keep_ids: bool) -> Tuple[Session, GameImporter]:
+    # L'id de la partie (celui de l'export, ou un nouveau) est connu avant l'import :
+    # il désigne la base où écrire. Une première ligne invalide est refusée par l'importeur.
+    game_id = gen_id(8)
+    if keep_ids and isinstance(record, dict) and isinstance(record.get("data"), dict):
+        game_id = record["data"].get("id") or game_id
+    db = session_for(str(game_id))
+    return db, GameImporter(db, name=name, keep_ids=keep_ids, game_id=None if keep_ids else game_id)
+
+
+def import_spooled(spool, name: Optional[str], keep_ids: bool) -> Tuple[Session, GameTransferResult]:
+    # L'export est déjà reçu en entier : la transaction d'écriture ne dure que le temps
+    # de l'import, jamais celui de l'envoi (un client lent bloquerait toute la base)
+    spool.seek(0)
+    db, importer = None, None
+    try:
+        for line in spool:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if importer is None:
+                db, importer = open_importer(record, name, keep_ids)
+            importer.add(record)
+        if importer is None:
+            raise ValueError("Export vide")
+        return db, importer.finish()
+    except BaseException:
+        if db is not None:
+            db.close()
+        raise
+
+
+@app.post("/games/import", summary="Importe une partie exportée au format NDJSON", response_model=GameTransferResult, status_code=HTTP_201_CREATED)
+async def import_game_ndjson(
+        request: Request,
+        name: str = Query(None, description="Nouveau nom de la partie importée"),
+        keep_ids: bool = Query(False, description="Conserve les ids de l'export (migration vers une autre base)")):
+    loop = asyncio.get_event_loop()
+    # Le corps est d'abord copié tel quel (en mémoire, puis sur le disque au-delà de
+    # IMPORT_SPOOL_BYTES), sans toucher à la base
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    db = None
+    try:
+        async for chunk in request.stream():
+            await loop.run_in_executor(None, spool.write, chunk)
+        db, result = await run_db(import_spooled, spool, name, keep_ids)
+        await load_game_state(db, result.id)
+    except ValueError as error:
+        raise bad_request(error)
+    except exc.IntegrityError:
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Partie, point clé ou joueur déjà existant")
+    finally:
+        spool.close()
+        if db is not None:
+            db.close()
+    return result
+
+
+def asset_model(stored: StoredAsset) -> Asset:
+    return Asset(
+        sha256=stored.sha256,
+        url="/assets/" + stored.name,
+        content_type=content_type(stored.name),
+        size=stored.size,
+        variants={width: "/assets/" + name for width, name in stored.variants.items()},
+    )
+
+
+async def receive_asset(request: Request) -> StoredAsset:
+    # L'image est le corps brut de la requête (pas de multipart : starlette lirait tout
+    # le fichier avant d'appeler la route), écrite sur le disque au fil de l'eau
+    if int(request.headers.get("content-length") or 0) > ASSET_MAX_BYTES:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    try:
+        return await store_asset(request.stream())
+    except AssetTooLarge:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Image de plus de %d octets" % ASSET_MAX_BYTES)
+    except UnsupportedImage:
+        raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Formats acceptés : JPEG, PNG, GIF, WebP")
+
+
+@app.post("/assets", summary="Envoie une image (corps brut de la requête)", response_model=Asset, status_code=HTTP_201_CREATED)
+async def create_asset(request: Request):
+    return asset_model(await receive_asset(request))
+
+
 @app.post("/games/{game_id}/keypoints", summary="Crée un keypoint")
 async def create_keypoint(
         name: str,
@@ -329,7 +980,12 @@ async def create_keypoint(
         latitude: float = None,
         longitude: float = None,
         url_cible: str = None,
-        db: Session = Depends(get_db)):
+        db: Session = Depends(get_game_db)):
+
+    # Partie inconnue ou archivée : la clé étrangère ferait échouer l'insertion
+    game = await run_db(db.query(GameDB.id).filter(GameDB.id == game_id).first)
+    if game is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
 
     # Génération de la nouvelle partie
     new_keypoint = KeypointDB(
@@ -342,9 +998,18 @@ async def create_keypoint(
         longitude=longitude,
         url_cible=url_cible,
     )
-    db_session.add(new_keypoint)
-    db_session.commit()
-    db_session.refresh(new_keypoint)
+    db.add(new_keypoint)
+    try:
+        await run_db(db.commit)
+    except exc.IntegrityError:
+        # Partie supprimée entre-temps
+        await run_db(db.rollback)
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    await run_db(db.refresh, new_keypoint)
+    game_versions.bump(game_id)
+    spatial_indexes.upsert(game_id, new_keypoint.id, new_keypoint.latitude, new_keypoint.longitude)
+    solutions.set(game_id, new_keypoint.id, new_keypoint.solution, new_keypoint.points)
+    publish_keypoint(game_id, new_keypoint.id, new_keypoint)
     return new_keypoint
 
 
@@ -353,7 +1018,11 @@ async def create_user(
         name: str,
         points: int,
         game_id: str,
-        db: Session = Depends(get_db)):
+        db: Session = Depends(get_game_db)):
+
+    game = await run_db(db.query(GameDB.id).filter(GameDB.id == game_id).first)
+    if game is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
 
     # Génération de la nouvelle partie
     new_user = UserDB(
@@ -361,61 +1030,167 @@ async def create_user(
         points=points,
         game_id=game_id,
     )
-    db_session.add(new_user)
-    db_session.commit()
-    db_session.refresh(new_user)
+    db.add(new_user)
+    try:
+        await run_db(db.commit)
+    except exc.IntegrityError:
+        await run_db(db.rollback)
+        # Nom déjà pris dans la partie, ou partie supprimée entre-temps
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Joueur déjà existant")
+    await run_db(db.refresh, new_user)
+    game_versions.bump(game_id)
+    leaderboards.update(game_id, new_user.id, new_user.name, new_user.points)
+    broadcaster.publish(game_id, "player_joined", {"user_id": new_user.id, "name": new_user.name, "points": new_user.points})
     return new_user
 
 
+async def user_exists(db: Session, game_id: str, user_id: int) -> bool:
+    # Classement en mémoire d'abord ; sinon (joueur créé par un autre worker et pas
+    # encore relu, par exemple) une lecture par clé primaire
+    leaderboard = leaderboards.get(game_id)
+    if leaderboard is not None and user_id in leaderboard:
+        return True
+    user = await run_db(db.query(UserDB.id).filter(UserDB.id == user_id, UserDB.game_id == game_id).first)
+    return user is not None
+
+
 @app.post("/games/{game_id}/solves", summary="Créé une validation", response_model=Solve)
-async def update_solve(game_id: str, user_id: int, keypoint_id: int, db: Session = Depends(get_db)):
-    solve = SolveDB(keypoint_id=keypoint_id, user_id=user_id, game_id=game_id)
-    db_session.add(solve)
-    db_session.commit()
-    db_session.refresh(solve)
+async def update_solve(game_id: str, user_id: int, keypoint_id: int, response: Response, db: Session = Depends(get_game_db)):
+    # Les points sont ceux du point clé, jamais fournis par le client
+    keypoint = solutions.get(game_id, keypoint_id)
+    if keypoint is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    points = keypoint[1]
+    created_at = int(time.time())
+    solve = Solve(keypoint_id=keypoint_id, user_id=user_id, game_id=game_id, created_at=created_at)
+    if SOLVE_INGEST == "batched":
+        # Acquittée tout de suite, écrite avec le prochain lot ; un joueur inconnu serait
+        # ignoré sans bruit par le lot, il est refusé avant
+        if not await user_exists(db, game_id, user_id):
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+        await solve_ingestor.submit(game_id, user_id, keypoint_id, points, created_at)
+        response.status_code = HTTP_202_ACCEPTED
+        return solve
+
+    try:
+        await run_db(record_solve, db, game_id=game_id, user_id=user_id, keypoint_id=keypoint_id, points=points, created_at=created_at)
+    except UnknownUser:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    except AlreadySolved:
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Point clé déjà résolu par ce joueur")
+    solves_committed([PendingSolve(game_id, user_id, keypoint_id, points)])
     return solve
 
+
+@app.post("/games/{game_id}/scores/recompute", summary="Recalcule les scores des joueurs de la partie à partir des résolutions")
+async def recompute_scores(game_id: str, db: Session = Depends(get_game_db)):
+    game = await run_db(db.query(GameDB.id).filter(GameDB.id == game_id).first)
+    if game is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    updated = await run_db(recompute_points, db, game_id)
+    users = await run_db(
+        db.query(UserDB.id, UserDB.name, UserDB.points)
+        .filter(UserDB.game_id == game_id)
+        .all
+    )
+    leaderboards.load(game_id, users)
+    game_versions.bump(game_id)
+    broadcaster.publish(game_id, "scores_recomputed", {"users": updated})
+    return {"users": updated}
+
+
+@app.post("/games/{game_id}/archive", summary="Termine la partie : fige les scores et l'archive en lecture seule", response_model=List[LeaderboardEntry])
+async def archive_game_now(game_id: str):
+    if game_id in game_archive:
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Partie déjà archivée")
+    snapshot = await game_lifecycle.archive_game(game_id)
+    if snapshot is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    return (await game_archive.get(game_id)).ranking
+
+
+@app.post("/games/{game_id}/keypoints/{keypoint_id}/attempts", summary="Vérifie la réponse d'un joueur et valide le point clé si elle est correcte", response_model=AttemptResult)
+async def create_attempt(game_id: str, keypoint_id: int, user_id: int, answer: str, db: Session = Depends(get_game_db)):
+    # Les mauvaises réponses sont vérifiées sans accès à la base
+    correct = solutions.check(game_id, keypoint_id, answer)
+    if correct is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    if not correct:
+        return AttemptResult(correct=False)
+
+    points = solutions.get(game_id, keypoint_id)[1]
+    created_at = int(time.time())
+    solve = Solve(keypoint_id=keypoint_id, user_id=user_id, game_id=game_id, created_at=created_at)
+    if SOLVE_INGEST == "batched":
+        # Acquittée tout de suite ; un doublon ne rapporte les points qu'une fois
+        if not await user_exists(db, game_id, user_id):
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+        await solve_ingestor.submit(game_id, user_id, keypoint_id, points, created_at)
+        return AttemptResult(correct=True, points=points, solve=solve, pending=True)
+
+    try:
+        await run_db(record_solve, db, game_id=game_id, user_id=user_id, keypoint_id=keypoint_id, points=points, created_at=created_at)
+    except UnknownUser:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    except AlreadySolved:
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Point clé déjà résolu par ce joueur")
+    solves_committed([PendingSolve(game_id, user_id, keypoint_id, points)])
+    return AttemptResult(correct=True, points=points, solve=solve)
+
 # ------------------------- DELETE ------------------------------
 
 
 @app.delete("/games/{game_id}", summary="Supprime une partie")
 async def delete_game(
         game_id: str,
-        db: Session = Depends(get_db)):
+        db: Session = Depends(get_game_db)):
     try:
-        game = db_session.query(GameDB).filter(GameDB.id == game_id).first()
-        db_session.delete(game)
-        db_session.commit()
+        game = await run_db(db.query(GameDB).filter(GameDB.id == game_id).first)
+        await run_db(db.delete, game)
+        await run_db(db.commit)
     except:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    game_versions.bump(game_id)
+    game_lifecycle.cancel(game_id)
+    leaderboards.drop(game_id)
+    spatial_indexes.drop(game_id)
+    solutions.drop(game_id)
+    broadcaster.publish(game_id, "game_deleted", {"game_id": game_id})
 
 
 @app.delete("/games/{game_id}/users/{user_id}", summary="Supprime un user")
 async def delete_user(
         game_id: str,
         user_id: int,
-        db: Session = Depends(get_db)):
+        db: Session = Depends(get_game_db)):
     try:
-        user = db_session.query(UserDB).filter(
-            UserDB.id == user_id).filter(UserDB.game_id == game_id).first()
-        db_session.delete(user)
-        db_session.commit()
+        user = await run_db(db.query(UserDB).filter(
+            UserDB.id == user_id).filter(UserDB.game_id == game_id).first)
+        await run_db(db.delete, user)
+        await run_db(db.commit)
     except:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    game_versions.bump(game_id)
+    leaderboards.remove(game_id, user_id)
+    broadcaster.publish(game_id, "player_left", {"user_id": user_id})
 
 
 @app.delete("/games/{game_id}/keypoints/{keypoint_id}", summary="Supprime un keypoint")
 async def delete_keypoint(
         game_id: str,
         keypoint_id: int,
-        db: Session = Depends(get_db)):
+        db: Session = Depends(get_game_db)):
     try:
-        keypoint = db_session.query(KeypointDB).filter(
-            KeypointDB.id == keypoint_id).filter(KeypointDB.game_id == game_id).first()
-        db_session.delete(keypoint)
-        db_session.commit()
+        keypoint = await run_db(db.query(KeypointDB).filter(
+            KeypointDB.id == keypoint_id).filter(KeypointDB.game_id == game_id).first)
+        await run_db(db.delete, keypoint)
+        await run_db(db.commit)
     except:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+    game_versions.bump(game_id)
+    spatial_indexes.remove(game_id, keypoint_id)
+    solutions.remove(game_id, keypoint_id)
+    publish_keypoint(game_id, keypoint_id)
 
 
 # ---------------------------- PUT --------------------------------------------
@@ -424,18 +1199,21 @@ async def delete_keypoint(
 async def update_game(
     game_id: str,
     updates: PutGame,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_game_db)
 ):
 
-    game = get_game(db, game_id=game_id)
+    game = await get_game(db, game_id=game_id)
     if game is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
 
     for key, value in updates.dict().items():
         if value is not None:
             setattr(game, key, value)
-    db.commit()
-    db.refresh(game)
+    await run_db(db.commit)
+    game_versions.bump(game_id)
+    # Rechargement avec les relations pour ne pas les charger depuis la boucle
+    game = await get_game(db, game_id=game_id)
+    game_lifecycle.schedule(game_id, game.time_start, game.duration)
     return game
 
 
@@ -444,18 +1222,37 @@ async def update_game(
     game_id: str,
     keypoint_id: int,
     updates: PutKeypoint,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_game_db)
 ):
 
-    keypoint = get_keypoint(db, game_id=game_id, keypoint_id=keypoint_id)
+    keypoint = await get_keypoint(db, game_id=game_id, keypoint_id=keypoint_id)
     if keypoint is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
 
     for key, value in updates.dict().items():
         if value is not None:
             setattr(keypoint, key, value)
-    db.commit()
-    db.refresh(keypoint)
+    await run_db(db.commit)
+    keypoint = await get_keypoint(db, game_id=game_id, keypoint_id=keypoint_id)
+    game_versions.bump(game_id)
+    spatial_indexes.upsert(game_id, keypoint.id, keypoint.latitude, keypoint.longitude)
+    solutions.set(game_id, keypoint.id, keypoint.solution, keypoint.points)
+    publish_keypoint(game_id, keypoint.id, keypoint)
+    return keypoint
+
+
+@app.put("/games/{game_id}/keypoints/{keypoint_id}/image", summary="Envoie l'image cible d'un keypoint (corps brut de la requête)", response_model=Keypoint)
+async def update_keypoint_image(game_id: str, keypoint_id: int, request: Request, db: Session = Depends(get_game_db)):
+    keypoint = await get_keypoint(db, game_id=game_id, keypoint_id=keypoint_id)
+    if keypoint is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND)
+
+    stored = await receive_asset(request)
+    keypoint.url_cible = "/assets/" + stored.name
+    await run_db(db.commit)
+    keypoint = await get_keypoint(db, game_id=game_id, keypoint_id=keypoint_id)
+    game_versions.bump(game_id)
+    publish_keypoint(game_id, keypoint.id, keypoint)
     return keypoint
 
 
@@ -464,17 +1261,32 @@ async def update_game(
     game_id: str,
     user_id: int,
     updates: PutUser,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_game_db)
 ):
 
-    user = get_user(db, game_id=game_id, user_id=user_id)
+    user = await get_user(db, game_id=game_id, user_id=user_id)
     if user is None:
         raise HTTPException(status_code=HTTP_404_NOT_FOUND)
-    for key, value in updates.dict().items():
+    changes = updates.dict()
+    points_delta = changes.pop("points_delta")
+    for key, value in changes.items():
         if value is not None:
             setattr(user, key, value)
-    db.commit()
-    db.refresh(user)
+    if points_delta:
+        # Ajoutée par la base, comme les points des résolutions : pas de relecture-écriture
+        await run_db(
+            db.query(UserDB)
+            .filter(UserDB.id == user_id, UserDB.game_id == game_id)
+            .update,
+            {UserDB.points: UserDB.points + points_delta},
+            synchronize_session=False,
+        )
+    await run_db(db.commit)
+    user = await get_user(db, game_id=game_id, user_id=user_id)
+    game_versions.bump(game_id)
+    leaderboards.update(game_id, user.id, user.name, user.points)
+    publish_score(game_id, user.id)
     return user
 if __name__ == '__main__':
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,240 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Métriques au format texte de Prometheus, exposées par GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "no")
+
+# Bornes (en s) des histogrammes de latence
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requêtes qui ne correspondent à aucune route : un seul libellé, pour borner le nombre de séries
+UNMATCHED_ROUTE = "<unmatched>"
+# Nombre de chemins dont la route est gardée en cache par le middleware
+ROUTE_CACHE_SIZE = 4096
+
+# Premier mot-clé et première table d'une requête SQL
+_STATEMENT = re.compile(r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE)\s+\"?(\w+))?", re.IGNORECASE | re.DOTALL)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Un compteur par borne, plus un pour +Inf ; cumulés seulement à l'export
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels)
+
+
+@lru_cache(maxsize=1024)
+def statement_kind(statement: str) -> Tuple[str, str]:
+    match = _STATEMENT.match(statement)
+    if match is None:
+        return "OTHER", ""
+    return match.group(1).upper(), (match.group(2) or "").lower()
+
+
+class Metrics:
+    # Compteurs, jauges et histogrammes en mémoire du processus. Les métriques HTTP ne
+    # sont modifiées que depuis la boucle d'évènements, les métriques SQL depuis les
+    # threads de run_db (protégées par un verrou).
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.sql_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.sql_errors: Dict[Tuple[str, str], int] = {}
+        self.collectors: List[Tuple[str, str, str, Callable[[], Dict[Labels, float]]]] = []
+        self._sql_lock = threading.Lock()
+        self._instrumented = set()
+
+    def request_started(self, method: str, route: str):
+        key = (method, route)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+    def request_finished(self, method: str, route: str, status: int, duration: float):
+        key = (method, route)
+        self.in_flight[key] -= 1
+        counter = (method, route, status)
+        self.requests[counter] = self.requests.get(counter, 0) + 1
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+        histogram.observe(duration)
+
+    def observe_sql(self, statement: str, duration: float):
+        key = statement_kind(statement)
+        with self._sql_lock:
+            histogram = self.sql_latency.get(key)
+            if histogram is None:
+                histogram = self.sql_latency[key] = Histogram()
+            histogram.observe(duration)
+
+    def sql_failed(self, statement: str):
+        key = statement_kind(statement)
+        with self._sql_lock:
+            self.sql_errors[key] = self.sql_errors.get(key, 0) + 1
+
+    def register(self, name: str, help_text: str, collect: Callable[[], Dict[Labels, float]], kind: str = "gauge"):
+        # Valeurs tenues ailleurs (pool, cache...) : collect est appelé à chaque
+        # lecture de /metrics et renvoie {labels: valeur}
+        self.collectors.append((name, help_text, kind, collect))
+
+    def instrument_engine(self, engine):
+        # Temps de chaque requête SQL, mesuré autour de l'appel au curseur DB-API
+        if id(engine) in self._instrumented:
+            return
+        self._instrumented.add(id(engine))
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info["metrics_started"].pop()
+            self.observe_sql(statement, time.perf_counter() - started)
+
+        @event.listens_for(engine, "handle_error")
+        def _handle_error(context):
+            started = context.connection.info.get("metrics_started") if context.connection is not None else None
+            if started:
+                started.pop()
+            self.sql_failed(context.statement or "")
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def header(name: str, help_text: str, kind: str):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        def histogram(name: str, label_names: Tuple[str, ...], histograms: Dict[tuple, Histogram]):
+            for key, values in sorted(histograms.items()):
+                labels = tuple(zip(label_names, key))
+                cumulative = 0
+                for bound, count in zip(values.buckets, values.counts):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (name, _format_labels(labels + (("le", repr(bound)),)), cumulative))
+                lines.append("%s_bucket%s %d" % (name, _format_labels(labels + (("le", "+Inf"),)), values.count))
+                lines.append("%s_sum%s %.6f" % (name, _format_labels(labels), values.sum))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels), values.count))
+
+        header("http_requests_total", "Requêtes HTTP traitées, par route et code de retour", "counter")
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append("http_requests_total%s %d" % (_format_labels((("method", method), ("route", route), ("status", str(status)))), count))
+
+        header("http_requests_in_flight", "Requêtes HTTP en cours de traitement", "gauge")
+        for (method, route), count in sorted(self.in_flight.items()):
+            lines.append("http_requests_in_flight%s %d" % (_format_labels((("method", method), ("route", route))), count))
+
+        header("http_request_duration_seconds", "Durée de traitement des requêtes HTTP", "histogram")
+        histogram("http_request_duration_seconds", ("method", "route"), self.latency)
+
+        with self._sql_lock:
+            sql_latency = {key: _copy(values) for key, values in self.sql_latency.items()}
+            sql_errors = dict(self.sql_errors)
+        header("db_statement_duration_seconds", "Durée des requêtes SQL, par type de requête et table", "histogram")
+        histogram("db_statement_duration_seconds", ("statement", "table"), sql_latency)
+        header("db_statement_errors_total", "Requêtes SQL en erreur", "counter")
+        for (statement, table), count in sorted(sql_errors.items()):
+            lines.append("db_statement_errors_total%s %d" % (_format_labels((("statement", statement), ("table", table))), count))
+
+        for name, help_text, kind, collect in self.collectors:
+            header(name, help_text, kind)
+            for labels, value in sorted(collect().items()):
+                lines.append("%s%s %s" % (name, _format_labels(labels), _format_number(value)))
+        return "\n".join(lines) + "\n"
+
+
+def _copy(histogram: Histogram) -> Histogram:
+    copy = Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
+
+
+def _format_number(value: float) -> str:
+    return "%d" % value if float(value).is_integer() else "%.6f" % value
+
+
+class MetricsMiddleware:
+    # Middleware ASGI « pur » (pas BaseHTTPMiddleware) : ni tâche ni file en plus par
+    # requête, seulement deux horodatages et quelques accès à des dictionnaires.
+
+    def __init__(self, app, metrics: Metrics, cache_size: int = ROUTE_CACHE_SIZE):
+        self.app = app
+        self.metrics = metrics
+        self.cache_size = cache_size
+        # (méthode, chemin) -> gabarit de la route (/games/{game_id}/users), pour ne pas
+        # créer une série par id ; les chemins sondés en boucle par les joueurs y restent.
+        self._routes: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    def _route(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        template = self._routes.get(key)
+        if template is not None:
+            self._routes.move_to_end(key)
+            return template
+        template = UNMATCHED_ROUTE
+        for route in scope["app"].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                template = route.path
+                break
+            if match == Match.PARTIAL and template == UNMATCHED_ROUTE:
+                # Bon chemin mais mauvaise méthode (405)
+                template = route.path
+        self._routes[key] = template
+        if len(self._routes) > self.cache_size:
+            self._routes.popitem(last=False)
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.request_started(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.request_finished(method, route, status, time.perf_counter() - started)
+
+
+metrics = Metrics()
@@ -0,0 +1,507 @@
+import argparse
+import sys
+import time
+from typing import Callable, List, NamedTuple
+
+from database import SHARDS, get_engine
+
+# Migrations versionnées du schéma SQLite. Elles sont appliquées une seule fois, avant
+# le lancement du serveur (`python migrations.py`), et jamais à l'import de l'application.
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable
+    # Les reconstructions de tables se font clés étrangères désactivées
+    foreign_keys_off: bool = False
+
+
+def _execute_all(cursor, statements: List[str]):
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def initial_schema(cursor):
+    # Schéma tel que créé par Base.metadata.create_all : sans effet sur une base existante
+    _execute_all(cursor, [
+        """CREATE TABLE IF NOT EXISTS games (
+            id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            visibility BOOLEAN NOT NULL,
+            duration INTEGER,
+            time_start INTEGER NOT NULL,
+            nb_player_max INTEGER,
+            PRIMARY KEY (id),
+            UNIQUE (name),
+            CHECK (visibility IN (0, 1))
+        )""",
+        """CREATE TABLE IF NOT EXISTS solves (
+            user_id INTEGER NOT NULL,
+            keypoint_id INTEGER NOT NULL,
+            game_id VARCHAR NOT NULL,
+            PRIMARY KEY (user_id, keypoint_id, game_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS keypoints (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            description VARCHAR NOT NULL,
+            solution VARCHAR NOT NULL,
+            points INTEGER NOT NULL,
+            latitude FLOAT,
+            longitude FLOAT,
+            url_cible VARCHAR,
+            game_id VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (name),
+            FOREIGN KEY(game_id) REFERENCES games (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            points INTEGER NOT NULL,
+            game_id VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (name),
+            FOREIGN KEY(game_id) REFERENCES games (id)
+        )""",
+    ])
+
+
+def game_scoped_constraints(cursor):
+    # Noms uniques par partie (et non plus dans toute la base) et clés étrangères
+    # sur solves, supprimées en cascade avec le joueur, le point clé ou la partie.
+    # SQLite ne sait pas modifier une contrainte : les tables sont reconstruites.
+
+    # Lignes orphelines laissées par les suppressions, sans clé étrangère jusqu'ici
+    _execute_all(cursor, [
+        "DELETE FROM keypoints WHERE game_id NOT IN (SELECT id FROM games)",
+        "DELETE FROM users WHERE game_id NOT IN (SELECT id FROM games)",
+        """DELETE FROM solves
+        WHERE user_id NOT IN (SELECT id FROM users)
+        OR keypoint_id NOT IN (SELECT id FROM keypoints)
+        OR game_id NOT IN (SELECT id FROM games)""",
+    ])
+    _execute_all(cursor, [
+        """CREATE TABLE keypoints_new (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            description VARCHAR NOT NULL,
+            solution VARCHAR NOT NULL,
+            points INTEGER NOT NULL,
+            latitude FLOAT,
+            longitude FLOAT,
+            url_cible VARCHAR,
+            game_id VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            CONSTRAINT uq_keypoints_game_name UNIQUE (game_id, name),
+            FOREIGN KEY(game_id) REFERENCES games (id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO keypoints_new (id, name, description, solution, points, latitude, longitude, url_cible, game_id)
+        SELECT id, name, description, solution, points, latitude, longitude, url_cible, game_id FROM keypoints""",
+        "DROP TABLE keypoints",
+        "ALTER TABLE keypoints_new RENAME TO keypoints",
+
+        """CREATE TABLE users_new (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            points INTEGER NOT NULL,
+            game_id VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            CONSTRAINT uq_users_game_name UNIQUE (game_id, name),
+            FOREIGN KEY(game_id) REFERENCES games (id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO users_new (id, name, points, game_id)
+        SELECT id, name, points, game_id FROM users""",
+        "DROP TABLE users",
+        "ALTER TABLE users_new RENAME TO users",
+
+        """CREATE TABLE solves_new (
+            user_id INTEGER NOT NULL,
+            keypoint_id INTEGER NOT NULL,
+            game_id VARCHAR NOT NULL,
+            PRIMARY KEY (user_id, keypoint_id, game_id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY(keypoint_id) REFERENCES keypoints (id) ON DELETE CASCADE,
+            FOREIGN KEY(game_id) REFERENCES games (id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO solves_new (user_id, keypoint_id, game_id)
+        SELECT user_id, keypoint_id, game_id FROM solves""",
+        "DROP TABLE solves",
+        "ALTER TABLE solves_new RENAME TO solves",
+    ])
+
+
+def lookup_indexes(cursor):
+    _execute_all(cursor, [
+        # Points clefs et joueurs d'une partie, triés par id (pagination par curseur)
+        "CREATE INDEX IF NOT EXISTS ix_keypoints_game_id ON keypoints (game_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_users_game_id ON users (game_id, id)",
+        # Résolutions d'une partie par joueur (GET /games/{id}/solves, points clefs résolus)
+        "CREATE INDEX IF NOT EXISTS ix_solves_game_user ON solves (game_id, user_id, keypoint_id)",
+        # Joueurs ayant résolu un point clé, et suppression en cascade d'un point clé
+        "CREATE INDEX IF NOT EXISTS ix_solves_keypoint ON solves (keypoint_id, game_id)",
+    ])
+
+
+def _change_trigger(table: str, event: str, row: str, entity: str, entity_id: str, related_id: str = "0") -> str:
+    # Un compteur par partie (change_versions) est incrémenté, puis la ligne de
+    # l'entité dans changes est remplacée : seule la dernière modification compte.
+    # Pas de INSERT OR REPLACE : le OR IGNORE de l'instruction déclenchante
+    # s'appliquerait aussi à celles du déclencheur.
+    deleted = 1 if event == "DELETE" else 0
+    return """CREATE TRIGGER IF NOT EXISTS tr_{table}_{event_name}_changes AFTER {event} ON {table}
+        BEGIN
+            UPDATE change_versions SET seq = seq + 1 WHERE game_id = {row}.game_id;
+            DELETE FROM changes
+            WHERE game_id = {row}.game_id AND entity = '{entity}' AND entity_id = {entity_id} AND related_id = {related_id};
+            INSERT INTO changes (game_id, entity, entity_id, related_id, seq, deleted)
+            SELECT game_id, '{entity}', {entity_id}, {related_id}, seq, {deleted} FROM change_versions WHERE game_id = {row}.game_id;
+        END""".format(
+        table=table, event=event, event_name=event.lower(), row=row, entity=entity,
+        entity_id=entity_id, related_id=related_id, deleted=deleted,
+    )
+
+
+def change_log(cursor):
+    # Journal des modifications, tenu par la base elle-même : toute écriture (routes,
+    # imports, lots de résolutions, scripts) fait avancer la version de sa partie.
+    _execute_all(cursor, [
+        """CREATE TABLE IF NOT EXISTS change_versions (
+            game_id VARCHAR NOT NULL,
+            seq INTEGER NOT NULL,
+            PRIMARY KEY (game_id)
+        )""",
+        # entity : game, keypoint, user ou solve ; related_id : point clé d'une résolution
+        """CREATE TABLE IF NOT EXISTS changes (
+            game_id VARCHAR NOT NULL,
+            entity VARCHAR NOT NULL,
+            entity_id INTEGER NOT NULL,
+            related_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            deleted BOOLEAN NOT NULL,
+            PRIMARY KEY (game_id, entity, entity_id, related_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_changes_game_seq ON changes (game_id, seq)",
+        # Les parties existantes partent de la version 1
+        "INSERT OR IGNORE INTO change_versions (game_id, seq) SELECT id, 1 FROM games",
+        """CREATE TRIGGER IF NOT EXISTS tr_games_insert_changes AFTER INSERT ON games
+        BEGIN
+            INSERT INTO change_versions (game_id, seq) VALUES (NEW.id, 1);
+            INSERT INTO changes (game_id, entity, entity_id, related_id, seq, deleted) VALUES (NEW.id, 'game', 0, 0, 1, 0);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_games_update_changes AFTER UPDATE ON games
+        BEGIN
+            UPDATE change_versions SET seq = seq + 1 WHERE game_id = NEW.id;
+            DELETE FROM changes WHERE game_id = NEW.id AND entity = 'game';
+            INSERT INTO changes (game_id, entity, entity_id, related_id, seq, deleted)
+            SELECT game_id, 'game', 0, 0, seq, 0 FROM change_versions WHERE game_id = NEW.id;
+        END""",
+        # Déclenché après la suppression en cascade des lignes filles
+        """CREATE TRIGGER IF NOT EXISTS tr_games_delete_changes AFTER DELETE ON games
+        BEGIN
+            DELETE FROM changes WHERE game_id = OLD.id;
+            DELETE FROM change_versions WHERE game_id = OLD.id;
+        END""",
+        _change_trigger("keypoints", "INSERT", "NEW", "keypoint", "NEW.id"),
+        _change_trigger("keypoints", "UPDATE", "NEW", "keypoint", "NEW.id"),
+        _change_trigger("keypoints", "DELETE", "OLD", "keypoint", "OLD.id"),
+        _change_trigger("users", "INSERT", "NEW", "user", "NEW.id"),
+        _change_trigger("users", "UPDATE", "NEW", "user", "NEW.id"),
+        _change_trigger("users", "DELETE", "OLD", "user", "OLD.id"),
+        _change_trigger("solves", "INSERT", "NEW", "solve", "NEW.user_id", "NEW.keypoint_id"),
+        _change_trigger("solves", "DELETE", "OLD", "solve", "OLD.user_id", "OLD.keypoint_id"),
+    ])
+
+
+def _feed_trigger(event: str, row: str) -> str:
+    # Chaque changement de version d'une partie prend le numéro suivant du compteur
+    # de la base : un seul numéro croissant pour toutes les parties. Une partie créée
+    # remplace la ligne laissée par une partie supprimée de même id.
+    if event == "UPDATE":
+        # Le cas fréquent (une ligne par écriture) : la ligne de la partie existe déjà
+        refresh = "UPDATE game_feed SET feed = (SELECT value FROM feed_counter) WHERE game_id = NEW.game_id;"
+    else:
+        refresh = """DELETE FROM game_feed WHERE game_id = {row}.game_id;
+            INSERT INTO game_feed (game_id, feed) SELECT {row}.game_id, value FROM feed_counter;""".format(row=row)
+    return """CREATE TRIGGER IF NOT EXISTS tr_change_versions_{event_name}_feed AFTER {event} ON change_versions
+        BEGIN
+            UPDATE feed_counter SET value = value + 1;
+            {refresh}
+        END""".format(event=event, event_name=event.lower(), refresh=refresh)
+
+
+def change_feed(cursor):
+    # Fil des modifications commun aux workers (coherence.py) : game_feed donne, pour
+    # chaque partie, le numéro de sa dernière modification (ou de sa suppression), et
+    # game_events relaie les évènements publiés par un worker vers les abonnés des autres.
+    _execute_all(cursor, [
+        """CREATE TABLE IF NOT EXISTS feed_counter (
+            id INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            epoch VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            CHECK (id = 1)
+        )""",
+        # epoch distingue les ETags d'une base recréée, dont le compteur repart de 0
+        "INSERT OR IGNORE INTO feed_counter (id, value, epoch) VALUES (1, 0, lower(hex(randomblob(4))))",
+        """CREATE TABLE IF NOT EXISTS game_feed (
+            game_id VARCHAR NOT NULL,
+            feed INTEGER NOT NULL,
+            PRIMARY KEY (game_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_game_feed_feed ON game_feed (feed)",
+        "INSERT OR IGNORE INTO game_feed (game_id, feed) SELECT game_id, 0 FROM change_versions",
+        _feed_trigger("INSERT", "NEW"),
+        _feed_trigger("UPDATE", "NEW"),
+        _feed_trigger("DELETE", "OLD"),
+        # origin : worker qui a publié l'évènement ; key : clé de regroupement (JSON)
+        # AUTOINCREMENT : un id n'est jamais réutilisé après la purge des anciens évènements
+        """CREATE TABLE IF NOT EXISTS game_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id VARCHAR NOT NULL,
+            origin VARCHAR NOT NULL,
+            payload VARCHAR NOT NULL,
+            key VARCHAR,
+            created_at INTEGER NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_game_events_created ON game_events (created_at)",
+    ])
+
+
+def game_analytics(cursor):
+    # Statistiques des parties (analytics.py) : résolutions horodatées, et agrégats tenus
+    # à jour par des déclencheurs dans la transaction de chaque écriture, quelle qu'en
+    # soit l'origine. Les temps de résolution sont comptés par tranche d'une minute
+    # (created_at / 60) : une médiane se lit sans parcourir les résolutions.
+    _execute_all(cursor, [
+        # Les résolutions déjà en base restent sans date
+        "ALTER TABLE solves ADD COLUMN created_at INTEGER",
+        """CREATE TABLE IF NOT EXISTS game_stats (
+            game_id VARCHAR NOT NULL,
+            players INTEGER NOT NULL,
+            PRIMARY KEY (game_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS keypoint_stats (
+            game_id VARCHAR NOT NULL,
+            keypoint_id INTEGER NOT NULL,
+            solves INTEGER NOT NULL,
+            PRIMARY KEY (game_id, keypoint_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS solve_times (
+            game_id VARCHAR NOT NULL,
+            keypoint_id INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            solves INTEGER NOT NULL,
+            PRIMARY KEY (game_id, keypoint_id, minute)
+        )""",
+        # Parties existantes
+        "INSERT INTO game_stats (game_id, players) SELECT game_id, count(*) FROM users GROUP BY game_id",
+        "INSERT INTO keypoint_stats (game_id, keypoint_id, solves) SELECT game_id, keypoint_id, count(*) FROM solves GROUP BY game_id, keypoint_id",
+        """CREATE TRIGGER IF NOT EXISTS tr_users_insert_stats AFTER INSERT ON users
+        BEGIN
+            INSERT INTO game_stats (game_id, players) SELECT NEW.game_id, 0
+            WHERE NOT EXISTS (SELECT 1 FROM game_stats WHERE game_id = NEW.game_id);
+            UPDATE game_stats SET players = players + 1 WHERE game_id = NEW.game_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_users_delete_stats AFTER DELETE ON users
+        BEGIN
+            UPDATE game_stats SET players = players - 1 WHERE game_id = OLD.game_id;
+        END""",
+        # Pas de OR IGNORE pour créer les lignes d'agrégat : le conflit de l'instruction
+        # déclenchante s'appliquerait aussi (voir _change_trigger)
+        """CREATE TRIGGER IF NOT EXISTS tr_solves_insert_stats AFTER INSERT ON solves
+        BEGIN
+            INSERT INTO keypoint_stats (game_id, keypoint_id, solves) SELECT NEW.game_id, NEW.keypoint_id, 0
+            WHERE NOT EXISTS (SELECT 1 FROM keypoint_stats WHERE game_id = NEW.game_id AND keypoint_id = NEW.keypoint_id);
+            UPDATE keypoint_stats SET solves = solves + 1 WHERE game_id = NEW.game_id AND keypoint_id = NEW.keypoint_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_solves_insert_times AFTER INSERT ON solves WHEN NEW.created_at IS NOT NULL
+        BEGIN
+            INSERT INTO solve_times (game_id, keypoint_id, minute, solves) SELECT NEW.game_id, NEW.keypoint_id, NEW.created_at / 60, 0
+            WHERE NOT EXISTS (
+                SELECT 1 FROM solve_times WHERE game_id = NEW.game_id AND keypoint_id = NEW.keypoint_id AND minute = NEW.created_at / 60
+            );
+            UPDATE solve_times SET solves = solves + 1
+            WHERE game_id = NEW.game_id AND keypoint_id = NEW.keypoint_id AND minute = NEW.created_at / 60;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_solves_delete_stats AFTER DELETE ON solves
+        BEGIN
+            UPDATE keypoint_stats SET solves = solves - 1 WHERE game_id = OLD.game_id AND keypoint_id = OLD.keypoint_id;
+            UPDATE solve_times SET solves = solves - 1
+            WHERE game_id = OLD.game_id AND keypoint_id = OLD.keypoint_id AND minute = OLD.created_at / 60;
+        END""",
+        # Déclenchés après la suppression en cascade des résolutions
+        """CREATE TRIGGER IF NOT EXISTS tr_keypoints_delete_stats AFTER DELETE ON keypoints
+        BEGIN
+            DELETE FROM keypoint_stats WHERE game_id = OLD.game_id AND keypoint_id = OLD.id;
+            DELETE FROM solve_times WHERE game_id = OLD.game_id AND keypoint_id = OLD.id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS tr_games_delete_stats AFTER DELETE ON games
+        BEGIN
+            DELETE FROM game_stats WHERE game_id = OLD.id;
+        END""",
+    ])
+
+
+MIGRATIONS = [
+    Migration(1, "schéma initial", initial_schema),
+    Migration(2, "contraintes par partie et clés étrangères", game_scoped_constraints, foreign_keys_off=True),
+    Migration(3, "index de recherche par partie", lookup_indexes),
+    Migration(4, "journal des modifications par partie", change_log),
+    Migration(5, "fil des modifications commun aux workers", change_feed),
+    Migration(6, "statistiques des parties", game_analytics),
+]
+
+
+def _ensure_version_table(cursor):
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER NOT NULL PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at INTEGER NOT NULL
+        )"""
+    )
+
+
+def applied_versions(cursor) -> List[int]:
+    _ensure_version_table(cursor)
+    return [row[0] for row in cursor.execute("SELECT version FROM schema_migrations ORDER BY version")]
+
+
+def _apply(dbapi_connection, migration: Migration):
+    cursor = dbapi_connection.cursor()
+    if migration.foreign_keys_off:
+        # Sans effet dans une transaction : à faire avant BEGIN
+        cursor.execute("PRAGMA foreign_keys=OFF")
+    try:
+        # IMMEDIATE : deux lanceurs simultanés ne peuvent pas appliquer la même migration
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if migration.version in applied_versions(cursor):
+                cursor.execute("ROLLBACK")
+                return False
+            migration.upgrade(cursor)
+            violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise RuntimeError("Clés étrangères invalides après la migration %d : %r" % (migration.version, violations[:10]))
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (migration.version, migration.name, int(time.time())),
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+    finally:
+        if migration.foreign_keys_off:
+            cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+    return True
+
+
+def migrate(bind=None, target: int = None) -> List[Migration]:
+    # Applique dans l'ordre les migrations manquantes, chacune dans sa transaction
+    connection = (bind or get_engine()).raw_connection()
+    # Transactions gérées explicitement (le module sqlite3 n'ouvre pas de transaction avant un DDL)
+    isolation_level = connection.connection.isolation_level
+    connection.connection.isolation_level = None
+    applied = []
+    try:
+        for migration in MIGRATIONS:
+            if target is not None and migration.version > target:
+                break
+            if _apply(connection.connection, migration):
+                applied.append(migration)
+    finally:
+        connection.connection.isolation_level = isolation_level
+        connection.close()
+    return applied
+
+
+def migrate_shards(target: int = None) -> List[List[Migration]]:
+    # Chaque base de la répartition (SHARDS) a son propre schéma, migré à son tour
+    return [migrate(get_engine(shard), target) for shard in range(SHARDS)]
+
+
+def current_version(bind=None) -> int:
+    connection = (bind or get_engine()).raw_connection()
+    try:
+        cursor = connection.cursor()
+        versions = applied_versions(cursor)
+        connection.commit()
+        return versions[-1] if versions else 0
+    finally:
+        connection.close()
+
+
+# Requêtes des routes les plus appelées, avec des paramètres d'exemple
+HOT_QUERIES = {
+    "points clefs d'une partie": (
+        "SELECT * FROM keypoints WHERE game_id = ? AND id > ? ORDER BY id LIMIT ?", ("G", 0, 100)),
+    "joueurs d'une partie": (
+        "SELECT * FROM users WHERE game_id = ? AND id > ? ORDER BY id LIMIT ?", ("G", 0, 100)),
+    "résolutions d'une partie": (
+        "SELECT * FROM solves WHERE game_id = ? AND (user_id > ? OR (user_id = ? AND keypoint_id > ?))"
+        " ORDER BY user_id, keypoint_id LIMIT ?", ("G", 0, 0, 0, 100)),
+    "joueurs ayant résolu un point clé": (
+        "SELECT users.* FROM solves JOIN users ON users.id = solves.user_id"
+        " WHERE solves.keypoint_id IN (?, ?) AND solves.game_id = ?", (1, 2, "G")),
+    "points clefs résolus par un joueur": (
+        "SELECT keypoints.* FROM solves JOIN keypoints ON keypoints.id = solves.keypoint_id"
+        " WHERE solves.user_id IN (?, ?) AND solves.game_id = ?", (1, 2, "G")),
+    "suppression en cascade d'un point clé": (
+        "DELETE FROM solves WHERE keypoint_id = ?", (1,)),
+    "suppression en cascade d'une partie": (
+        "DELETE FROM solves WHERE game_id = ?", ("G",)),
+    "statistiques des points clefs d'une partie": (
+        "SELECT keypoints.id, keypoints.name, keypoint_stats.solves FROM keypoints"
+        " LEFT JOIN keypoint_stats ON keypoint_stats.game_id = keypoints.game_id AND keypoint_stats.keypoint_id = keypoints.id"
+        " WHERE keypoints.game_id = ? ORDER BY keypoints.id", ("G",)),
+    "temps de résolution d'une partie": (
+        "SELECT keypoint_id, minute, solves FROM solve_times WHERE game_id = ? ORDER BY keypoint_id, minute", ("G",)),
+    "modifications d'une partie depuis une version": (
+        "SELECT entity, entity_id, related_id, deleted FROM changes WHERE game_id = ? AND seq > ?", ("G", 0)),
+}
+
+
+def unindexed_queries(bind=None) -> List[str]:
+    # Renvoie les étapes des plans d'exécution qui parcourent une table entière ou trient
+    connection = (bind or get_engine()).raw_connection()
+    problems = []
+    try:
+        cursor = connection.cursor()
+        for label, (query, parameters) in HOT_QUERIES.items():
+            for row in cursor.execute("EXPLAIN QUERY PLAN " + query, parameters).fetchall():
+                detail = row[-1]
+                full_scan = detail.startswith("SCAN") and "INDEX" not in detail
+                if full_scan or "TEMP B-TREE" in detail:
+                    problems.append("%s : %s" % (label, detail))
+    finally:
+        connection.close()
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrations du schéma de la base ARriddle")
+    parser.add_argument("--status", action="store_true", help="affiche la version du schéma sans rien appliquer")
+    parser.add_argument("--target", type=int, default=None, help="s'arrête à cette version")
+    parser.add_argument("--check-plans", action="store_true", help="vérifie que les requêtes fréquentes utilisent un index")
+    args = parser.parse_args()
+
+    if args.status:
+        for shard in range(SHARDS):
+            base = "Base %d : " % shard if SHARDS > 1 else ""
+            print("%sVersion du schéma : %d (dernière : %d)" % (base, current_version(get_engine(shard)), MIGRATIONS[-1].version))
+        sys.exit(0)
+    if args.check_plans:
+        problems = unindexed_queries()
+        for problem in problems:
+            print("Sans index :", problem)
+        sys.exit(1 if problems else 0)
+
+    for shard, applied in enumerate(migrate_shards(args.target)):
+        base = "Base %d : " % shard if SHARDS > 1 else ""
+        for migration in applied:
+            print("%sMigration %d appliquée : %s" % (base, migration.version, migration.name))
+        print("%sVersion du schéma : %d" % (base, current_version(get_engine(shard))))
@@ -1,13 +1,14 @@
 from __future__ import annotations
+import time
 from pydantic import BaseModel, Schema, PositiveInt
-from typing import List, Optional
+from typing import Dict, List, Optional
 from sqlalchemy import Boolean, Table, Column, Integer, String, create_engine, Float, ARRAY
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 
-class Keypoint(BaseModel):
+class KeypointSummary(BaseModel):
     id: int = Schema(..., gt=0, description="Id du points d'intérêt")
     name: str = Schema(..., min_length=1, description="Nom du point d'intérêt")
     points: int = Schema(..., description="Nombre de points")
@@ -16,23 +17,32 @@ class Keypoint(BaseModel):
     url_cible: Optional[str] = Schema(None, description="Url de l'image")
     latitude: Optional[float] = Schema(None, description = "Latitude du point clef")
     longitude: Optional[float] = Schema(None, description = "Longitude du point clef")
-    users_solvers: List[User] = Schema([], description="Utilisateurs ayant résolu le point clef")
     game_id: str = Schema(None, description="Id de la partie")
 
     class Config:
         orm_mode = True
 
 
-class User(BaseModel):
+class UserSummary(BaseModel):
     id: int = Schema(..., gt=0, description="Id de l'utilisateur")
     name: str = Schema(..., min_length=1, description="Nom de l'utilisateur")
     points: int = Schema(..., description="Nombre de points")
-    keypoints_solved: List[Keypoint] = Schema([], description="Points clefs résolus")
     game_id: str = Schema(None, description="Id de la partie")
 
     class Config:
         orm_mode = True
 
+
+# Les relations imbriquées s'arrêtent à un niveau (résumés) pour ne pas boucler
+# entre points clefs et joueurs lors de la sérialisation.
+class Keypoint(KeypointSummary):
+    users_solvers: List[UserSummary] = Schema([], description="Utilisateurs ayant résolu le point clef")
+
+
+class User(UserSummary):
+    keypoints_solved: List[KeypointSummary] = Schema([], description="Points clefs résolus")
+
+
 class Game(BaseModel):
     id: str = Schema(..., description="Id de la partie")
     name: str = Schema(..., min_length=1, description="Nom de la partie")
@@ -50,11 +60,123 @@ class Solve(BaseModel):
     keypoint_id: int = Schema(..., gt=0, description="Id du points d'intérêt")
     user_id: int = Schema(..., gt=0, description="Id de l'utilisateur")
     game_id: str = Schema(..., description="Id de la partie")
+    created_at: Optional[int] = Schema(None, description="Heure de la résolution (absente pour les résolutions antérieures à son enregistrement)")
 
 
     class Config:
         orm_mode = True
 
+class LeaderboardEntry(BaseModel):
+    rank: int = Schema(..., gt=0, description="Rang du joueur dans la partie")
+    user_id: int = Schema(..., gt=0, description="Id de l'utilisateur")
+    name: str = Schema(..., description="Nom de l'utilisateur")
+    points: int = Schema(..., description="Nombre de points")
+
+class NearbyKeypoint(Keypoint):
+    distance: float = Schema(..., ge=0, description="Distance au point de recherche (en mètres)")
+
+class AttemptResult(BaseModel):
+    correct: bool = Schema(..., description="La réponse est-elle correcte")
+    points: int = Schema(0, description="Nombre de points gagnés")
+    solve: Optional[Solve] = Schema(None, description="Résolution enregistrée si la réponse est correcte")
+    pending: bool = Schema(False, description="Résolution acquittée mais pas encore écrite en base")
+
+# ---------- Classes des statistiques d'une partie -----------------
+
+class KeypointAnalytics(BaseModel):
+    id: int = Schema(..., description="Id du points d'intérêt")
+    name: str = Schema(..., description="Nom du point d'intérêt")
+    solves: int = Schema(..., description="Nombre de joueurs ayant résolu le point clef")
+    solve_rate: float = Schema(..., description="Part des joueurs de la partie ayant résolu le point clef (de 0 à 1)")
+    median_time: Optional[int] = Schema(None, description="Temps médian (en s, à la minute près) entre le début de la partie et les résolutions")
+
+class GameAnalytics(BaseModel):
+    game_id: str = Schema(..., description="Id de la partie")
+    players: int = Schema(..., description="Nombre de joueurs")
+    solves: int = Schema(..., description="Nombre de résolutions")
+    timed_solves: int = Schema(..., description="Résolutions horodatées, seules comptées dans les temps médians")
+    solve_rate: float = Schema(..., description="Part des couples joueur / point clef résolus (de 0 à 1)")
+    median_time: Optional[int] = Schema(None, description="Temps médian (en s, à la minute près) entre le début de la partie et les résolutions")
+    keypoints: List[KeypointAnalytics] = Schema([], description="Statistiques de chaque point clef, par id")
+    least_solved: List[KeypointAnalytics] = Schema([], description="Points clefs les moins résolus, du moins résolu au plus résolu")
+
+# ---------- Classes pour la création en masse -----------------
+
+class BulkKeypoint(BaseModel):
+    name: str = Schema(..., min_length=1, description="Nom du point d'intérêt")
+    points: int = Schema(..., description="Nombre de points")
+    description: str = Schema(..., min_length=1, description="Question")
+    solution: str = Schema(..., min_length=1, description="Solution")
+    url_cible: Optional[str] = Schema(None, description="Url de l'image")
+    latitude: Optional[float] = Schema(None, description = "Latitude du point clef")
+    longitude: Optional[float] = Schema(None, description = "Longitude du point clef")
+
+class BulkUser(BaseModel):
+    name: str = Schema(..., min_length=1, description="Nom de l'utilisateur")
+    points: int = Schema(0, description="Nombre de points")
+
+class BulkGame(BaseModel):
+    name: str = Schema(..., min_length=1, description="Nom de la partie")
+    visibility: bool = Schema(..., description="Partie publique ou privée")
+    duration: Optional[int] = Schema(None, description="Durée de la partie")
+    time_start: int = Schema(..., description="Heure de début de la partie")
+    nb_player_max: Optional[int] = Schema(None, description="Nombre de joueurs max")
+    keypoints: List[BulkKeypoint] = Schema([], description="Points clefs composant la partie")
+    users: List[BulkUser] = Schema([], description="Joueurs de la partie")
+
+class GameTransferResult(BaseModel):
+    id: str = Schema(..., description="Id de la partie créée")
+    keypoints: int = Schema(..., description="Nombre de points clefs créés")
+    users: int = Schema(..., description="Nombre de joueurs créés")
+    solves: int = Schema(0, description="Nombre de résolutions créées")
+
+# ---------- Classes du paquet hors-ligne -----------------
+
+class BundleGame(BaseModel):
+    id: str = Schema(..., description="Id de la partie")
+    name: str = Schema(..., description="Nom de la partie")
+    visibility: bool = Schema(..., description="Partie publique ou privée")
+    duration: Optional[int] = Schema(None, description="Durée de la partie")
+    time_start: int = Schema(..., description="Heure de début de la partie")
+    nb_player_max: Optional[int] = Schema(None, description="Nombre de joueurs max")
+
+class BundleKeypoint(BaseModel):
+    id: int = Schema(..., description="Id du points d'intérêt")
+    name: str = Schema(..., description="Nom du point d'intérêt")
+    points: int = Schema(..., description="Nombre de points")
+    description: str = Schema(..., description="Question")
+    solution: str = Schema(..., description="Solution")
+    url_cible: Optional[str] = Schema(None, description="Url de l'image")
+    latitude: Optional[float] = Schema(None, description="Latitude du point clef")
+    longitude: Optional[float] = Schema(None, description="Longitude du point clef")
+
+class BundleUser(BaseModel):
+    id: int = Schema(..., description="Id de l'utilisateur")
+    name: str = Schema(..., description="Nom de l'utilisateur")
+    points: int = Schema(..., description="Nombre de points")
+
+class BundleDeletions(BaseModel):
+    keypoints: List[int] = Schema([], description="Ids des points clefs supprimés")
+    users: List[int] = Schema([], description="Ids des joueurs supprimés")
+    solves: List[List[int]] = Schema([], description="Résolutions supprimées, en [user_id, keypoint_id]")
+
+class GameBundle(BaseModel):
+    version: int = Schema(..., description="Version de la partie, à renvoyer dans since à la prochaine synchronisation")
+    since: Optional[int] = Schema(None, description="Version de départ des modifications (absente pour un paquet complet)")
+    full: bool = Schema(..., description="Paquet complet : remplace toutes les données locales")
+    game: Optional[BundleGame] = Schema(None, description="Partie, absente si elle n'a pas changé")
+    keypoints: List[BundleKeypoint] = Schema([], description="Points clefs ajoutés ou modifiés")
+    users: List[BundleUser] = Schema([], description="Joueurs ajoutés ou modifiés")
+    solves: List[List[int]] = Schema([], description="Résolutions ajoutées, en [user_id, keypoint_id]")
+    deleted: BundleDeletions = Schema(..., description="Entités supprimées")
+
+class Asset(BaseModel):
+    sha256: str = Schema(..., description="Empreinte SHA-256 du fichier")
+    url: str = Schema(..., description="Url de l'image")
+    content_type: str = Schema(..., description="Type MIME de l'image")
+    size: int = Schema(..., ge=0, description="Taille du fichier (en octets)")
+    variants: Dict[int, str] = Schema({}, description="Url des versions redimensionnées, par largeur (en pixels)")
+
 # ---------- Classes pour les routes PUT -----------------
 
 class PutKeypoint(BaseModel):
@@ -71,10 +193,13 @@ class PutKeypoint(BaseModel):
 
 class PutUser(BaseModel):
     name: Optional[str] = Schema(None, min_length=1, description="Nom de l'utilisateur")
-    points: Optional[int] = Schema(None, description="Nombre de points")
+    # Pas de total absolu : une correction s'ajoute au score (points = points + :delta)
+    points_delta: Optional[int] = Schema(None, description="Correction ajoutée au score du joueur")
 
     class Config:
         orm_mode = True
+        # L'ancien champ points est refusé (422) plutôt qu'ignoré sans rien dire
+        extra = "forbid"
 
 class PutGame(BaseModel):
     name: Optional[str] = Schema(None, min_length=1, description="Nom de la partie")
@@ -91,6 +216,7 @@ class PutGame(BaseModel):
 PutKeypoint.update_forward_refs()
 PutUser.update_forward_refs()
 Keypoint.update_forward_refs()
+NearbyKeypoint.update_forward_refs()
 User.update_forward_refs()
 Base = declarative_base()
 
@@ -98,27 +224,47 @@ Base = declarative_base()
 # Transcription des classes de models.py pour les rendre
 # au même format que la BdD.
 
+# Le schéma est créé et modifié par migrations.py : les contraintes et index
+# déclarés ici doivent correspondre à la dernière migration.
+
 class SolveDB(Base):
     __tablename__ = "solves"
-    user_id = Column(Integer, primary_key=True, nullable=False)
-    keypoint_id = Column(Integer, primary_key=True, nullable=False)
-    game_id = Column(String, primary_key=True, nullable=False)
+    __table_args__ = (
+        Index("ix_solves_game_user", "game_id", "user_id", "keypoint_id"),
+        Index("ix_solves_keypoint", "keypoint_id", "game_id"),
+    )
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    keypoint_id = Column(Integer, ForeignKey("keypoints.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    game_id = Column(String, ForeignKey("games.id", ondelete="CASCADE"), primary_key=True, nullable=False)
+    # Heure de la résolution (timestamp) ; NULL pour celles d'avant la migration 6
+    created_at = Column(Integer, nullable=True, default=lambda: int(time.time()))
 
 
 
 class KeypointDB(Base):
     __tablename__ = "keypoints"
+    __table_args__ = (
+        UniqueConstraint("game_id", "name", name="uq_keypoints_game_name"),
+        Index("ix_keypoints_game_id", "game_id", "id"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    name = Column(String, nullable=False, unique=True)
+    name = Column(String, nullable=False)
     description = Column(String, nullable = False)
     solution = Column(String, nullable=False)
     points = Column(Integer, nullable=False)
     latitude = Column(Float, nullable=True)    
     longitude = Column(Float, nullable=True)
     url_cible = Column(String, nullable=True)
-    game_id = Column(String, ForeignKey("games.id"), nullable=False)
+    game_id = Column(String, ForeignKey("games.id", ondelete="CASCADE"), nullable=False)
     # jointure
     game = relationship("GameDB", back_populates="keypoints")
+    users_solvers = relationship(
+        "UserDB",
+        secondary="solves",
+        primaryjoin="and_(KeypointDB.id == foreign(SolveDB.keypoint_id), KeypointDB.game_id == foreign(SolveDB.game_id))",
+        secondaryjoin="UserDB.id == foreign(SolveDB.user_id)",
+        viewonly=True,
+    )
 
 
 class GameDB(Base):
@@ -129,14 +275,26 @@ class GameDB(Base):
     duration = Column(Integer, nullable=True)
     time_start = Column(Integer, nullable=False)
     nb_player_max = Column(Integer, nullable=True)
-    keypoints = relationship("KeypointDB", back_populates="game", cascade="delete")
-    users = relationship("UserDB", back_populates="game", cascade="delete")
+    # Les lignes filles sont supprimées par la base (ON DELETE CASCADE), sans être chargées
+    keypoints = relationship("KeypointDB", back_populates="game", cascade="delete", passive_deletes=True)
+    users = relationship("UserDB", back_populates="game", cascade="delete", passive_deletes=True)
 
 
 class UserDB(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        UniqueConstraint("game_id", "name", name="uq_users_game_name"),
+        Index("ix_users_game_id", "game_id", "id"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    name = Column(String, nullable=False, unique=True)
+    name = Column(String, nullable=False)
     points = Column(Integer, nullable=False)
-    game_id = Column(String, ForeignKey("games.id"), nullable=False)
+    game_id = Column(String, ForeignKey("games.id", ondelete="CASCADE"), nullable=False)
     game = relationship("GameDB", back_populates="users")
+    keypoints_solved = relationship(
+        "KeypointDB",
+        secondary="solves",
+        primaryjoin="and_(UserDB.id == foreign(SolveDB.user_id), UserDB.game_id == foreign(SolveDB.game_id))",
+        secondaryjoin="KeypointDB.id == foreign(SolveDB.keypoint_id)",
+        viewonly=True,
+    )
@@ -0,0 +1,66 @@
+import base64
+import json
+from typing import Dict, Iterable, List, Optional, Sequence, Type
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.requests import Request
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key: Sequence) -> str:
+    # Curseur opaque : la clé de la dernière ligne renvoyée
+    raw = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List:
+    # types : type attendu de chaque élément de la clé (un curseur modifié par le
+    # client ne doit jamais atteindre les requêtes SQL)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Curseur invalide")
+    if not isinstance(key, list) or len(key) != len(types):
+        raise ValueError("Curseur invalide")
+    for value, expected in zip(key, types):
+        # bool est une sous-classe d'int
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError("Curseur invalide")
+    return key
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> List[str]:
+    # Champs demandés par fields=a,b,c, dans l'ordre du modèle de réponse
+    allowed = list(model.__fields__)
+    if not fields:
+        return allowed
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise ValueError("Champs inconnus : " + ", ".join(sorted(unknown)))
+    return [field for field in allowed if field in requested]
+
+
+def project(obj, fields: Iterable[str], nested: Dict[str, Type[BaseModel]]) -> dict:
+    # Sérialise seulement les champs demandés d'un objet ORM ; les relations
+    # absentes de fields ne sont jamais lues, donc jamais chargées.
+    content = {}
+    for field in fields:
+        value = getattr(obj, field)
+        model = nested.get(field)
+        if model is not None:
+            value = [model.from_orm(item) for item in value]
+        content[field] = value
+    return jsonable_encoder(content)
+
+
+def page_headers(request: Request, next_key: Optional[Sequence]) -> Dict[str, str]:
+    if next_key is None:
+        return {}
+    cursor = encode_cursor(next_key)
+    next_url = request.url.include_query_params(cursor=cursor)
+    return {"X-Next-Cursor": cursor, "Link": '<%s>; rel="next"' % next_url}
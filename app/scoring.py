@@ -0,0 +1,129 @@
+import argparse
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import exc, text
+from sqlalchemy.orm import Session
+
+from models import SolveDB, UserDB
+
+
+class AlreadySolved(Exception):
+    pass
+
+
+class UnknownUser(Exception):
+    pass
+
+
+def is_foreign_key_error(error: exc.IntegrityError) -> bool:
+    # Joueur, point clé ou partie inexistant (et non résolution déjà enregistrée)
+    return "FOREIGN KEY" in str(error.orig)
+
+
+def record_solve(db_session: Session, game_id: str, user_id: int, keypoint_id: int, points: int, created_at: Optional[int] = None):
+    # Enregistre la résolution et crédite les points du joueur dans une seule transaction :
+    # un doublon est rejeté par la clé primaire de solves avant toute écriture sur users,
+    # et les points sont ajoutés par la base (points = points + :p), sans relecture.
+    solve = SolveDB(keypoint_id=keypoint_id, user_id=user_id, game_id=game_id)
+    if created_at is not None:
+        solve.created_at = created_at
+    db_session.add(solve)
+    try:
+        db_session.flush()
+    except exc.IntegrityError as error:
+        db_session.rollback()
+        if is_foreign_key_error(error):
+            raise UnknownUser()
+        raise AlreadySolved()
+
+    updated = (
+        db_session.query(UserDB)
+        .filter(UserDB.game_id == game_id)
+        .filter(UserDB.id == user_id)
+        .update({UserDB.points: UserDB.points + points}, synchronize_session=False)
+    )
+    if not updated:
+        db_session.rollback()
+        raise UnknownUser()
+    db_session.commit()
+
+
+class PendingSolve(NamedTuple):
+    game_id: str
+    user_id: int
+    keypoint_id: int
+    points: int
+    # Heure de l'acquittement ; absente des journaux écrits avant l'horodatage
+    created_at: Optional[int] = None
+
+
+INSERT_SOLVE = text(
+    "INSERT OR IGNORE INTO solves (user_id, keypoint_id, game_id, created_at)"
+    " SELECT :user_id, :keypoint_id, :game_id, COALESCE(:created_at, CAST(strftime('%s', 'now') AS INTEGER))"
+    " WHERE EXISTS (SELECT 1 FROM users WHERE id = :user_id AND game_id = :game_id)"
+    " AND EXISTS (SELECT 1 FROM keypoints WHERE id = :keypoint_id AND game_id = :game_id)"
+)
+
+
+def record_solves(db_session: Session, solves: List[PendingSolve]) -> List[PendingSolve]:
+    # Enregistre un lot de résolutions en une seule transaction (un seul fsync) ;
+    # renvoie celles réellement appliquées, sans les doublons ni les joueurs inconnus.
+    # OR IGNORE ne couvre pas les clés étrangères : l'existence du joueur et du point
+    # clé est vérifiée dans l'insertion même, pour qu'une ligne invalide n'annule pas le lot.
+    users_table = UserDB.__table__
+    applied = []
+    for solve in solves:
+        parameters = {
+            "game_id": solve.game_id, "user_id": solve.user_id, "keypoint_id": solve.keypoint_id, "created_at": solve.created_at,
+        }
+        inserted = db_session.execute(INSERT_SOLVE, parameters)
+        if not inserted.rowcount:
+            continue
+        db_session.execute(
+            users_table.update()
+            .where(users_table.c.game_id == solve.game_id)
+            .where(users_table.c.id == solve.user_id)
+            .values(points=users_table.c.points + solve.points)
+        )
+        applied.append(solve)
+    db_session.commit()
+    return applied
+
+
+# Score d'un joueur = somme des points des points clés qu'il a résolus
+RECOMPUTE_POINTS = """
+UPDATE users SET points = COALESCE((
+    SELECT SUM(keypoints.points) FROM solves
+    JOIN keypoints ON keypoints.id = solves.keypoint_id
+    WHERE solves.user_id = users.id AND solves.game_id = users.game_id
+), 0)
+"""
+
+
+def recompute_points(db_session: Session, game_id: Optional[str] = None) -> int:
+    # Recalcule les scores d'une partie (de toutes si game_id est None) depuis solves,
+    # en une seule requête ; renvoie le nombre de joueurs mis à jour.
+    if game_id is None:
+        updated = db_session.execute(text(RECOMPUTE_POINTS))
+    else:
+        updated = db_session.execute(text(RECOMPUTE_POINTS + "WHERE users.game_id = :game_id"), {"game_id": game_id})
+    db_session.commit()
+    return updated.rowcount
+
+
+if __name__ == "__main__":
+    from database import SHARDS, session_for, shard_session
+
+    parser = argparse.ArgumentParser(description="Recalcule les scores des joueurs depuis les résolutions")
+    parser.add_argument("game_id", nargs="?", help="partie à recalculer (toutes par défaut)")
+    args = parser.parse_args()
+
+    # Une partie : sa base ; toutes les parties : chaque base tour à tour
+    sessions = [session_for(args.game_id)] if args.game_id else [shard_session(shard) for shard in range(SHARDS)]
+    updated = 0
+    for db in sessions:
+        try:
+            updated += recompute_points(db, args.game_id)
+        finally:
+            db.close()
+    print("%d joueurs recalculés" % updated)
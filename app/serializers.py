@@ -0,0 +1,163 @@
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from models import Game, GameDB, KeypointDB, KeypointSummary, SolveDB, UserDB, UserSummary
+
+# Sérialisation rapide des grosses réponses imbriquées : les lignes sont lues en
+# tuples (requêtes Core) et assemblées directement en dictionnaires, sans objet ORM
+# ni modèle Pydantic par ligne. Les champs, et leur ordre, restent ceux des modèles
+# de models.py, qui documentent toujours les réponses.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+KEYPOINT_FIELDS = list(KeypointSummary.__fields__)
+USER_FIELDS = list(UserSummary.__fields__)
+GAME_FIELDS = [field for field in Game.__fields__ if field not in ("keypoints", "users")]
+
+games = GameDB.__table__
+keypoints = KeypointDB.__table__
+users = UserDB.__table__
+solves = SolveDB.__table__
+
+
+def dumps(content) -> bytes:
+    # orjson s'il est installé (plusieurs fois plus rapide), sinon le même encodage que JSONResponse
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _columns(table, fields: Sequence[str]) -> list:
+    return [table.c[field] for field in fields]
+
+
+def _solvers(db_session: Session, where) -> Dict[Tuple[str, int], List[dict]]:
+    # (game_id, keypoint_id) -> résumés des joueurs ayant résolu le point clef
+    rows = db_session.execute(
+        select([solves.c.game_id, solves.c.keypoint_id] + _columns(users, USER_FIELDS))
+        .select_from(solves.join(users, users.c.id == solves.c.user_id))
+        .where(where)
+        .order_by(solves.c.game_id, solves.c.keypoint_id, users.c.id)
+    )
+    grouped: Dict[Tuple[str, int], List[dict]] = {}
+    for row in rows:
+        grouped.setdefault((row[0], row[1]), []).append(dict(zip(USER_FIELDS, row[2:])))
+    return grouped
+
+
+def _solved(db_session: Session, where) -> Dict[Tuple[str, int], List[dict]]:
+    # (game_id, user_id) -> résumés des points clefs résolus par le joueur
+    rows = db_session.execute(
+        select([solves.c.game_id, solves.c.user_id] + _columns(keypoints, KEYPOINT_FIELDS))
+        .select_from(solves.join(keypoints, keypoints.c.id == solves.c.keypoint_id))
+        .where(where)
+        .order_by(solves.c.game_id, solves.c.user_id, keypoints.c.id)
+    )
+    grouped: Dict[Tuple[str, int], List[dict]] = {}
+    for row in rows:
+        grouped.setdefault((row[0], row[1]), []).append(dict(zip(KEYPOINT_FIELDS, row[2:])))
+    return grouped
+
+
+def _keypoints(db_session: Session, game_ids: List[str]) -> Dict[str, List[dict]]:
+    solvers = _solvers(db_session, solves.c.game_id.in_(game_ids))
+    grouped: Dict[str, List[dict]] = {game_id: [] for game_id in game_ids}
+    for row in db_session.execute(
+            select(_columns(keypoints, KEYPOINT_FIELDS))
+            .where(keypoints.c.game_id.in_(game_ids))
+            .order_by(keypoints.c.game_id, keypoints.c.id)):
+        keypoint = dict(zip(KEYPOINT_FIELDS, row))
+        keypoint["users_solvers"] = solvers.get((keypoint["game_id"], keypoint["id"]), [])
+        grouped[keypoint["game_id"]].append(keypoint)
+    return grouped
+
+
+def _users(db_session: Session, game_ids: List[str]) -> Dict[str, List[dict]]:
+    solved = _solved(db_session, solves.c.game_id.in_(game_ids))
+    grouped: Dict[str, List[dict]] = {game_id: [] for game_id in game_ids}
+    for row in db_session.execute(
+            select(_columns(users, USER_FIELDS))
+            .where(users.c.game_id.in_(game_ids))
+            .order_by(users.c.game_id, users.c.id)):
+        user = dict(zip(USER_FIELDS, row))
+        user["keypoints_solved"] = solved.get((user["game_id"], user["id"]), [])
+        grouped[user["game_id"]].append(user)
+    return grouped
+
+
+def keypoints_content(db_session: Session, game_id: str) -> List[dict]:
+    # GET /games/{id}/keypoints (modèle Keypoint)
+    return _keypoints(db_session, [game_id])[game_id]
+
+
+def game_content(db_session: Session, game_id: str) -> Optional[dict]:
+    # GET /games/{id} (modèle Game)
+    row = db_session.execute(select(_columns(games, GAME_FIELDS)).where(games.c.id == game_id)).first()
+    if row is None:
+        return None
+    game = dict(zip(GAME_FIELDS, row))
+    game["keypoints"] = _keypoints(db_session, [game_id])[game_id]
+    game["users"] = _users(db_session, [game_id])[game_id]
+    return game
+
+
+def users_content(
+        db_session: Session,
+        game_id: str,
+        fields: Sequence[str],
+        after_id: Optional[int],
+        limit: int) -> Tuple[List[dict], Optional[Tuple[int]]]:
+    # GET /games/{id}/users (modèle User, limité aux champs demandés), et clé de la page suivante
+    where = users.c.game_id == game_id
+    if after_id is not None:
+        where = and_(where, users.c.id > after_id)
+    rows = db_session.execute(
+        select(_columns(users, USER_FIELDS)).where(where).order_by(users.c.id).limit(limit + 1)
+    ).fetchall()
+    next_key = (rows[limit - 1][0],) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    solved = {}
+    if "keypoints_solved" in fields and rows:
+        # Résolutions des seuls joueurs de la page : intervalle d'ids (index game_id, user_id)
+        solved = _solved(db_session, and_(
+            solves.c.game_id == game_id, solves.c.user_id >= rows[0][0], solves.c.user_id <= rows[-1][0],
+        ))
+    content = []
+    for row in rows:
+        user = dict(zip(USER_FIELDS, row))
+        user["keypoints_solved"] = solved.get((game_id, user["id"]), [])
+        content.append({field: user[field] for field in fields})
+    return content, next_key
+
+
+def games_content(
+        db_session: Session,
+        where: list,
+        fields: Sequence[str],
+        limit: int) -> Tuple[List[dict], Optional[Tuple[str]]]:
+    # GET /games (modèle Game, limité aux champs demandés) : les relations ne sont lues
+    # que si elles sont demandées, en une requête par relation pour toute la page
+    rows = db_session.execute(
+        select(_columns(games, GAME_FIELDS)).where(and_(*where)).order_by(games.c.id).limit(limit + 1)
+    ).fetchall()
+    next_key = (rows[limit - 1][0],) if len(rows) > limit else None
+    page = [dict(zip(GAME_FIELDS, row)) for row in rows[:limit]]
+    game_ids = [game["id"] for game in page]
+    if "keypoints" in fields and game_ids:
+        grouped = _keypoints(db_session, game_ids)
+        for game in page:
+            game["keypoints"] = grouped[game["id"]]
+    if "users" in fields and game_ids:
+        grouped = _users(db_session, game_ids)
+        for game in page:
+            game["users"] = grouped[game["id"]]
+    return [{field: game.get(field, []) for field in fields} for game in page], next_key
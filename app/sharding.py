@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from bundle import changes
+from database import SHARDS, get_engines, run_db, shard_for, shard_session
+from models import GameDB, KeypointDB, SolveDB, UserDB
+from serializers import games_content
+
+# Répartition des parties entre SHARDS bases (database.py) : lectures qui traversent
+# toutes les bases, et rééquilibrage des données après un changement de SHARDS.
+
+games = GameDB.__table__
+keypoints = KeypointDB.__table__
+users = UserDB.__table__
+solves = SolveDB.__table__
+
+
+def _fetch(shard: int, statement) -> list:
+    db_session = shard_session(shard)
+    try:
+        return db_session.execute(statement).fetchall()
+    finally:
+        db_session.close()
+
+
+async def fetch_all(statement) -> list:
+    # Lignes de toutes les bases, concaténées ; les requêtes partent en parallèle
+    results = await asyncio.gather(*(run_db(_fetch, shard, statement) for shard in range(SHARDS)))
+    return [row for rows in results for row in rows]
+
+
+def _games_content(shard: int, where: list, fields: Sequence[str], limit: int):
+    db_session = shard_session(shard)
+    try:
+        return games_content(db_session, where, fields, limit)
+    finally:
+        db_session.close()
+
+
+async def games_page(where: list, fields: Sequence[str], limit: int) -> Tuple[List[dict], Optional[Tuple[str]]]:
+    # GET /games sur toutes les bases : les ids de la page sont choisis en fusionnant
+    # les ids triés de chaque base, puis seules ces parties sont sérialisées, chacune
+    # dans sa base. Le contenu est remis dans l'ordre des ids (l'id peut ne pas être demandé).
+    if SHARDS == 1:
+        return await run_db(_games_content, 0, where, fields, limit)
+    statement = select([games.c.id]).where(and_(*where)).order_by(games.c.id).limit(limit + 1)
+    ids = await asyncio.gather(*(run_db(_fetch, shard, statement) for shard in range(SHARDS)))
+    merged = list(heapq.merge(*([row[0] for row in rows] for rows in ids)))
+    next_key = (merged[limit - 1],) if len(merged) > limit else None
+    page = merged[:limit]
+
+    by_shard: Dict[int, List[str]] = {}
+    for game_id in page:
+        by_shard.setdefault(shard_for(game_id), []).append(game_id)
+    shards = list(by_shard)
+    contents = await asyncio.gather(*(
+        run_db(_games_content, shard, [games.c.id.in_(by_shard[shard])], fields, len(by_shard[shard]))
+        for shard in shards
+    ))
+    # Chaque base renvoie ses parties dans l'ordre des ids : on les dépile dans l'ordre global
+    iterators = {shard: iter(content) for shard, (content, _) in zip(shards, contents)}
+    return [next(iterators[shard_for(game_id)]) for game_id in page], next_key
+
+
+# ---------------------------------- RÉÉQUILIBRAGE -------------------------------
+
+
+def misplaced_games(db_session: Session, shard: int) -> List[str]:
+    # Parties de la base qui appartiennent à une autre base avec le SHARDS courant
+    return [
+        game_id for game_id, in db_session.execute(select([games.c.id]).order_by(games.c.id))
+        if shard_for(game_id) != shard
+    ]
+
+
+def _rows(db_session: Session, table, game_id: str) -> List[dict]:
+    return [dict(row) for row in db_session.execute(table.select().where(table.c.game_id == game_id))]
+
+
+def _offset(db_session: Session, table, rows: List[dict]) -> int:
+    # Décalage des ids d'une table de la base cible : nul si aucun id de la partie n'y
+    # est déjà utilisé (par exemple quand toutes les parties viennent d'une seule base)
+    if not rows:
+        return 0
+    first, last = min(row["id"] for row in rows), max(row["id"] for row in rows)
+    used = db_session.execute(
+        select([func.count()]).select_from(table).where(table.c.id.between(first, last))
+    ).scalar()
+    if not used:
+        return 0
+    return (db_session.execute(select([func.max(table.c.id)])).scalar() or 0) + 1 - first
+
+
+def copy_game(source: Session, target: Session, game_id: str) -> bool:
+    # Copie la partie dans la base cible, dans une transaction ; renvoie True si les
+    # ids des points clés et des joueurs ont dû être décalés.
+    game = dict(source.execute(games.select().where(games.c.id == game_id)).first())
+    game_keypoints = _rows(source, keypoints, game_id)
+    game_users = _rows(source, users, game_id)
+    game_solves = _rows(source, solves, game_id)
+    game_changes = _rows(source, changes, game_id)
+    version = source.execute(
+        "SELECT seq FROM change_versions WHERE game_id = :game_id", {"game_id": game_id}
+    ).scalar() or 0
+
+    keypoint_offset = _offset(target, keypoints, game_keypoints)
+    user_offset = _offset(target, users, game_users)
+    target.execute(games.insert(), [game])
+    if game_keypoints:
+        target.execute(keypoints.insert(), [dict(row, id=row["id"] + keypoint_offset) for row in game_keypoints])
+    if game_users:
+        target.execute(users.insert(), [dict(row, id=row["id"] + user_offset) for row in game_users])
+    if game_solves:
+        target.execute(solves.insert(), [
+            dict(row, user_id=row["user_id"] + user_offset, keypoint_id=row["keypoint_id"] + keypoint_offset)
+            for row in game_solves
+        ])
+
+    # Journal des modifications : celui de la base d'origine remplace les lignes
+    # écrites par les déclencheurs, pour que les deltas des clients restent valables.
+    renumbered = bool(keypoint_offset or user_offset)
+    if not renumbered:
+        target.execute(changes.delete().where(changes.c.game_id == game_id))
+        if game_changes:
+            target.execute(changes.insert(), game_changes)
+        target.execute(
+            "UPDATE change_versions SET seq = :seq WHERE game_id = :game_id", {"seq": version, "game_id": game_id}
+        )
+    else:
+        # Ids décalés : toutes les entités sont renvoyées aux clients à la version
+        # suivante, et les anciens ids leur sont signalés comme supprimés.
+        seq = version + 1
+        target.execute(changes.update().where(changes.c.game_id == game_id).values(seq=seq))
+        tombstones = [("keypoint", row["id"], 0) for row in game_keypoints]
+        tombstones += [("user", row["id"], 0) for row in game_users]
+        tombstones += [("solve", row["user_id"], row["keypoint_id"]) for row in game_solves]
+        target.execute(changes.insert().prefix_with("OR IGNORE"), [
+            dict(game_id=game_id, entity=entity, entity_id=entity_id, related_id=related_id, seq=seq, deleted=True)
+            for entity, entity_id, related_id in tombstones
+        ] + [change for change in game_changes if change["deleted"]])
+        target.execute(
+            "UPDATE change_versions SET seq = :seq WHERE game_id = :game_id", {"seq": seq, "game_id": game_id}
+        )
+    target.commit()
+    return renumbered
+
+
+def move_game(source: Session, target: Session, game_id: str) -> str:
+    # La copie est validée avant la suppression : une interruption laisse au pire la
+    # partie dans les deux bases, et la relance ne fait plus que la suppression
+    # (la base cible est celle que lisent les routes).
+    exists = target.execute(select([games.c.id]).where(games.c.id == game_id)).first() is not None
+    status = "déjà copiée"
+    if not exists:
+        status = "déplacée (ids décalés)" if copy_game(source, target, game_id) else "déplacée"
+    # Points clefs, joueurs, résolutions et journal suivent (ON DELETE CASCADE, déclencheurs)
+    source.execute(games.delete().where(games.c.id == game_id))
+    source.commit()
+    return status
+
+
+def rebalance(previous_shards: int = SHARDS, dry_run: bool = False) -> Dict[str, int]:
+    # Déplace chaque partie vers la base que lui attribue shard_for ; à lancer serveur
+    # arrêté, après avoir changé SHARDS et appliqué les migrations à toutes les bases.
+    # previous_shards : nombre de bases avant le changement, pour vider celles en trop.
+    get_engines()
+    counts: Dict[str, int] = {}
+    for shard in range(max(SHARDS, previous_shards)):
+        source = shard_session(shard)
+        try:
+            for game_id in misplaced_games(source, shard):
+                target_shard = shard_for(game_id)
+                if dry_run:
+                    status = "à déplacer"
+                else:
+                    target = shard_session(target_shard)
+                    try:
+                        status = move_game(source, target, game_id)
+                    finally:
+                        target.close()
+                print("%s : base %d -> base %d, %s" % (game_id, shard, target_shard, status))
+                counts[status] = counts.get(status, 0) + 1
+        finally:
+            source.close()
+    return counts
+
+
+def shard_sizes() -> List[Tuple[int, int, int]]:
+    # (parties, points clés, joueurs) de chaque base
+    sizes = []
+    for shard in range(SHARDS):
+        db_session = shard_session(shard)
+        try:
+            sizes.append(tuple(
+                db_session.execute(select([func.count()]).select_from(table)).scalar()
+                for table in (games, keypoints, users)
+            ))
+        finally:
+            db_session.close()
+    return sizes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Répartition des parties entre les bases (SHARDS)")
+    parser.add_argument("command", choices=["status", "rebalance"])
+    parser.add_argument("--previous-shards", type=int, default=SHARDS, help="nombre de bases avant le changement de SHARDS")
+    parser.add_argument("--dry-run", action="store_true", help="affiche les déplacements sans rien écrire")
+    args = parser.parse_args()
+
+    get_engines()
+    if args.command == "rebalance":
+        for status, count in sorted(rebalance(args.previous_shards, args.dry_run).items()):
+            print("%s : %d parties" % (status.capitalize(), count))
+    for shard, (game_count, keypoint_count, user_count) in enumerate(shard_sizes()):
+        print("Base %d : %d parties, %d points clés, %d joueurs" % (shard, game_count, keypoint_count, user_count))
@@ -0,0 +1,140 @@
+import math
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+EARTH_RADIUS = 6371008.8  # en mètres
+
+# Taille (en degrés) d'une case de la grille : ~1,1 km en latitude pour 0.01
+CELL_SIZE = float(os.getenv("SPATIAL_CELL_SIZE", "0.01"))
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # Distance en mètres entre deux points GPS
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    # Grille régulière latitude/longitude : chaque case contient les ids des points clefs qu'elle couvre
+
+    def __init__(self, cell_size: float = CELL_SIZE):
+        self.cell_size = cell_size
+        self._columns = int(math.ceil(360 / cell_size))
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size)) % self._columns
+
+    def upsert(self, keypoint_id: int, lat: Optional[float], lon: Optional[float]):
+        self.remove(keypoint_id)
+        if lat is None or lon is None:
+            return
+        self._points[keypoint_id] = (lat, lon)
+        self._cells.setdefault(self._cell(lat, lon), set()).add(keypoint_id)
+
+    def remove(self, keypoint_id: int):
+        position = self._points.pop(keypoint_id, None)
+        if position is None:
+            return
+        cell = self._cell(*position)
+        members = self._cells[cell]
+        members.discard(keypoint_id)
+        if not members:
+            del self._cells[cell]
+
+    def _candidates(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Iterator[int]:
+        first_row = int(math.floor(max(min_lat, -90.0) / self.cell_size))
+        last_row = int(math.floor(min(max_lat, 90.0) / self.cell_size))
+        first_column = int(math.floor(min_lon / self.cell_size))
+        last_column = int(math.floor(max_lon / self.cell_size))
+        nb_columns = min(last_column - first_column + 1, self._columns)
+
+        # Si la zone couvre plus de cases qu'il n'y a de points, un parcours direct est moins cher
+        if (last_row - first_row + 1) * nb_columns > len(self._points):
+            yield from self._points
+            return
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, first_column + nb_columns):
+                yield from self._cells.get((row, column % self._columns), ())
+
+    def within(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Iterator[int]:
+        # Les longitudes peuvent dépasser ±180 pour une zone qui chevauche l'antiméridien
+        for keypoint_id in self._candidates(min_lat, min_lon, max_lat, max_lon):
+            lat, lon = self._points[keypoint_id]
+            if not min_lat <= lat <= max_lat:
+                continue
+            if min_lon <= lon <= max_lon or min_lon <= lon + 360 <= max_lon or min_lon <= lon - 360 <= max_lon:
+                yield keypoint_id
+
+    def nearest(self, lat: float, lon: float, keypoint_ids: Iterable[int], limit: int) -> List[Tuple[float, int]]:
+        distances = [
+            (haversine(lat, lon, *self._points[keypoint_id]), keypoint_id)
+            for keypoint_id in keypoint_ids
+        ]
+        distances.sort()
+        return distances[:limit]
+
+    def nearby(self, lat: float, lon: float, radius: float, limit: int) -> List[Tuple[float, int]]:
+        # Boîte englobante du cercle, puis filtrage exact par la distance
+        d_lat = math.degrees(radius / EARTH_RADIUS)
+        cos_lat = math.cos(math.radians(lat))
+        d_lon = 180.0 if cos_lat < 1e-6 else min(180.0, d_lat / cos_lat)
+        candidates = self._candidates(lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon)
+        distances = []
+        for keypoint_id in candidates:
+            distance = haversine(lat, lon, *self._points[keypoint_id])
+            if distance <= radius:
+                distances.append((distance, keypoint_id))
+        distances.sort()
+        return distances[:limit]
+
+
+class SpatialIndexes:
+    # Un index spatial par partie, tenu à jour par les routes des points clefs
+
+    def __init__(self):
+        self._games: Dict[str, GridIndex] = {}
+
+    def get(self, game_id: str) -> Optional[GridIndex]:
+        # Sans rien créer : None pour une partie sans point clef (ou inconnue)
+        return self._games.get(game_id)
+
+    def upsert(self, game_id: str, keypoint_id: int, lat: Optional[float], lon: Optional[float]):
+        index = self._games.get(game_id)
+        if index is None:
+            index = self._games[game_id] = GridIndex()
+        index.upsert(keypoint_id, lat, lon)
+
+    def remove(self, game_id: str, keypoint_id: int):
+        if game_id in self._games:
+            self._games[game_id].remove(keypoint_id)
+
+    def drop(self, game_id: str):
+        self._games.pop(game_id, None)
+
+    def load(self, game_id: str, rows: Iterable[Tuple[int, Optional[float], Optional[float]]]):
+        # rows : (keypoint_id, latitude, longitude) de tous les points clefs de la partie
+        index = GridIndex()
+        for keypoint_id, lat, lon in rows:
+            index.upsert(keypoint_id, lat, lon)
+        self._games[game_id] = index
+
+    def rebuild(self, rows: Iterable[Tuple[str, int, Optional[float], Optional[float]]]):
+        # rows : (game_id, keypoint_id, latitude, longitude), lus depuis la table keypoints
+        games: Dict[str, GridIndex] = {}
+        for game_id, keypoint_id, lat, lon in rows:
+            index = games.get(game_id)
+            if index is None:
+                index = games[game_id] = GridIndex()
+            index.upsert(keypoint_id, lat, lon)
+        self._games = games
+
+
+spatial_indexes = SpatialIndexes()
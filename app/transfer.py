@@ -0,0 +1,204 @@
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import session_for
+from functions import gen_id
+from models import BulkGame, GameDB, GameTransferResult, KeypointDB, SolveDB, UserDB
+
+# Nombre de lignes insérées ou lues par requête
+BATCH_SIZE = 1000
+# Octets d'un export reçu gardés en mémoire avant d'être déversés dans un fichier temporaire
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(4 * 1024 * 1024)))
+
+GAME_COLUMNS = [column.name for column in GameDB.__table__.columns]
+KEYPOINT_COLUMNS = [column.name for column in KeypointDB.__table__.columns]
+USER_COLUMNS = [column.name for column in UserDB.__table__.columns]
+SOLVE_COLUMNS = [column.name for column in SolveDB.__table__.columns]
+
+# Ordre des lignes d'un export : chaque type ne référence que des types déjà vus
+RECORD_TYPES = ["game", "keypoint", "user", "solve"]
+
+
+def create_game_bulk(db_session: Session, game: BulkGame, game_id: Optional[str] = None) -> GameTransferResult:
+    # Partie, points clefs et joueurs en une transaction et une requête par table ;
+    # l'id est choisi par l'appelant quand il détermine la base (SHARDS)
+    game_id = game_id or gen_id(8)
+    db_session.execute(GameDB.__table__.insert(), [dict(
+        id=game_id,
+        name=game.name,
+        visibility=game.visibility,
+        duration=game.duration,
+        time_start=game.time_start,
+        nb_player_max=game.nb_player_max,
+    )])
+    if game.keypoints:
+        db_session.execute(
+            KeypointDB.__table__.insert(),
+            [dict(keypoint.dict(), game_id=game_id) for keypoint in game.keypoints],
+        )
+    if game.users:
+        db_session.execute(
+            UserDB.__table__.insert(),
+            [dict(user.dict(), game_id=game_id) for user in game.users],
+        )
+    db_session.commit()
+    return GameTransferResult(id=game_id, keypoints=len(game.keypoints), users=len(game.users))
+
+
+def _ndjson(record_type: str, data: dict) -> bytes:
+    return (json.dumps({"type": record_type, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def export_game(game_id: str) -> Iterator[bytes]:
+    # Générateur synchrone (itéré dans un thread par StreamingResponse) : les lignes
+    # sont lues par lots depuis le curseur, sans jamais charger toute la partie.
+    db_session = session_for(game_id)
+    try:
+        game = db_session.execute(
+            GameDB.__table__.select().where(GameDB.id == game_id)
+        ).first()
+        if game is None:
+            return
+        yield _ndjson("game", dict(game))
+
+        for record_type, table, order_by in (
+                ("keypoint", KeypointDB.__table__, [KeypointDB.id]),
+                ("user", UserDB.__table__, [UserDB.id]),
+                ("solve", SolveDB.__table__, [SolveDB.user_id, SolveDB.keypoint_id])):
+            result = db_session.execute(
+                table.select().where(table.c.game_id == game_id).order_by(*order_by)
+            )
+            while True:
+                rows = result.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                yield b"".join(_ndjson(record_type, dict(row)) for row in rows)
+    finally:
+        db_session.close()
+
+
+class GameImporter:
+    # Importe un export NDJSON ligne à ligne, par lots, dans une seule transaction.
+    # Les ids sont décalés d'une constante par table plutôt que stockés dans une
+    # table de correspondance : la mémoire utilisée ne dépend pas de la taille de la partie.
+
+    def __init__(self, db_session: Session, name: Optional[str] = None, keep_ids: bool = False, game_id: Optional[str] = None):
+        self.db_session = db_session
+        self.name = name
+        self.keep_ids = keep_ids
+        # Id imposé à la nouvelle partie (sans keep_ids) : celui qui a servi à choisir la base
+        self.new_game_id = game_id
+        self.game_id: Optional[str] = None
+        self.counts = {"keypoint": 0, "user": 0, "solve": 0}
+        self._stage = -1
+        self._offsets: Dict[str, int] = {}
+        self._last_ids: Dict[str, int] = {}
+        self._batch: List[dict] = []
+        self._batch_type: Optional[str] = None
+
+    def add_all(self, records: Iterable[dict]):
+        for record in records:
+            self.add(record)
+
+    def add(self, record: dict):
+        if not isinstance(record, dict) or not isinstance(record.get("data"), dict):
+            raise ValueError("Ligne invalide : {\"type\": ..., \"data\": {...}} attendu")
+        record_type, data = record.get("type"), record["data"]
+        if record_type not in RECORD_TYPES:
+            raise ValueError("Type de ligne inconnu : %r" % record_type)
+        stage = RECORD_TYPES.index(record_type)
+        if stage < self._stage or (stage == 0 and self._stage == 0):
+            raise ValueError("Les lignes doivent suivre l'ordre game, keypoint, user, solve")
+        if stage > 0 and self.game_id is None:
+            raise ValueError("La première ligne doit décrire la partie")
+        self._stage = stage
+
+        if record_type == "game":
+            self._insert_game(data)
+        elif record_type == "keypoint":
+            self._append("keypoint", dict(self._pick(data, KEYPOINT_COLUMNS), id=self._map_id("keypoint", data)))
+        elif record_type == "user":
+            self._append("user", dict(self._pick(data, USER_COLUMNS), id=self._map_id("user", data)))
+        else:
+            self._append("solve", dict(
+                user_id=self._shift("user", data),
+                keypoint_id=self._shift("keypoint", data),
+                created_at=data.get("created_at"),
+            ))
+
+    def finish(self) -> GameTransferResult:
+        if self.game_id is None:
+            raise ValueError("Export vide")
+        self._flush()
+        self.db_session.commit()
+        return GameTransferResult(
+            id=self.game_id,
+            keypoints=self.counts["keypoint"],
+            users=self.counts["user"],
+            solves=self.counts["solve"],
+        )
+
+    def _pick(self, data: dict, columns: List[str]) -> dict:
+        return {column: data.get(column) for column in columns if column not in ("id", "game_id")}
+
+    def _insert_game(self, data: dict):
+        game = self._pick(data, GAME_COLUMNS)
+        self.game_id = data.get("id") if self.keep_ids else (self.new_game_id or gen_id(8))
+        if not self.game_id:
+            raise ValueError("Id de partie manquant")
+        if self.name:
+            game["name"] = self.name
+        self.db_session.execute(GameDB.__table__.insert(), [dict(game, id=self.game_id)])
+
+    def _map_id(self, record_type: str, data: dict) -> int:
+        old_id = data.get("id")
+        if not isinstance(old_id, int):
+            raise ValueError("Id manquant pour une ligne %s" % record_type)
+        # Les exports sont triés par id : on le vérifie pour que le décalage reste injectif
+        if old_id <= self._last_ids.get(record_type, 0):
+            raise ValueError("Les lignes %s doivent être triées par id croissant" % record_type)
+        self._last_ids[record_type] = old_id
+
+        if record_type not in self._offsets:
+            if self.keep_ids:
+                self._offsets[record_type] = 0
+            else:
+                # La ligne de la partie est déjà insérée : le verrou d'écriture est pris,
+                # personne ne peut insérer entre ce max() et nos lignes.
+                table = KeypointDB if record_type == "keypoint" else UserDB
+                current_max = self.db_session.query(func.max(table.id)).scalar() or 0
+                self._offsets[record_type] = current_max + 1 - old_id
+        self.counts[record_type] += 1
+        return old_id + self._offsets[record_type]
+
+    def _shift(self, record_type: str, data: dict) -> int:
+        old_id = data.get(record_type + "_id")
+        if not isinstance(old_id, int) or record_type not in self._offsets:
+            raise ValueError("Résolution vers un %s absent de l'export" % record_type)
+        return old_id + self._offsets[record_type]
+
+    def _append(self, record_type: str, row: dict):
+        if self._batch_type != record_type:
+            self._flush()
+            self._batch_type = record_type
+        row["game_id"] = self.game_id
+        self._batch.append(row)
+        if record_type == "solve":
+            self.counts["solve"] += 1
+        if len(self._batch) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        table = {
+            "keypoint": KeypointDB.__table__,
+            "user": UserDB.__table__,
+            "solve": SolveDB.__table__,
+        }[self._batch_type]
+        self.db_session.execute(table.insert(), self._batch)
+        self._batch = []
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+
+# Test de charge des sessions par requête : de plus en plus de clients simultanés,
+# chacun propriétaire d'un joueur qu'il renomme puis relit, avec de temps en temps une
+# écriture qui échoue (nom déjà pris, 409). Pour chaque niveau de concurrence : débit,
+# réponses inattendues, relectures qui ne rendent pas la dernière écriture du client
+# (état d'une requête visible dans une autre), et connexions encore prises au pool
+# à la fin. Code de retour 1 en cas d'erreur, de fuite ou de relecture incohérente.
+#
+#   python bench/concurrency.py --levels 1,4,16,64 --duration 3
+
+READ_RATIO = 0.8
+FAILING_RATIO = 0.05
+
+
+async def run_level(app, game, clients: int, duration: float, seed: int) -> dict:
+    from driver import ASGIClient
+
+    client = ASGIClient(app)
+    deadline = time.perf_counter() + duration
+    keypoint_ids = list(game.answers)
+    taken_name = "Joueur 0"
+    stats = {"requests": 0, "errors": 0, "stale": 0}
+
+    async def player(index: int, user_id: int, rng: random.Random):
+        # Seul ce client écrit le nom de ce joueur : une relecture doit rendre sa dernière écriture
+        name = None
+        writes = 0
+        while time.perf_counter() < deadline:
+            draw = rng.random()
+            if draw < FAILING_RATIO:
+                response = await client.post("/games/%s/users" % game.id, params={"name": taken_name, "points": 0})
+                ok = response.status == 409
+            elif draw < FAILING_RATIO + (1 - READ_RATIO):
+                writes += 1
+                name = "Client %d-%d-%d" % (seed, index, writes)
+                response = await client.request("PUT", "/games/%s/users/%d" % (game.id, user_id), json_body={"name": name})
+                ok = response.status == 200 and response.json()["name"] == name
+            elif draw < 0.5:
+                response = await client.get("/games/%s/keypoints/%d" % (game.id, rng.choice(keypoint_ids)))
+                ok = response.status == 200
+            else:
+                response = await client.get("/games/%s/users/%d" % (game.id, user_id))
+                ok = response.status == 200
+                if ok:
+                    user = response.json()
+                    if user["id"] != user_id or (name is not None and user["name"] != name):
+                        stats["stale"] += 1
+            stats["requests"] += 1
+            if not ok:
+                stats["errors"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        player(index, game.user_ids[index + 1], random.Random(seed * 1000 + index)) for index in range(clients)
+    ))
+    stats["rps"] = stats["requests"] / (time.perf_counter() - started)
+    return stats
+
+
+async def measure(args) -> list:
+    import main
+    from database import pool_stats
+    from scenarios import create_game
+
+    levels = [int(level) for level in args.levels.split(",")]
+    await main.app.router.startup()
+    try:
+        # Un joueur par client, plus le joueur 0 dont le nom sert aux écritures refusées
+        game = await create_game(main.app, args.keypoints, max(levels) + 1)
+        results = []
+        for seed, clients in enumerate(levels):
+            stats = await run_level(main.app, game, clients, args.duration, seed)
+            stats["checked_out"] = pool_stats().get("checked_out", 0)
+            results.append((clients, stats))
+        return results
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    from run import prepare_app
+
+    parser = argparse.ArgumentParser(description="Débit et isolation des requêtes selon le nombre de clients simultanés")
+    parser.add_argument("--levels", default="1,4,16,64", help="nombres de clients simultanés, séparés par des virgules")
+    parser.add_argument("--duration", type=float, default=3.0, help="durée (en s) de chaque niveau")
+    parser.add_argument("--keypoints", type=int, default=50, help="points clés de la partie")
+    parser.add_argument("--min-speedup", type=float, default=None, help="débit minimal du dernier niveau, relatif au premier (code de retour 1 en dessous)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        results = asyncio.get_event_loop().run_until_complete(measure(args))
+
+    failed = False
+    base_rps = results[0][1]["rps"]
+    print("%8s %10s %9s %8s %8s %8s %12s" % ("clients", "requêtes", "req/s", "x", "erreurs", "périmées", "connexions"))
+    for clients, stats in results:
+        bad = stats["errors"] or stats["stale"] or stats["checked_out"]
+        failed = failed or bool(bad)
+        print("%s%6d %10d %9.1f %8.2f %8d %8d %12d" % (
+            "!!" if bad else "  ", clients, stats["requests"], stats["rps"], stats["rps"] / base_rps,
+            stats["errors"], stats["stale"], stats["checked_out"],
+        ))
+    speedup = results[-1][1]["rps"] / base_rps
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print("Débit x%.2f avec %d clients, moins que --min-speedup %.2f" % (speedup, results[-1][0], args.min_speedup))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
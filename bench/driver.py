@@ -0,0 +1,123 @@
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlencode
+
+# Client ASGI en mémoire : les requêtes sont passées directement à l'application,
+# sans socket ni serveur, pour ne mesurer que le coût de l'API elle-même.
+
+
+class BenchResponse(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Recorder:
+    # Latences par route (gabarit de chemin, pas l'URL réelle) et nombre d'erreurs
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def record(self, route: str, latency: float, ok: bool):
+        self.latencies[route].append(latency)
+        if not ok:
+            self.errors[route] += 1
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+
+    def summary(self) -> Dict[str, dict]:
+        duration = self.duration or (time.perf_counter() - self.started)
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            routes[route] = {
+                "count": len(latencies),
+                "errors": self.errors.get(route, 0),
+                "rps": len(latencies) / duration,
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p95": percentile(latencies, 0.95) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": max(latencies) * 1000,
+            }
+        return routes
+
+
+class ASGIClient:
+
+    def __init__(self, app, recorder: Optional[Recorder] = None):
+        self.app = app
+        self.recorder = recorder
+
+    async def request(
+            self,
+            method: str,
+            path: str,
+            route: Optional[str] = None,
+            params: Optional[dict] = None,
+            json_body=None,
+            body: bytes = b"",
+            headers: Optional[Dict[str, str]] = None,
+            expected=(200, 201, 202, 304)) -> BenchResponse:
+        raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+            raw_headers.append((b"content-type", b"application/json"))
+        raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "root_path": "",
+            "query_string": urlencode(params or {}).encode("latin-1"),
+            "headers": raw_headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        sent_body = False
+        status = 500
+        response_headers: Dict[str, str] = {}
+        chunks = []
+
+        async def receive():
+            nonlocal sent_body
+            if sent_body:
+                return {"type": "http.disconnect"}
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", []):
+                    response_headers[name.decode("latin-1")] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        started = time.perf_counter()
+        await self.app(scope, receive, send)
+        latency = time.perf_counter() - started
+        if self.recorder is not None:
+            self.recorder.record(route or "%s %s" % (method, path), latency, status in expected)
+        return BenchResponse(status, response_headers, b"".join(chunks))
+
+    async def get(self, path: str, **kwargs) -> BenchResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> BenchResponse:
+        return await self.request("POST", path, **kwargs)
@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+# Diffusion des évènements d'une partie à beaucoup d'abonnés (events.py) : N clients,
+# WebSocket et SSE mêlés, sont connectés en mémoire (interface ASGI) à la même partie,
+# puis des joueurs la rejoignent (POST /games/{id}/users, évènement player_joined).
+# Pour chaque évènement : délai entre l'écriture et sa réception par chaque client
+# rapide (p50, p99, max), et délai jusqu'au dernier d'entre eux. Une partie des clients
+# ne lit presque pas : leurs files restent bornées (évènements écrasés, message
+# overflow) sans ralentir les autres. Mémoire par abonné mesurée avec tracemalloc.
+# Code de retour 1 si un client rapide n'a pas reçu tous les évènements.
+#
+#   python bench/event_fanout.py --clients 1000 --events 100
+
+
+class Client:
+
+    def __init__(self, index: int, slow_delay: float):
+        self.index = index
+        self.slow_delay = slow_delay
+        # user_id du joueur annoncé -> instant de réception
+        self.received: Dict[int, float] = {}
+        self.overflows = 0
+        self.connected = asyncio.Event()
+        self.disconnect = asyncio.Event()
+        self.task: Optional[asyncio.Future] = None
+
+    def on_payload(self, payload: str):
+        event = json.loads(payload)
+        if event["type"] == "player_joined":
+            self.received[event["data"]["user_id"]] = time.perf_counter()
+        elif event["type"] == "overflow":
+            self.overflows += 1
+
+    async def consumed(self):
+        # Client lent : chaque message lui prend slow_delay secondes
+        if self.slow_delay:
+            await asyncio.sleep(self.slow_delay)
+
+
+def base_scope(kind: str, path: str) -> dict:
+    return {
+        "type": kind,
+        "scheme": "ws" if kind == "websocket" else "http",
+        "http_version": "1.1",
+        "path": path,
+        "raw_path": path.encode("latin-1"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+
+
+def open_websocket(app, game_id: str, client: Client):
+    scope = dict(base_scope("websocket", "/games/%s/events" % game_id), subprotocols=[])
+    connecting = [True]
+
+    async def receive():
+        if connecting[0]:
+            connecting[0] = False
+            return {"type": "websocket.connect"}
+        await client.disconnect.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send(message):
+        if message["type"] == "websocket.accept":
+            client.connected.set()
+        elif message["type"] == "websocket.send":
+            client.on_payload(message["text"])
+            await client.consumed()
+
+    client.task = asyncio.ensure_future(app(scope, receive, send))
+
+
+def open_sse(app, game_id: str, client: Client):
+    scope = dict(base_scope("http", "/games/%s/events" % game_id), method="GET")
+    requested = [False]
+    buffer = [""]
+
+    async def receive():
+        if not requested[0]:
+            requested[0] = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await client.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            client.connected.set()
+        elif message["type"] == "http.response.body":
+            buffer[0] += message.get("body", b"").decode("utf-8")
+            *events, buffer[0] = buffer[0].split("\n\n")
+            for event in events:
+                if event.startswith("data: "):
+                    client.on_payload(event[len("data: "):])
+            await client.consumed()
+
+    client.task = asyncio.ensure_future(app(scope, receive, send))
+
+
+async def measure(args) -> dict:
+    import main
+    from driver import ASGIClient, percentile
+    from events import broadcaster
+    from scenarios import create_game
+
+    await main.app.router.startup()
+    try:
+        game = await create_game(main.app, 10, 1)
+        slow_every = int(round(1 / args.slow)) if args.slow else 0
+        clients = [
+            Client(index, args.slow_delay if slow_every and index % slow_every == 0 else 0.0)
+            for index in range(args.clients)
+        ]
+
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        for client in clients:
+            # Alternance WebSocket / SSE selon --sse (part des clients en SSE)
+            if client.index % 100 < args.sse * 100:
+                open_sse(main.app, game.id, client)
+            else:
+                open_websocket(main.app, game.id, client)
+        await asyncio.wait_for(asyncio.gather(*(client.connected.wait() for client in clients)), 60)
+        while broadcaster.count(game.id) < len(clients):
+            await asyncio.sleep(0.01)
+        subscriber_bytes = (tracemalloc.get_traced_memory()[0] - memory_before) / len(clients)
+        tracemalloc.stop()
+
+        writer = ASGIClient(main.app)
+        published: Dict[int, float] = {}
+        for number in range(args.events):
+            started = time.perf_counter()
+            response = await writer.post("/games/%s/users" % game.id, params={"name": "Arrivée %d" % number, "points": 0})
+            assert response.status == 200, response.body
+            published[response.json()["id"]] = started
+            await asyncio.sleep(args.interval)
+
+        fast = [client for client in clients if not client.slow_delay]
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and any(len(client.received) < len(published) for client in fast):
+            await asyncio.sleep(0.01)
+
+        latencies: List[float] = []
+        completions: List[float] = []
+        for user_id, started in published.items():
+            received = [client.received[user_id] - started for client in fast if user_id in client.received]
+            latencies.extend(received)
+            if len(received) == len(fast):
+                completions.append(max(received))
+        slow = [client for client in clients if client.slow_delay]
+        result = {
+            "clients": len(clients),
+            "fast": len(fast),
+            "events": len(published),
+            "missing": sum(len(published) - len(client.received) for client in fast),
+            "p50": percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+            "p99": percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+            "max": max(latencies) * 1000 if latencies else 0.0,
+            "complete_p50": percentile(completions, 0.50) * 1000 if completions else 0.0,
+            "complete_max": max(completions) * 1000 if completions else 0.0,
+            "slow": len(slow),
+            "slow_received": sum(len(client.received) for client in slow) / len(slow) if slow else 0.0,
+            "slow_overflowed": sum(1 for client in slow if client.overflows),
+            "subscriber_bytes": subscriber_bytes,
+        }
+
+        # Déconnexion : WebSocket par le client, SSE en fermant l'abonnement
+        for client in clients:
+            client.disconnect.set()
+        for subscription in list(broadcaster._subscribers.get(game.id, ())):
+            subscription.close()
+        await asyncio.wait_for(asyncio.gather(*(client.task for client in clients), return_exceptions=True), 30)
+        result["left"] = broadcaster.count(game.id)
+        return result
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    from run import prepare_app
+
+    parser = argparse.ArgumentParser(description="Latence et mémoire de la diffusion des évènements à de nombreux abonnés")
+    parser.add_argument("--clients", type=int, default=1000, help="abonnés connectés à la partie")
+    parser.add_argument("--sse", type=float, default=0.5, help="part des abonnés en SSE (les autres en WebSocket)")
+    parser.add_argument("--slow", type=float, default=0.1, help="part des abonnés qui lisent lentement")
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="temps (en s) de lecture d'un message par un abonné lent")
+    parser.add_argument("--events", type=int, default=100, help="évènements publiés")
+    parser.add_argument("--interval", type=float, default=0.01, help="pause (en s) entre deux publications")
+    parser.add_argument("--queue-size", type=int, default=32, help="file d'un abonné (EVENTS_QUEUE_SIZE)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="attente maximale (en s) des derniers évènements")
+    args = parser.parse_args()
+
+    os.environ["EVENTS_QUEUE_SIZE"] = str(args.queue_size)
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        result = asyncio.get_event_loop().run_until_complete(measure(args))
+
+    print("%d abonnés (%d rapides, %d lents), %d évènements" % (result["clients"], result["fast"], result["slow"], result["events"]))
+    print("réception par un abonné rapide : p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (result["p50"], result["p99"], result["max"]))
+    print("jusqu'au dernier abonné rapide : p50 %.2f ms, max %.2f ms" % (result["complete_p50"], result["complete_max"]))
+    print("abonnés lents : %.1f évènements reçus en moyenne, %d prévenus d'une perte (overflow)" % (
+        result["slow_received"], result["slow_overflowed"]))
+    print("mémoire : %.1f Ko par abonné (tracemalloc), %d Mo au plus pour le processus" % (
+        result["subscriber_bytes"] / 1024, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+    print("abonnements restants après déconnexion : %d" % result["left"])
+    if result["missing"] or result["left"]:
+        sys.exit("%d évènements manquants chez les abonnés rapides, %d abonnements restants" % (result["missing"], result["left"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+# Coût d'un rafraîchissement du tableau de bord d'une partie : GET /games/{id}/analytics
+# (lu dans les agrégats de la migration 6) face au recalcul des mêmes statistiques à
+# partir des résolutions, en SQL ou par les routes existantes (/solves et /users, page
+# par page). Une écriture précède chaque mesure : rien n'est servi depuis le cache.
+#
+#   python bench/game_analytics.py --keypoints 100 --players 2000 --repeat 20
+
+RECOMPUTE = [
+    "SELECT count(*) FROM users WHERE game_id = :game_id",
+    "SELECT keypoint_id, count(*) FROM solves WHERE game_id = :game_id GROUP BY keypoint_id",
+    "SELECT keypoint_id, created_at / 60, count(*) FROM solves"
+    " WHERE game_id = :game_id AND created_at IS NOT NULL GROUP BY keypoint_id, created_at / 60",
+]
+
+
+def insert_solves(game, seed: int) -> int:
+    # Les premiers points clés sont résolus par presque tous les joueurs, les derniers
+    # par presque aucun, au fil des trois heures de la partie
+    from database import session_for
+    from models import SolveDB
+
+    rng = random.Random(seed)
+    keypoint_ids = sorted(game.answers)
+    started = int(time.time())
+    rows = [
+        {"user_id": user_id, "keypoint_id": keypoint_id, "game_id": game.id, "created_at": started + rng.randrange(3 * 3600)}
+        for user_id in game.user_ids
+        for position, keypoint_id in enumerate(keypoint_ids)
+        if rng.random() < 1 - position / len(keypoint_ids)
+    ]
+    db_session = session_for(game.id)
+    try:
+        db_session.execute(SolveDB.__table__.insert(), rows)
+        db_session.commit()
+    finally:
+        db_session.close()
+    return len(rows)
+
+
+def recompute(game_id: str):
+    from database import session_for
+
+    db_session = session_for(game_id)
+    try:
+        for statement in RECOMPUTE:
+            db_session.execute(statement, {"game_id": game_id}).fetchall()
+    finally:
+        db_session.close()
+
+
+async def page_through(client, path: str, params: dict) -> int:
+    rows = 0
+    while True:
+        response = await client.get(path, params=params)
+        rows += len(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return rows
+        params = dict(params, cursor=cursor)
+
+
+async def measure(args) -> list:
+    import main
+    from driver import ASGIClient
+    from pagination import MAX_PAGE_SIZE
+    from scenarios import create_game
+
+    await main.app.router.startup()
+    try:
+        game = await create_game(main.app, args.keypoints, args.players)
+        solves = insert_solves(game, args.seed)
+        client = ASGIClient(main.app)
+
+        async def analytics():
+            response = await client.get("/games/%s/analytics" % game.id)
+            assert response.status == 200, response.body
+
+        async def sql():
+            await main.run_db(recompute, game.id)
+
+        async def routes():
+            await page_through(client, "/games/%s/solves" % game.id, {"limit": MAX_PAGE_SIZE})
+            await page_through(client, "/games/%s/users" % game.id, {"limit": MAX_PAGE_SIZE, "fields": "id"})
+
+        results = []
+        for label, refresh, repeat in (
+                ("GET /games/{id}/analytics", analytics, args.repeat),
+                ("recalcul SQL depuis solves", sql, args.repeat),
+                ("pages de /solves et /users", routes, max(1, args.repeat // 5))):
+            durations = []
+            for _ in range(repeat):
+                main.game_versions.bump(game.id)
+                started = time.perf_counter()
+                await refresh()
+                durations.append(time.perf_counter() - started)
+            results.append((label, statistics.median(durations)))
+        return solves, results
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    from run import prepare_app
+
+    parser = argparse.ArgumentParser(description="Coût d'un rafraîchissement des statistiques d'une partie")
+    parser.add_argument("--keypoints", type=int, default=100, help="points clés de la partie")
+    parser.add_argument("--players", type=int, default=2000, help="joueurs de la partie")
+    parser.add_argument("--repeat", type=int, default=20, help="rafraîchissements mesurés (médiane)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        solves, results = asyncio.get_event_loop().run_until_complete(measure(args))
+
+    print("%d points clés, %d joueurs, %d résolutions" % (args.keypoints, args.players, solves))
+    print("%-32s %12s" % ("rafraîchissement", "médiane (ms)"))
+    for label, duration in results:
+        print("%-32s %12.2f" % (label, duration * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Coût des limites de débit et de la file d'admission (limits.py) : les mêmes requêtes
+# sont jouées, une à une, dans des processus sans limites puis avec (en alternance).
+# Avec limites, les budgets sont assez larges pour que rien ne soit refusé : on mesure
+# le chemin complet (route reconnue, seaux consultés, place prise puis rendue). Puis
+# les seaux seuls, sur beaucoup de clés distinctes, pour montrer que leur nombre est borné.
+#
+#   python bench/limits_overhead.py --requests 2000 --rounds 5
+
+ROUTES = [
+    ("GET / (sans budget)", "GET", "/", False),
+    ("GET /games/{id}/users/{uid}", "GET", "/games/{game}/users/{user}", False),
+    ("POST .../attempts (mauvaise réponse)", "POST", "/games/{game}/keypoints/{keypoint}/attempts", True),
+]
+
+# Mêmes routes que DEFAULT_RATE_LIMITS, budgets jamais atteints pendant la mesure
+LARGE_BUDGET = (10 ** 9, 1)
+RATE_LIMITS = {
+    "POST /games": {"ip": LARGE_BUDGET},
+    "POST /games/{game_id}/keypoints": {"game": LARGE_BUDGET, "ip": LARGE_BUDGET},
+    "POST /games/{game_id}/users": {"game": LARGE_BUDGET, "ip": LARGE_BUDGET},
+    "PUT /games/{game_id}/users/{user_id}": {"user": LARGE_BUDGET, "ip": LARGE_BUDGET},
+    "POST /games/{game_id}/solves": {"user": LARGE_BUDGET, "game": LARGE_BUDGET, "ip": LARGE_BUDGET},
+    "POST /games/{game_id}/keypoints/{keypoint_id}/attempts": {"user": LARGE_BUDGET, "game": LARGE_BUDGET, "ip": LARGE_BUDGET},
+}
+
+CONFIGURATIONS = {
+    "sans": {"RATE_LIMIT_ENABLED": "0", "MAX_CONCURRENT_REQUESTS": "0"},
+    "avec": {"RATE_LIMIT_ENABLED": "1", "MAX_CONCURRENT_REQUESTS": "128", "RATE_LIMITS": json.dumps(RATE_LIMITS)},
+}
+
+
+async def measure(requests: int) -> dict:
+    import main
+    from driver import ASGIClient
+    from scenarios import create_game
+
+    await main.app.router.startup()
+    try:
+        game = await create_game(main.app, 50, 50)
+        client = ASGIClient(main.app)
+        keypoint_id = next(iter(game.answers))
+        results = {}
+        for label, method, template, attempt in ROUTES:
+            path = template.format(game=game.id, user=game.user_ids[0], keypoint=keypoint_id)
+            params = {"user_id": game.user_ids[0], "answer": "mauvaise réponse"} if attempt else None
+            for _ in range(requests // 10):
+                await client.request(method, path, params=params)
+            started = time.perf_counter()
+            for _ in range(requests):
+                await client.request(method, path, params=params)
+            results[label] = (time.perf_counter() - started) / requests
+        return results
+    finally:
+        await main.app.router.shutdown()
+
+
+def child(requests: int):
+    from run import prepare_app
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        results = asyncio.get_event_loop().run_until_complete(measure(requests))
+    print(json.dumps(results))
+
+
+def buckets(keys: int, max_keys: int):
+    # Un seau par joueur, avec beaucoup plus de joueurs que de seaux gardés
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app"))
+    from limits import TokenBuckets
+
+    token_buckets = TokenBuckets(10, 10, max_keys=max_keys)
+    started = time.perf_counter()
+    for index in range(keys):
+        token_buckets.take(("partie", index))
+    duration = time.perf_counter() - started
+    print("seaux : %d clés distinctes, %.2f µs par take(), %d seaux gardés (max %d), %d oubliés" % (
+        keys, duration / keys * 1e6, len(token_buckets), max_keys, token_buckets.evictions,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Surcoût des limites de débit et d'admission par requête")
+    parser.add_argument("--requests", type=int, default=2000, help="requêtes par route et par processus")
+    parser.add_argument("--rounds", type=int, default=5, help="processus lancés pour chaque configuration")
+    parser.add_argument("--keys", type=int, default=1000000, help="clés distinctes pour la mesure des seaux")
+    parser.add_argument("--max-keys", type=int, default=100000, help="seaux gardés au plus (RATE_LIMIT_KEYS)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.requests)
+        return
+
+    timings = {name: [] for name in CONFIGURATIONS}
+    for _ in range(args.rounds):
+        for name, configuration in CONFIGURATIONS.items():
+            env = dict(os.environ, **configuration)
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--child", "--requests", str(args.requests)], env=env,
+            )
+            timings[name].append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    print("%-40s %12s %12s %12s" % ("route", "sans (µs)", "avec (µs)", "surcoût"))
+    for label, _, _, _ in ROUTES:
+        without = statistics.median(run[label] for run in timings["sans"]) * 1e6
+        with_limits = statistics.median(run[label] for run in timings["avec"]) * 1e6
+        print("%-40s %12.1f %12.1f %+8.1f µs (%+.1f %%)" % (
+            label, without, with_limits, with_limits - without, (with_limits / without - 1) * 100,
+        ))
+    buckets(args.keys, args.max_keys)
+
+
+if __name__ == "__main__":
+    main()
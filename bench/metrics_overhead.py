@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Coût du middleware de métriques et des évènements SQL : les mêmes requêtes sont
+# jouées, une à une, dans des processus avec METRICS_ENABLED=0 puis 1 (en alternance).
+#
+#   python bench/metrics_overhead.py --requests 2000 --rounds 5
+
+ROUTES = [
+    ("GET /", "/", None),
+    ("GET /games/{id}/users/{uid}", "/games/{game}/users/{user}", None),
+    ("GET /games/{id}/users (304)", "/games/{game}/users", "etag"),
+    ("GET /games/{id}/solves", "/games/{game}/solves", None),
+]
+
+
+async def measure(requests: int) -> dict:
+    import main
+    from driver import ASGIClient
+    from scenarios import create_game
+
+    await main.app.router.startup()
+    try:
+        game = await create_game(main.app, 50, 50)
+        client = ASGIClient(main.app)
+        etag = (await client.get("/games/%s/users" % game.id)).headers["etag"]
+        results = {}
+        for label, template, condition in ROUTES:
+            path = template.format(game=game.id, user=game.user_ids[0])
+            headers = {"If-None-Match": etag} if condition == "etag" else None
+            for _ in range(requests // 10):
+                await client.get(path, headers=headers)
+            started = time.perf_counter()
+            for _ in range(requests):
+                await client.get(path, headers=headers)
+            results[label] = (time.perf_counter() - started) / requests
+        return results
+    finally:
+        await main.app.router.shutdown()
+
+
+def child(requests: int):
+    from run import prepare_app
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        results = asyncio.get_event_loop().run_until_complete(measure(requests))
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Surcoût des métriques par requête")
+    parser.add_argument("--requests", type=int, default=2000, help="requêtes par route et par processus")
+    parser.add_argument("--rounds", type=int, default=5, help="processus lancés pour chaque configuration")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.requests)
+        return
+
+    timings = {"0": [], "1": []}
+    for _ in range(args.rounds):
+        for enabled in ("0", "1"):
+            env = dict(os.environ, METRICS_ENABLED=enabled)
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--child", "--requests", str(args.requests)], env=env,
+            )
+            timings[enabled].append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    print("%-32s %12s %12s %12s" % ("route", "sans (µs)", "avec (µs)", "surcoût"))
+    for label, _, _ in ROUTES:
+        without = statistics.median(run[label] for run in timings["0"]) * 1e6
+        with_metrics = statistics.median(run[label] for run in timings["1"]) * 1e6
+        print("%-32s %12.1f %12.1f %+8.1f µs (%+.1f %%)" % (
+            label, without, with_metrics, with_metrics - without, (with_metrics / without - 1) * 100,
+        ))
+
+
+if __name__ == "__main__":
+    main()
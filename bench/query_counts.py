@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import sys
+import tempfile
+from typing import Dict
+
+# Nombre de requêtes SQL par route de lecture, compté par un écouteur
+# before_cursor_execute sur chaque moteur, pour deux tailles de données : il ne doit
+# pas dépendre de la taille (pas de chargement paresseux par ligne). Code de retour 1
+# si une route en fait plus sur la grande partie que sur la petite, ou ne répond pas 200.
+#
+#   python bench/query_counts.py --keypoints 40 --players 80
+
+ROUTES = [
+    ("GET /games", "/games", None),
+    ("GET /games/{id}", "/games/{game}", None),
+    ("GET /games/{id}/keypoints", "/games/{game}/keypoints", None),
+    ("GET /games/{id}/keypoints/{kid}", "/games/{game}/keypoints/{keypoint}", None),
+    ("GET /games/{id}/keypoints/nearby", "/games/{game}/keypoints/nearby", {"lat": 50.6, "lon": 3.13, "radius": 5000}),
+    ("GET /games/{id}/users", "/games/{game}/users", None),
+    ("GET /games/{id}/users/{uid}", "/games/{game}/users/{user}", None),
+    ("GET /games/{id}/solves", "/games/{game}/solves", None),
+    ("GET /games/{id}/leaderboard", "/games/{game}/leaderboard", None),
+    ("GET /games/{id}/leaderboard/{uid}", "/games/{game}/leaderboard/{user}", None),
+    ("GET /games/{id}/analytics", "/games/{game}/analytics", None),
+    ("GET /games/{id}/bundle", "/games/{game}/bundle", None),
+]
+
+
+class StatementCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def attach(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            self.count += 1
+
+
+async def populate(app, keypoints: int, players: int, solved: float):
+    # Chaque joueur résout la même part des points clés : les relations imbriquées
+    # (résolveurs, points clés résolus) ont toutes des lignes
+    from driver import ASGIClient
+    from scenarios import create_game
+
+    game = await create_game(app, keypoints, players)
+    client = ASGIClient(app)
+    keypoint_ids = sorted(game.answers)
+    for user_id in game.user_ids:
+        for keypoint_id in keypoint_ids[:max(1, int(len(keypoint_ids) * solved))]:
+            response = await client.post(
+                "/games/%s/keypoints/%d/attempts" % (game.id, keypoint_id),
+                params={"user_id": user_id, "answer": game.answers[keypoint_id]},
+            )
+            assert response.status == 200, response.body
+    return game
+
+
+async def count_statements(app, counter: StatementCounter, game) -> Dict[str, tuple]:
+    import main
+    from driver import ASGIClient
+
+    client = ASGIClient(app)
+    counts = {}
+    for label, template, params in ROUTES:
+        path = template.format(game=game.id, keypoint=min(game.answers), user=game.user_ids[0])
+        # Nouvelle version de la partie : rien n'est servi depuis le cache de réponses
+        main.game_versions.bump(game.id)
+        counter.count = 0
+        response = await client.get(path, params=params)
+        counts[label] = (response.status, counter.count)
+    return counts
+
+
+async def measure(args):
+    import main
+    from database import get_engines
+
+    await main.app.router.startup()
+    try:
+        counter = StatementCounter()
+        for engine in get_engines():
+            counter.attach(engine)
+        small = await populate(main.app, 2, 2, 1.0)
+        small_counts = await count_statements(main.app, counter, small)
+        # Plus de parties, de points clés, de joueurs et de résolutions
+        for _ in range(args.games):
+            await populate(main.app, 5, 5, args.solved)
+        large = await populate(main.app, args.keypoints, args.players, args.solved)
+        large_counts = await count_statements(main.app, counter, large)
+        return small_counts, large_counts
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    from run import prepare_app
+
+    parser = argparse.ArgumentParser(description="Requêtes SQL par route de lecture, selon la taille des données")
+    parser.add_argument("--keypoints", type=int, default=40, help="points clés de la grande partie")
+    parser.add_argument("--players", type=int, default=80, help="joueurs de la grande partie")
+    parser.add_argument("--games", type=int, default=10, help="autres parties ajoutées avant la seconde mesure")
+    parser.add_argument("--solved", type=float, default=0.5, help="part des points clés résolus par chaque joueur")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        small, large = asyncio.get_event_loop().run_until_complete(measure(args))
+
+    failures = []
+    print("%-36s %10s %10s" % ("route", "petite", "grande"))
+    for label, _, _ in ROUTES:
+        (small_status, small_count), (large_status, large_count) = small[label], large[label]
+        failed = small_status != 200 or large_status != 200 or large_count > small_count
+        print("%s %-34s %10d %10d%s" % (
+            "!!" if failed else "  ", label, small_count, large_count,
+            "" if small_status == large_status == 200 else "  (statut %d / %d)" % (small_status, large_status),
+        ))
+        if failed:
+            failures.append(label)
+    if failures:
+        sys.exit("Requêtes SQL dépendant de la taille des données : %s" % ", ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+# Octets envoyés et temps CPU par requête selon l'encodage négocié (identity, gzip, br),
+# pour les grosses réponses d'une partie aux textes longs. « à chaud » : la version
+# de la partie ne change pas (corps compressé lu dans le cache de réponses) ; « à
+# froid » : une écriture avant chaque requête, donc sérialisation et compression à
+# chaque fois. GET /games n'est pas versionnée : compressée à la volée par le middleware.
+#
+#   python bench/response_compression.py --keypoints 300 --users 1000 --repeat 30
+
+ENCODINGS = ("identity", "gzip", "br")
+
+
+async def create_game(app, keypoints: int, users: int) -> str:
+    from driver import ASGIClient
+
+    client = ASGIClient(app)
+    body = {
+        "name": "Compression %d" % time.time_ns(),
+        "visibility": True,
+        "time_start": int(time.time()),
+        "duration": 3600,
+        "keypoints": [
+            {
+                "name": "Point %d" % i,
+                "points": 10,
+                "description": "Indice %d : cherchez la plaque commémorative près de la fontaine, "
+                               "puis comptez les fenêtres de la façade qui donne sur la place. " % i * 3,
+                "solution": "La réponse détaillée du point %d, avec ses variantes acceptées" % i,
+                "url_cible": "https://assets.arriddle.example/targets/%040x.jpg" % (i * 7919),
+                "latitude": 50.6 + (i % 100) * 1e-4,
+                "longitude": 3.13 + (i // 100) * 1e-4,
+            }
+            for i in range(keypoints)
+        ],
+        "users": [{"name": "Joueur %d" % i} for i in range(users)],
+    }
+    response = await client.post("/games/bulk", json_body=body)
+    assert response.status == 201, response.body
+    return response.json()["id"]
+
+
+async def timed(client, path: str, params: dict, encoding: str, repeat: int, before=None):
+    # (taille du corps, temps CPU médian par requête)
+    durations = []
+    size = 0
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.process_time()
+        response = await client.get(path, params=params, headers={"Accept-Encoding": encoding})
+        durations.append(time.process_time() - started)
+        assert response.status == 200, response.body
+        assert response.headers.get("content-encoding", "identity") == encoding, response.headers
+        size = len(response.body)
+    return size, statistics.median(durations)
+
+
+async def measure(args) -> list:
+    import main
+    from compression import brotli
+    from driver import ASGIClient
+
+    await main.app.router.startup()
+    try:
+        game_id = await create_game(main.app, args.keypoints, args.users)
+        client = ASGIClient(main.app)
+        encodings = [encoding for encoding in ENCODINGS if encoding != "br" or brotli is not None]
+        routes = [
+            ("GET /games/{id}", "/games/%s" % game_id, {}, True),
+            ("GET /games/{id}/keypoints", "/games/%s/keypoints" % game_id, {}, True),
+            ("GET /games/{id}/users", "/games/%s/users" % game_id, {"limit": args.users}, True),
+            ("GET /games", "/games", {"limit": 100, "fields": "id,name,keypoints"}, False),
+        ]
+        results = []
+        for label, path, params, versioned in routes:
+            for encoding in encodings:
+                await client.get(path, params=params, headers={"Accept-Encoding": encoding})
+                size, warm = await timed(client, path, params, encoding, args.repeat)
+                cold = None
+                if versioned:
+                    # Nouvelle version à chaque requête : rien n'est servi depuis le cache
+                    bump = lambda: main.game_versions.bump(game_id)
+                    _, cold = await timed(client, path, params, encoding, args.repeat, bump)
+                results.append((label, encoding, size, warm, cold))
+        return results
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    from run import prepare_app
+
+    parser = argparse.ArgumentParser(description="Octets envoyés et temps CPU par requête selon l'encodage")
+    parser.add_argument("--keypoints", type=int, default=300, help="points clés de la partie")
+    parser.add_argument("--users", type=int, default=1000, help="joueurs de la partie")
+    parser.add_argument("--repeat", type=int, default=30, help="mesures par route et encodage (médiane)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        results = asyncio.get_event_loop().run_until_complete(measure(args))
+
+    print("%-28s %-9s %11s %7s %15s %15s" % ("route", "encodage", "octets", "ratio", "CPU chaud (ms)", "CPU froid (ms)"))
+    sizes = {}
+    for label, encoding, size, warm, cold in results:
+        sizes.setdefault(label, size)
+        cold_text = "%15.2f" % (cold * 1e3) if cold is not None else "%15s" % "-"
+        print("%-28s %-9s %11d %6.1fx %15.2f %s" % (label, encoding, size, sizes[label] / size, warm * 1e3, cold_text))
+
+
+if __name__ == "__main__":
+    main()
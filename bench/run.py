@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# Banc de charge de l'API, joué en mémoire sur une base SQLite temporaire :
+#
+#   python bench/run.py                                  # tous les scénarios
+#   python bench/run.py --scenario players --players 200 --save bench/baseline.json
+#   python bench/run.py --compare bench/baseline.json    # code de retour 1 en cas de régression
+#   SOLVE_INGEST=batched python bench/run.py --scenario solve_burst
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, os.pardir, "app")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Banc de charge de l'API ARriddle")
+    parser.add_argument("--scenario", action="append", help="scénario à jouer (plusieurs possibles, tous par défaut)")
+    parser.add_argument("--players", type=int, default=50, help="joueurs par partie")
+    parser.add_argument("--keypoints", type=int, default=100, help="points clés par partie")
+    parser.add_argument("--bulk-keypoints", type=int, default=20, help="points clés des parties créées par game_creation")
+    parser.add_argument("--slow-write-keypoints", type=int, default=2000, help="points clés des parties créées par les écritures lentes de reads_during_writes")
+    parser.add_argument("--concurrency", type=int, default=16, help="requêtes simultanées des scénarios qui ne simulent pas de joueurs")
+    parser.add_argument("--duration", type=float, default=5.0, help="durée (en s) des scénarios à durée fixe")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="part des tours de jeu d'un joueur qui envoient une réponse")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="enregistre les résultats (référence) dans ce fichier JSON")
+    parser.add_argument("--compare", help="compare aux résultats de référence de ce fichier JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="écart relatif toléré avant de signaler une régression")
+    return parser.parse_args()
+
+
+def prepare_app(directory: str):
+    # La configuration est lue à l'import des modules de l'application : à régler avant
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(directory, "bench.db")
+    os.environ.setdefault("SOLVE_JOURNAL", os.path.join(directory, "solves.journal"))
+    # Les scénarios envoient bien plus de requêtes qu'un client réel : pas de limites
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    os.environ.setdefault("MAX_CONCURRENT_REQUESTS", "0")
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    os.chdir(directory)
+    import migrations
+    migrations.migrate_shards()
+
+
+async def run_scenarios(names, options) -> dict:
+    import main
+    from scenarios import SCENARIOS
+
+    await main.app.router.startup()
+    results = {}
+    try:
+        for name in names:
+            recorder = await SCENARIOS[name](main.app, options)
+            results[name] = {"duration": recorder.duration, "routes": recorder.summary()}
+    finally:
+        await main.app.router.shutdown()
+    return results
+
+
+def print_results(results: dict):
+    for name, scenario in results.items():
+        print("\n== %s (%.1f s)" % (name, scenario["duration"]))
+        print("%-44s %8s %6s %9s %8s %8s %8s %8s" % ("route", "requêtes", "err", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+        for route, stats in scenario["routes"].items():
+            print("%-44s %8d %6d %9.1f %8.2f %8.2f %8.2f %8.2f" % (
+                route, stats["count"], stats["errors"], stats["rps"], stats["p50"], stats["p95"], stats["p99"], stats["max"],
+            ))
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    # Régression : débit plus faible ou p95 plus élevé que la référence, au-delà de la tolérance
+    regressions = []
+    print("\n== comparaison à la référence (tolérance %d %%)" % (tolerance * 100))
+    for name, scenario in results.items():
+        base_routes = baseline.get("scenarios", {}).get(name, {}).get("routes", {})
+        for route, stats in scenario["routes"].items():
+            base = base_routes.get(route)
+            if base is None:
+                continue
+            rps_delta = stats["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+            p95_delta = stats["p95"] / base["p95"] - 1 if base["p95"] else 0.0
+            worse = rps_delta < -tolerance or p95_delta > tolerance or stats["errors"] > base["errors"]
+            print("%s %-16s %-44s req/s %+6.1f %%  p95 %+6.1f %%" % (
+                "!!" if worse else "  ", name, route, rps_delta * 100, p95_delta * 100,
+            ))
+            if worse:
+                regressions.append((name, route))
+    return regressions
+
+
+def main():
+    options = parse_args()
+    # N'importe pas l'application : seulement le client et les scénarios
+    from scenarios import SCENARIOS
+    names = options.scenario or list(SCENARIOS)
+    unknown = set(names).difference(SCENARIOS)
+    if unknown:
+        sys.exit("Scénarios inconnus : %s (disponibles : %s)" % (", ".join(sorted(unknown)), ", ".join(SCENARIOS)))
+    save = os.path.abspath(options.save) if options.save else None
+    baseline_path = os.path.abspath(options.compare) if options.compare else None
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        try:
+            results = asyncio.get_event_loop().run_until_complete(run_scenarios(names, options))
+        finally:
+            os.chdir(cwd)
+
+    print_results(results)
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "solve_ingest": os.getenv("SOLVE_INGEST", "sync"),
+            "options": {key: value for key, value in vars(options).items() if key not in ("save", "compare")},
+        },
+        "scenarios": results,
+    }
+    if save:
+        with open(save, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print("\nRésultats enregistrés dans", save)
+    if baseline_path:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import asyncio
+import random
+import time
+from typing import Dict, List, NamedTuple
+
+from driver import ASGIClient, Recorder
+
+# Scénarios de charge : chacun prépare ses données (non mesurées), puis joue des
+# requêtes concurrentes et renvoie l'enregistreur de latences par route.
+
+
+class BenchGame(NamedTuple):
+    id: str
+    user_ids: List[int]
+    # id du point clé -> réponse correcte
+    answers: Dict[int, str]
+
+
+_games_created = 0
+
+
+async def create_game(app, keypoints: int, players: int) -> BenchGame:
+    global _games_created
+    _games_created += 1
+    client = ASGIClient(app)
+    body = {
+        "name": "Bench %d %d" % (_games_created, time.time_ns()),
+        "visibility": True,
+        "time_start": int(time.time()),
+        "duration": 3600,
+        "keypoints": [
+            {
+                "name": "Point %d" % i,
+                "points": 10 + i % 5,
+                "description": "Question %d" % i,
+                "solution": "Réponse %d" % i,
+                "latitude": 50.6 + (i % 100) * 1e-4,
+                "longitude": 3.13 + (i // 100) * 1e-4,
+            }
+            for i in range(keypoints)
+        ],
+        "users": [{"name": "Joueur %d" % i} for i in range(players)],
+    }
+    response = await client.post("/games/bulk", json_body=body)
+    assert response.status == 201, response.body
+    game_id = response.json()["id"]
+
+    answers = {}
+    for keypoint in (await client.get("/games/%s/keypoints" % game_id)).json():
+        answers[keypoint["id"]] = keypoint["solution"]
+    user_ids = []
+    params = {"fields": "id", "limit": 1000}
+    while True:
+        response = await client.get("/games/%s/users" % game_id, params=params)
+        user_ids.extend(user["id"] for user in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+        params = dict(params, cursor=cursor)
+    return BenchGame(game_id, user_ids, answers)
+
+
+async def players(app, options) -> Recorder:
+    # N joueurs d'une partie interrogent joueurs et résolutions (avec If-None-Match,
+    # comme une application qui rafraîchit son écran) et répondent de temps en temps.
+    game = await create_game(app, options.keypoints, options.players)
+    recorder = Recorder()
+    client = ASGIClient(app, recorder)
+    deadline = time.perf_counter() + options.duration
+    keypoint_ids = list(game.answers)
+
+    async def player(user_id: int, rng: random.Random):
+        etag = None
+        unsolved = keypoint_ids[:]
+        rng.shuffle(unsolved)
+        while time.perf_counter() < deadline:
+            headers = {"If-None-Match": etag} if etag else None
+            response = await client.get("/games/%s/users" % game.id, route="GET /games/{id}/users", headers=headers)
+            etag = response.headers.get("etag", etag)
+            await client.get("/games/%s/solves" % game.id, route="GET /games/{id}/solves")
+            if unsolved and rng.random() < options.write_ratio:
+                keypoint_id = unsolved.pop()
+                await client.post(
+                    "/games/%s/keypoints/%d/attempts" % (game.id, keypoint_id),
+                    route="POST /games/{id}/keypoints/{kid}/attempts",
+                    params={"user_id": user_id, "answer": game.answers[keypoint_id]},
+                )
+
+    await asyncio.gather(*(
+        player(user_id, random.Random(options.seed + index))
+        for index, user_id in enumerate(game.user_ids)
+    ))
+    recorder.stop()
+    return recorder
+
+
+async def solve_burst(app, options) -> Recorder:
+    # Tous les joueurs valident tous les points clés en même temps ; le temps du
+    # scénario comprend l'écriture du dernier lot en mode SOLVE_INGEST=batched.
+    import main
+
+    game = await create_game(app, options.keypoints, options.players)
+    recorder = Recorder()
+    client = ASGIClient(app, recorder)
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    async def attempt(user_id: int, keypoint_id: int):
+        async with semaphore:
+            await client.post(
+                "/games/%s/keypoints/%d/attempts" % (game.id, keypoint_id),
+                route="POST /games/{id}/keypoints/{kid}/attempts",
+                params={"user_id": user_id, "answer": game.answers[keypoint_id]},
+            )
+
+    rng = random.Random(options.seed)
+    attempts = [(user_id, keypoint_id) for user_id in game.user_ids for keypoint_id in game.answers]
+    rng.shuffle(attempts)
+    await asyncio.gather(*(attempt(user_id, keypoint_id) for user_id, keypoint_id in attempts))
+    if main.SOLVE_INGEST == "batched":
+        await main.solve_ingestor.flush()
+    recorder.stop()
+    return recorder
+
+
+async def keypoint_reads(app, options) -> Recorder:
+    # Lecture de tous les points clés d'une grosse partie, d'un point clé et des voisins
+    game = await create_game(app, options.keypoints, 1)
+    recorder = Recorder()
+    client = ASGIClient(app, recorder)
+    deadline = time.perf_counter() + options.duration
+    keypoint_ids = list(game.answers)
+
+    async def reader(rng: random.Random):
+        while time.perf_counter() < deadline:
+            await client.get("/games/%s/keypoints" % game.id, route="GET /games/{id}/keypoints")
+            await client.get(
+                "/games/%s/keypoints/%d" % (game.id, rng.choice(keypoint_ids)),
+                route="GET /games/{id}/keypoints/{kid}",
+            )
+            await client.get(
+                "/games/%s/keypoints/nearby" % game.id,
+                route="GET /games/{id}/keypoints/nearby",
+                params={"lat": 50.6 + rng.random() * 0.01, "lon": 3.13 + rng.random() * 0.01, "radius": 200, "limit": 20},
+            )
+
+    await asyncio.gather(*(reader(random.Random(options.seed + index)) for index in range(options.concurrency)))
+    recorder.stop()
+    return recorder
+
+
+async def game_creation(app, options) -> Recorder:
+    # Création de parties vides et de parties complètes (points clés et joueurs)
+    recorder = Recorder()
+    client = ASGIClient(app, recorder)
+    deadline = time.perf_counter() + options.duration
+    counter = iter(range(10 ** 9))
+
+    async def creator(worker: int):
+        while time.perf_counter() < deadline:
+            number = next(counter)
+            await client.post(
+                "/games",
+                route="POST /games",
+                params={"name": "Création %d-%d-%d" % (worker, number, time.time_ns()), "visibility": True, "time_start": 0},
+            )
+            await client.post("/games/bulk", route="POST /games/bulk", json_body={
+                "name": "Création complète %d-%d-%d" % (worker, number, time.time_ns()),
+                "visibility": True,
+                "time_start": 0,
+                "keypoints": [
+                    {"name": "P%d" % i, "points": 10, "description": "Q", "solution": "R"}
+                    for i in range(options.bulk_keypoints)
+                ],
+                "users": [{"name": "J%d" % i} for i in range(10)],
+            })
+
+    await asyncio.gather(*(creator(worker) for worker in range(options.concurrency)))
+    recorder.stop()
+    return recorder
+
+
+async def reads_during_writes(app, options) -> Recorder:
+    # Lectures simples d'une partie, seules puis pendant des écritures lentes (parties
+    # complètes de --slow-write-keypoints points clés créées en boucle) : la latence des
+    # lectures ne doit pas dépendre des écritures en cours.
+    game = await create_game(app, options.keypoints, options.players)
+    recorder = Recorder()
+    client = ASGIClient(app, recorder)
+    keypoint_ids = list(game.answers)
+    counter = iter(range(10 ** 9))
+
+    async def reader(phase: str, deadline: float, rng: random.Random):
+        while time.perf_counter() < deadline:
+            await client.get(
+                "/games/%s/keypoints/%d" % (game.id, rng.choice(keypoint_ids)),
+                route="GET /games/{id}/keypoints/{kid} [%s]" % phase,
+            )
+            await client.get(
+                "/games/%s/users/%d" % (game.id, rng.choice(game.user_ids)),
+                route="GET /games/{id}/users/{uid} [%s]" % phase,
+            )
+            await client.get(
+                "/games/%s/leaderboard" % game.id,
+                route="GET /games/{id}/leaderboard [%s]" % phase,
+            )
+
+    async def writer(deadline: float):
+        while time.perf_counter() < deadline:
+            number = next(counter)
+            await client.post("/games/bulk", route="POST /games/bulk (écriture lente)", json_body={
+                "name": "Écriture lente %d-%d" % (number, time.time_ns()),
+                "visibility": True,
+                "time_start": 0,
+                "keypoints": [
+                    {"name": "P%d" % i, "points": 10, "description": "Q", "solution": "R"}
+                    for i in range(options.slow_write_keypoints)
+                ],
+                "users": [{"name": "J%d" % i} for i in range(options.slow_write_keypoints // 4)],
+            })
+
+    for phase, writers in (("seules", 0), ("écritures", max(1, options.concurrency // 4))):
+        deadline = time.perf_counter() + options.duration / 2
+        await asyncio.gather(
+            *(reader(phase, deadline, random.Random(options.seed + index)) for index in range(options.concurrency)),
+            *(writer(deadline) for _ in range(writers)),
+        )
+    recorder.stop()
+    return recorder
+
+
+SCENARIOS = {
+    "players": players,
+    "solve_burst": solve_burst,
+    "keypoint_reads": keypoint_reads,
+    "game_creation": game_creation,
+    "reads_during_writes": reads_during_writes,
+}
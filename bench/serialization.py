@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+
+# Temps de sérialisation des grosses réponses imbriquées, par route : chemin ORM +
+# modèles Pydantic + jsonable_encoder (l'ancien chemin) contre lignes assemblées en
+# dictionnaires (serializers.py), encodées avec json puis avec orjson s'il est installé.
+#
+#   python bench/serialization.py --keypoints 500 --users 2000 --solves 20 --repeat 20
+
+
+def stdlib_dumps(content) -> bytes:
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def routes(game_id: str, limit: int):
+    # (route, ancien chemin, nouveau chemin) ; chaque chemin renvoie le contenu à encoder
+    import main
+    import serializers
+    from fastapi.encoders import jsonable_encoder
+    from models import Game, Keypoint, KeypointSummary, User
+    from pagination import project
+
+    user_fields = list(User.__fields__)
+    game_fields = list(Game.__fields__)
+
+    async def legacy_game(db):
+        return jsonable_encoder(Game.from_orm(await main.get_game(db, game_id=game_id)))
+
+    async def legacy_keypoints(db):
+        keypoints = await main.get_all_keypoints(db, game_id=game_id)
+        return jsonable_encoder([Keypoint.from_orm(keypoint) for keypoint in keypoints])
+
+    async def legacy_users(db):
+        users = await main.get_all_users(db, game_id=game_id, limit=limit)
+        return [project(user, user_fields, {"keypoints_solved": KeypointSummary}) for user in users]
+
+    async def legacy_games(db):
+        games = await main.get_all_games(db, limit=limit)
+        return [project(game, game_fields, {"keypoints": Keypoint, "users": User}) for game in games]
+
+    async def fast_game(db):
+        return await main.run_db(serializers.game_content, db, game_id)
+
+    async def fast_keypoints(db):
+        return await main.run_db(serializers.keypoints_content, db, game_id)
+
+    async def fast_users(db):
+        return (await main.run_db(serializers.users_content, db, game_id, user_fields, None, limit))[0]
+
+    async def fast_games(db):
+        return (await main.run_db(serializers.games_content, db, [], game_fields, limit))[0]
+
+    return [
+        ("GET /games/{id}", legacy_game, fast_game),
+        ("GET /games/{id}/keypoints", legacy_keypoints, fast_keypoints),
+        ("GET /games/{id}/users", legacy_users, fast_users),
+        ("GET /games", legacy_games, fast_games),
+    ]
+
+
+async def add_solves(game, per_user: int):
+    # Résolutions insérées directement : leur préparation n'est pas mesurée
+    from database import SessionLocal
+    from models import SolveDB
+
+    keypoint_ids = sorted(game.answers)
+    rows = [
+        {"game_id": game.id, "user_id": user_id, "keypoint_id": keypoint_ids[(index + offset) % len(keypoint_ids)]}
+        for index, user_id in enumerate(game.user_ids)
+        for offset in range(min(per_user, len(keypoint_ids)))
+    ]
+    db = SessionLocal()
+    try:
+        db.execute(SolveDB.__table__.insert(), rows)
+        db.commit()
+    finally:
+        db.close()
+    return len(rows)
+
+
+async def timed(path, encode, db, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encode(await path(db))
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+async def measure(args) -> list:
+    import main
+    import serializers
+    from database import SessionLocal
+    from scenarios import create_game
+
+    await main.app.router.startup()
+    try:
+        game = await create_game(main.app, args.keypoints, args.users)
+        solves = await add_solves(game, args.solves)
+        print("partie %s : %d points clés, %d joueurs, %d résolutions" % (
+            game.id, args.keypoints, args.users, solves))
+        results = []
+        db = SessionLocal()
+        try:
+            for label, legacy, fast in routes(game.id, args.limit):
+                # Mêmes données sur les deux chemins (à l'ordre des listes imbriquées près)
+                assert len(await legacy(db)) == len(await fast(db)), label
+                row = [label, await timed(legacy, stdlib_dumps, db, args.repeat), await timed(fast, stdlib_dumps, db, args.repeat)]
+                if serializers.orjson is not None:
+                    row.append(await timed(fast, serializers.orjson.dumps, db, args.repeat))
+                results.append(row)
+        finally:
+            db.close()
+        return results
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    from run import prepare_app
+
+    parser = argparse.ArgumentParser(description="Temps de sérialisation par route, ancien et nouveau chemin")
+    parser.add_argument("--keypoints", type=int, default=500, help="points clés de la partie")
+    parser.add_argument("--users", type=int, default=2000, help="joueurs de la partie")
+    parser.add_argument("--solves", type=int, default=20, help="résolutions par joueur")
+    parser.add_argument("--limit", type=int, default=1000, help="taille de page des listings")
+    parser.add_argument("--repeat", type=int, default=20, help="mesures par route (médiane)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_app(directory)
+        results = asyncio.get_event_loop().run_until_complete(measure(args))
+
+    with_orjson = len(results[0]) == 4
+    header = ("route", "ORM (ms)", "lignes (ms)") + (("orjson (ms)",) if with_orjson else ())
+    print(("%-28s" + " %12s" * (len(header) - 1) + " %10s") % (header + ("gain",)))
+    for row in results:
+        label, timings = row[0], [duration * 1e3 for duration in row[1:]]
+        print(("%-28s" + " %12.2f" * len(timings) + " %9.1fx") % ((label,) + tuple(timings) + (timings[0] / timings[-1],)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Débit d'écriture total avec beaucoup de parties simultanées, selon le nombre de
+# bases (SHARDS). Plusieurs processus (comme les workers d'uvicorn) écrivent dans les
+# mêmes fichiers SQLite : chacun crée ses parties, puis tous envoient en même temps
+# les bonnes réponses de leurs joueurs. Une base neuve par configuration.
+#
+#   python bench/shard_throughput.py --shards 1,2,4,8 --processes 4 --games 32
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, os.pardir, "app")
+
+
+async def play(args) -> dict:
+    import main
+    from driver import ASGIClient
+    from scenarios import create_game
+
+    await main.app.router.startup()
+    try:
+        games = [await create_game(main.app, args.keypoints, args.players) for _ in range(args.games)]
+        client = ASGIClient(main.app)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        attempts = [
+            (game, user_id, keypoint_id)
+            for game in games for user_id in game.user_ids for keypoint_id in game.answers
+        ]
+        random.Random(args.seed).shuffle(attempts)
+        errors = 0
+
+        async def attempt(game, user_id: int, keypoint_id: int):
+            nonlocal errors
+            async with semaphore:
+                try:
+                    response = await client.post(
+                        "/games/%s/keypoints/%d/attempts" % (game.id, keypoint_id),
+                        params={"user_id": user_id, "answer": game.answers[keypoint_id]},
+                    )
+                    errors += response.status != 200
+                except Exception:
+                    # "database is locked" : le verrou d'écriture n'a pas été obtenu à temps
+                    errors += 1
+
+        # Départ commun à tous les processus
+        await asyncio.sleep(max(0.0, args.start_at - time.time()))
+        started = time.time()
+        await asyncio.gather(*(attempt(*arguments) for arguments in attempts))
+        return {"writes": len(attempts), "errors": errors, "started": started, "finished": time.time()}
+    finally:
+        await main.app.router.shutdown()
+
+
+def child(args):
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    os.chdir(args.directory)
+    print(json.dumps(asyncio.get_event_loop().run_until_complete(play(args))))
+
+
+def measure(shards: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, SHARDS=str(shards), DATABASE_URL="sqlite:///" + os.path.join(directory, "bench.db"))
+        env["PYTHONPATH"] = os.path.abspath(APP_DIR)
+        # Débit d'écriture brut : ni budgets par joueur, ni file d'admission
+        env.setdefault("RATE_LIMIT_ENABLED", "0")
+        env.setdefault("MAX_CONCURRENT_REQUESTS", "0")
+        subprocess.check_call([sys.executable, os.path.join(APP_DIR, "migrations.py")], env=env, cwd=directory, stdout=subprocess.DEVNULL)
+        # Le temps de création des parties n'est pas mesuré : départ fixé après
+        start_at = time.time() + args.setup_time
+        command = [
+            sys.executable, os.path.abspath(__file__), "--child", "--directory", directory, "--start-at", str(start_at),
+            "--games", str(args.games // args.processes), "--players", str(args.players),
+            "--keypoints", str(args.keypoints), "--concurrency", str(args.concurrency),
+        ]
+        processes = [
+            subprocess.Popen(command + ["--seed", str(index)], env=env, stdout=subprocess.PIPE)
+            for index in range(args.processes)
+        ]
+        results = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode:
+                sys.exit("Processus de mesure en échec (SHARDS=%d)" % shards)
+            results.append(json.loads(output.decode().strip().splitlines()[-1]))
+    duration = max(result["finished"] for result in results) - min(result["started"] for result in results)
+    if min(result["started"] for result in results) < start_at - 0.01:
+        sys.exit("--setup-time trop court : les parties n'étaient pas toutes créées au départ")
+    writes = sum(result["writes"] for result in results)
+    return {"writes": writes, "errors": sum(result["errors"] for result in results), "duration": duration}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Débit d'écriture selon le nombre de bases (SHARDS)")
+    parser.add_argument("--shards", default="1,2,4,8", help="configurations à mesurer, séparées par des virgules")
+    parser.add_argument("--processes", type=int, default=4, help="processus qui écrivent en même temps")
+    parser.add_argument("--games", type=int, default=32, help="parties jouées en même temps (réparties entre les processus)")
+    parser.add_argument("--players", type=int, default=20, help="joueurs par partie")
+    parser.add_argument("--keypoints", type=int, default=10, help="points clés par partie")
+    parser.add_argument("--concurrency", type=int, default=16, help="réponses envoyées en même temps par processus")
+    parser.add_argument("--setup-time", type=float, default=10.0, help="délai (en s) laissé aux processus pour créer leurs parties")
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    print("%-8s %10s %8s %10s %12s %8s" % ("SHARDS", "écritures", "erreurs", "durée (s)", "écritures/s", "gain"))
+    reference = None
+    for shards in [int(value) for value in args.shards.split(",")]:
+        result = measure(shards, args)
+        rate = result["writes"] / result["duration"]
+        reference = reference or rate
+        print("%-8d %10d %8d %10.2f %12.1f %7.2fx" % (
+            shards, result["writes"], result["errors"], result["duration"], rate, rate / reference,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from driver import percentile
+
+# Mesure le temps de démarrage d'un worker : lancement de l'interpréteur, import de
+# main, hooks de démarrage, puis première réponse (envoyée directement à l'application
+# ASGI, sans uvicorn ni réseau). Chaque essai est un nouveau processus.
+#
+#   python bench/startup.py --runs 20 --keypoints 10000 --max-ms 1500
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app")
+
+CHILD = r"""
+import asyncio, json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+
+async def run():
+    await main.app.router.startup()
+    t2 = time.perf_counter()
+    messages = []
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": "/",
+             "root_path": "", "query_string": b"", "headers": [], "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await main.app(scope, receive, send)
+    t3 = time.perf_counter()
+    await main.app.router.shutdown()
+    assert messages[0]["status"] == 200, messages[0]
+    return t2, t3
+
+t2, t3 = asyncio.get_event_loop().run_until_complete(run())
+print(json.dumps({"import": t1 - t0, "startup": t2 - t1, "first_request": t3 - t2}))
+"""
+
+
+def prepare_database(directory: str, keypoints: int, fixtures: bool) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = "sqlite:///" + os.path.join(directory, "bench.db")
+    env["PYTHONPATH"] = os.path.abspath(APP_DIR)
+    subprocess.check_call([sys.executable, os.path.join(APP_DIR, "migrations.py")], env=env, cwd=directory, stdout=subprocess.DEVNULL)
+    if fixtures:
+        subprocess.check_call([sys.executable, os.path.join(APP_DIR, "fixtures.py")], env=env, cwd=directory, stdout=subprocess.DEVNULL)
+    if keypoints:
+        # Une partie de la taille demandée, pour mesurer le chargement des index en mémoire
+        populate = (
+            "from database import SessionLocal, get_engine\n"
+            "from models import BulkGame\n"
+            "from transfer import create_game_bulk\n"
+            "get_engine()\n"
+            "n = %d\n"
+            "game = BulkGame(name='bench', visibility=True, time_start=0,\n"
+            "    keypoints=[dict(name='k%%d' %% i, points=10, description='d', solution='s',\n"
+            "                    latitude=50 + i * 1e-5, longitude=3.0) for i in range(n)],\n"
+            "    users=[dict(name='u%%d' %% i, points=i) for i in range(max(1, n // 10))])\n"
+            "create_game_bulk(SessionLocal(), game)\n" % keypoints
+        )
+        subprocess.check_call([sys.executable, "-c", populate], env=env, cwd=directory)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps de démarrage d'un worker ARriddle")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--keypoints", type=int, default=0, help="taille de la partie créée avant la mesure")
+    parser.add_argument("--fixtures", action="store_true", help="charge les parties de démonstration")
+    parser.add_argument("--max-ms", type=float, default=None, help="échoue si la médiane dépasse ce temps total")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = prepare_database(directory, args.keypoints, args.fixtures)
+        results = {"import": [], "startup": [], "first_request": [], "total": []}
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            output = subprocess.check_output([sys.executable, "-c", CHILD], env=env, cwd=directory)
+            results["total"].append(time.perf_counter() - started)
+            for phase, duration in json.loads(output.decode().strip().splitlines()[-1]).items():
+                results[phase].append(duration)
+
+    print("%-14s %10s %10s %10s" % ("phase (ms)", "médiane", "p95", "max"))
+    for phase, durations in results.items():
+        print("%-14s %10.1f %10.1f %10.1f" % (
+            phase,
+            statistics.median(durations) * 1000,
+            percentile(durations, 0.95) * 1000,
+            max(durations) * 1000,
+        ))
+    if args.max_ms is not None and statistics.median(results["total"]) * 1000 > args.max_ms:
+        print("Démarrage trop lent : médiane au-dessus de %.0f ms" % args.max_ms)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+# Vérification de plusieurs workers uvicorn sur les mêmes bases (coherence.py) : un
+# vrai serveur est lancé avec --workers N, puis des connexions HTTP persistantes, que
+# le noyau répartit entre les workers, écrivent sur l'une et relisent sur les autres :
+# classement, vérification des réponses, ETags, évènements SSE, puis débit de lecture.
+# Code de sortie 1 si une lecture est incohérente.
+#
+#   python bench/workers.py --workers 4 --coherence strict
+#   python bench/workers.py --workers 4 --coherence eventual --rounds 50
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(BENCH_DIR, os.pardir, "app"))
+
+WORKER_INFO = re.compile(r'coherence_worker_info\{worker="(\w+)"')
+
+
+class Connection:
+    # Connexion persistante : toutes ses requêtes sont servies par le même worker
+
+    def __init__(self, port: int):
+        self.http = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        self.worker = "?"
+
+    def request(self, method: str, path: str, params: Optional[dict] = None, headers: Optional[dict] = None):
+        if params:
+            path += "?" + urlencode(params)
+        self.http.request(method, path, headers=headers or {})
+        response = self.http.getresponse()
+        body = response.read()
+        content = None
+        if body and response.getheader("Content-Type", "").startswith("application/json"):
+            content = json.loads(body)
+        return response.status, response, content
+
+    def identify(self):
+        status, _, _ = self.request("GET", "/")
+        self.http.request("GET", "/metrics")
+        match = WORKER_INFO.search(self.http.getresponse().read().decode("utf-8"))
+        if match:
+            self.worker = match.group(1)
+
+
+class Failures:
+
+    def __init__(self):
+        self.messages: List[str] = []
+        self.lags: List[float] = []
+
+    def check(self, condition: bool, message: str):
+        if not condition:
+            self.messages.append(message)
+
+
+def eventually(read, timeout: float) -> Tuple[bool, float]:
+    # Relit jusqu'à obtenir la valeur attendue ; renvoie (succès, délai)
+    started = time.perf_counter()
+    while True:
+        if read():
+            return True, time.perf_counter() - started
+        if time.perf_counter() - started > timeout:
+            return False, timeout
+        time.sleep(0.005)
+
+
+def start_server(directory: str, args) -> subprocess.Popen:
+    environment = dict(
+        os.environ,
+        PYTHONPATH=APP_DIR,
+        DATABASE_URL="sqlite:///" + os.path.join(directory, "workers.db"),
+        SOLVE_JOURNAL=os.path.join(directory, "solves.journal"),
+        COHERENCE_LOCK=os.path.join(directory, "arriddle.lock"),
+        GAME_ARCHIVE_DIR=os.path.join(directory, "archives"),
+        WORKERS=str(args.workers),
+        COHERENCE=args.coherence,
+        COHERENCE_INTERVAL=str(args.interval),
+        METRICS_ENABLED="1",
+        RATE_LIMIT_ENABLED=os.getenv("RATE_LIMIT_ENABLED", "0"),
+    )
+    subprocess.run([sys.executable, os.path.join(APP_DIR, "migrations.py")], env=environment, cwd=directory, check=True,
+                   stdout=subprocess.DEVNULL)
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ], env=environment, cwd=directory)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", args.port), timeout=1).close()
+            # Le port est ouvert avant que chaque worker ait fini son démarrage
+            time.sleep(1 + 0.2 * args.workers)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Le serveur n'a pas démarré")
+
+
+def check_writes(connections: List[Connection], game_id: str, args, failures: Failures):
+    strict = args.coherence == "strict"
+    for round_index in range(args.rounds):
+        writer = connections[round_index % len(connections)]
+        readers = [connection for connection in connections if connection is not writer]
+
+        # Nouveau joueur : visible dans le classement (en mémoire) de tous les workers
+        _, _, user = writer.request("POST", "/games/%s/users" % game_id, {"name": "Joueur %d" % round_index, "points": round_index})
+        for reader in readers:
+            def has_user():
+                return reader.request("GET", "/games/%s/leaderboard/%d" % (game_id, user["id"]))[0] == 200
+            ok, lag = (has_user(), 0.0) if strict else eventually(has_user, args.timeout)
+            failures.lags.append(lag)
+            failures.check(ok, "joueur %d absent du classement du worker %s" % (user["id"], reader.worker))
+
+        # Nouveau point clé : la réponse est vérifiée par un autre worker (solutions en mémoire)
+        _, _, keypoint = writer.request("POST", "/games/%s/keypoints" % game_id, {
+            "name": "Point %d" % round_index, "description": "Question", "solution": "Réponse %d" % round_index,
+            "points": 10, "latitude": 50.6, "longitude": 3.1,
+        })
+        reader = readers[round_index % len(readers)]
+
+        def attempt():
+            status, _, result = reader.request(
+                "POST", "/games/%s/keypoints/%d/attempts" % (game_id, keypoint["id"]),
+                {"user_id": user["id"], "answer": "Réponse %d" % round_index},
+            )
+            return status == 200 and result["correct"]
+        ok = attempt() if strict else eventually(attempt, args.timeout)[0]
+        failures.check(ok, "point clé %d inconnu du worker %s" % (keypoint["id"], reader.worker))
+
+        # Partie complète (cache de réponses) : le joueur et sa résolution y figurent
+        for reader in readers:
+            def has_solve():
+                _, _, game = reader.request("GET", "/games/%s" % game_id)
+                solved = {entry["id"]: entry["keypoints_solved"] for entry in game["users"]}
+                return any(entry["id"] == keypoint["id"] for entry in solved.get(user["id"], []))
+            ok = has_solve() if strict else eventually(has_solve, args.timeout)[0]
+            failures.check(ok, "résolution absente de GET /games/%s sur le worker %s" % (game_id, reader.worker))
+
+
+def check_etags(connections: List[Connection], game_id: str, args, failures: Failures):
+    # Une fois le fil relu partout, l'ETag est le même sur tous les workers
+    time.sleep(10 * args.interval)
+    etags = {connection.request("GET", "/games/%s" % game_id)[1].getheader("ETag") for connection in connections}
+    failures.check(len(etags) == 1, "ETags différents selon le worker : %s" % sorted(etags))
+    etag = etags.pop()
+    for connection in connections:
+        status = connection.request("GET", "/games/%s" % game_id, headers={"If-None-Match": etag})[0]
+        failures.check(status == 304, "pas de 304 sur le worker %s" % connection.worker)
+
+
+def check_events(port: int, writer: Connection, game_id: str, args, failures: Failures):
+    # Un flux SSE par connexion : chacun doit recevoir le joueur créé sur le writer
+    streams = []
+    for _ in range(args.streams):
+        stream = http.client.HTTPConnection("127.0.0.1", port, timeout=args.timeout + 5)
+        stream.request("GET", "/games/%s/events" % game_id)
+        streams.append(stream.getresponse())
+    time.sleep(10 * args.interval)
+    _, _, user = writer.request("POST", "/games/%s/users" % game_id, {"name": "Abonné", "points": 0})
+    received = []
+
+    def listen(response):
+        deadline = time.time() + args.timeout
+        while time.time() < deadline:
+            line = response.fp.readline().decode("utf-8")
+            if line.startswith("data: "):
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "player_joined" and event["data"]["user_id"] == user["id"]:
+                    received.append(True)
+                    return
+
+    threads = [threading.Thread(target=listen, args=(response,)) for response in streams]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failures.check(len(received) == len(streams), "évènement reçu par %d flux sur %d" % (len(received), len(streams)))
+    for response in streams:
+        response.close()
+
+
+def read_throughput(port: int, game_id: str, args) -> float:
+    # GET /games/{id} en boucle sur args.connections connexions (une par thread)
+    counts = [0] * args.connections
+    deadline = time.time() + args.duration
+
+    def reader(index: int):
+        connection = Connection(port)
+        while time.time() < deadline:
+            connection.request("GET", "/games/%s" % game_id)
+            counts[index] += 1
+
+    threads = [threading.Thread(target=reader, args=(index,)) for index in range(args.connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / args.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cohérence et débit de lecture avec plusieurs workers uvicorn")
+    parser.add_argument("--workers", type=int, default=4, help="processus uvicorn")
+    parser.add_argument("--coherence", choices=["eventual", "strict"], default="strict")
+    parser.add_argument("--interval", type=float, default=0.05, help="COHERENCE_INTERVAL (s)")
+    parser.add_argument("--connections", type=int, default=16, help="connexions persistantes")
+    parser.add_argument("--rounds", type=int, default=20, help="écritures vérifiées")
+    parser.add_argument("--streams", type=int, default=8, help="flux SSE ouverts")
+    parser.add_argument("--timeout", type=float, default=5.0, help="délai maximal de propagation (s)")
+    parser.add_argument("--duration", type=float, default=5.0, help="durée de la mesure de débit (s)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    failures = Failures()
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(directory, args)
+        try:
+            connections = [Connection(args.port) for _ in range(args.connections)]
+            for connection in connections:
+                connection.identify()
+            workers: Dict[str, int] = {}
+            for connection in connections:
+                workers[connection.worker] = workers.get(connection.worker, 0) + 1
+            print("%d connexions sur %d workers : %s" % (
+                len(connections), len(workers), ", ".join("%s (%d)" % item for item in sorted(workers.items()))))
+
+            _, _, game = connections[0].request("POST", "/games", {
+                "name": "Workers %d" % time.time_ns(), "visibility": True, "time_start": int(time.time()),
+            })
+            check_writes(connections, game["id"], args, failures)
+            check_etags(connections, game["id"], args, failures)
+            check_events(args.port, connections[-1], game["id"], args, failures)
+            throughput = read_throughput(args.port, game["id"], args)
+        finally:
+            server.terminate()
+            server.wait()
+
+    if failures.lags:
+        lags = sorted(failures.lags)
+        print("délai de propagation : médiane %.1f ms, max %.1f ms" % (lags[len(lags) // 2] * 1e3, lags[-1] * 1e3))
+    print("débit de lecture GET /games/{id} : %.0f requêtes/s" % throughput)
+    for message in failures.messages:
+        print("Incohérence :", message)
+    print("OK" if not failures.messages else "%d incohérences" % len(failures.messages))
+    sys.exit(1 if failures.messages else 0)
+
+
+if __name__ == "__main__":
+    main()